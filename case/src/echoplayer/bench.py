@@ -0,0 +1,271 @@
+"""
+Benchmarks for the case build pipeline
+
+Each stage of the build is timed over a number of iterations and the
+results compared against a stored baseline. The run fails if the median
+time of any stage regresses by more than a threshold.
+
+Baselines are only meaningful on the machine that recorded them, so
+record a fresh one with --save before comparing on a new machine, or
+pass --save-missing to record one when there is none.
+"""
+
+import argparse
+import atexit
+import contextlib
+import copy
+import fnmatch
+import io
+import json
+import pathlib
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+from typing import Any
+
+# Baselines are looked up relative to the current directory, which is the
+# project directory when run by tox. The installed package can't be used,
+# as it is in site-packages unless installed in editable mode.
+BASELINE_DIR = pathlib.Path("bench")
+
+# Timer noise makes relative changes in very short stages meaningless,
+# so regressions smaller than this (in seconds) are always ignored
+MIN_REGRESSION = 0.005
+
+
+@dataclass
+class Benchmark:
+    name: str
+    fn: Callable[[], Any]
+
+
+def r1_rev1_benchmarks() -> list[Benchmark]:
+    from . import r1_rev1
+    from .csg import csg_options
+    from .main import export_file, write_mesh_file
+    from .tessellation import (
+        DEFAULT_MESH_QUALITY,
+        MESH_QUALITIES,
+        MESH_WRITERS,
+        tessellate,
+    )
+
+    params = r1_rev1.get_params()
+    datums = r1_rev1.get_datums(params)
+    pcb_ds = datums["pcb"]
+    ushell_ds = datums["ushell"]
+
+    wall_dist = abs(ushell_ds.pcb.button_vol_up_press_pos.X - ushell_ds.inner_wall_right.origin.X)
+
+    benchmarks = [
+        Benchmark("get_params", r1_rev1.get_params),
+        Benchmark("get_pcb_datums",
+                  lambda: r1_rev1.get_pcb_datums(params)),
+        Benchmark("get_upper_shell_datums",
+                  lambda: r1_rev1.get_upper_shell_datums(params, pcb_ds)),
+        Benchmark("get_lower_shell_datums",
+                  lambda: r1_rev1.get_lower_shell_datums(params, ushell_ds)),
+        Benchmark("get_battery_frame_datums",
+                  lambda: r1_rev1.get_battery_frame_datums(params, ushell_ds)),
+        Benchmark("make_upper_shell",
+                  lambda: r1_rev1.make_upper_shell(params, ushell_ds)),
+        Benchmark("make_lower_shell",
+                  lambda: r1_rev1.make_lower_shell(params, datums["lshell"])),
+        Benchmark("make_battery_frame",
+                  lambda: r1_rev1.make_battery_frame(params, datums["bframe"])),
+        Benchmark("make_dome_buttons",
+                  lambda: r1_rev1.make_dome_buttons(params, ushell_ds)),
+        Benchmark("make_side_button",
+                  lambda: r1_rev1.make_side_button(params, wall_dist, params.wall_thickness_side)),
+        Benchmark("make_pcb",
+                  lambda: r1_rev1.make_pcb(params.pcb, pcb_ds)),
+        Benchmark("make_battery",
+                  lambda: r1_rev1.make_battery(params)),
+        Benchmark("make_battery_connector",
+                  lambda: r1_rev1.make_battery_connector(params)),
+        Benchmark("make_side_pcb_button",
+                  lambda: r1_rev1.make_side_pcb_button(params)),
+        Benchmark("build", r1_rev1.build),
+    ]
+
+    # Compare the CSG planner with the booleans made before it: one per
+    # `-=` or `+=`, each with all of its tools, and without culling
+    def sequential_csg(fn: Callable[[], Any]) -> Callable[[], Any]:
+        def wrapper():
+            with csg_options(merge=False, cull=False):
+                return fn()
+        return wrapper
+
+    for bench in list(benchmarks):
+        if bench.name in ("make_upper_shell", "make_lower_shell", "make_battery_frame"):
+            benchmarks.append(Benchmark(f"{bench.name}_sequential_csg",
+                                        sequential_csg(bench.fn)))
+
+    # Exporters are benchmarked on the upper shell, which dominates
+    # export time. Tessellation is included for mesh formats, so each
+    # iteration needs a fresh copy of the shell without a triangulation.
+    upper_shell = r1_rev1.make_upper_shell(params, ushell_ds)
+    outdir = pathlib.Path(tempfile.mkdtemp(prefix="echoplayer-bench-"))
+    atexit.register(shutil.rmtree, outdir, ignore_errors=True)
+
+    def export_bench(fmt: str) -> Callable[[], Any]:
+        def fn():
+            shell = copy.deepcopy(upper_shell)
+            file_name = outdir / f"upper-shell.{fmt}"
+            if fmt in MESH_WRITERS:
+                mesh = tessellate(shell, MESH_QUALITIES[DEFAULT_MESH_QUALITY])
+                return write_mesh_file(mesh, file_name, fmt)
+            return export_file(shell, file_name)
+        return fn
+
+    for fmt in ("stl", "step", "gltf"):
+        benchmarks.append(Benchmark(f"export_{fmt}", export_bench(fmt)))
+
+    return benchmarks
+
+
+def run_benchmark(bench: Benchmark,
+                  iterations: int,
+                  warmup: int) -> dict[str, Any]:
+    times = []
+
+    # Builders print progress messages which would swamp the output
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(warmup + iterations):
+            start = time.perf_counter()
+            bench.fn()
+            elapsed = time.perf_counter() - start
+
+            if i >= warmup:
+                times.append(elapsed)
+
+    return {
+        "iterations": iterations,
+        "min": min(times),
+        "median": statistics.median(times),
+        "mean": statistics.mean(times),
+        "stdev": statistics.stdev(times) if len(times) > 1 else 0.0,
+    }
+
+def compare(results: dict[str, dict[str, Any]],
+            baseline: dict[str, dict[str, Any]],
+            threshold: float) -> list[str]:
+    """
+    Return the names of stages whose median time regressed by more than
+    `threshold` percent compared to the baseline
+    """
+
+    regressions = []
+
+    for name, res in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+
+        delta = res["median"] - base["median"]
+        if delta > MIN_REGRESSION and delta / base["median"] * 100 > threshold:
+            regressions.append(name)
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the case build pipeline")
+
+    case_group = parser.add_argument_group(title="Case variant selection")
+    case_group = case_group.add_mutually_exclusive_group(required=True)
+    case_group.add_argument("--r1-rev1", action="store_true",
+                            help="R1-Rev1 / R1-Rev1.1")
+
+    parser.add_argument("-n", "--iterations", metavar="N", type=int, default=5,
+                        help="Timed iterations per stage (default: 5)")
+    parser.add_argument("--warmup", metavar="N", type=int, default=1,
+                        help="Untimed warmup iterations per stage (default: 1)")
+    parser.add_argument("-k", "--filter", metavar="PATTERN", action="append",
+                        help="Only run stages matching glob PATTERN (may be repeated)")
+    parser.add_argument("--baseline", metavar="FILE", type=pathlib.Path,
+                        help="Baseline file (default: bench/<variant>.json in the current directory)")
+    parser.add_argument("--threshold", metavar="PCT", type=float, default=20,
+                        help="Fail if a stage is slower than the baseline by more than PCT percent (default: 20)")
+    parser.add_argument("--save", action="store_true",
+                        help="Save results as the new baseline instead of comparing")
+    parser.add_argument("--save-missing", action="store_true",
+                        help="Save results as the baseline if there is none, instead of failing")
+    parser.add_argument("--output", metavar="FILE", type=pathlib.Path,
+                        help="Also write results to FILE as JSON")
+
+    args = parser.parse_args()
+
+    if args.iterations < 1:
+        parser.error("need at least one iteration")
+
+    if args.r1_rev1:
+        benchmarks = r1_rev1_benchmarks()
+        variant = "r1-rev1"
+    else:
+        assert False, "Unknown case type"
+
+    baseline_file = args.baseline or BASELINE_DIR / f"{variant}.json"
+    if args.filter:
+        benchmarks = [b for b in benchmarks
+                      if any(fnmatch.fnmatchcase(b.name, pat) for pat in args.filter)]
+
+    baseline: dict[str, dict[str, Any]] = {}
+    if baseline_file.exists():
+        baseline = json.loads(baseline_file.read_text())["results"]
+
+    results: dict[str, dict[str, Any]] = {}
+
+    width = max([26] + [len(b.name) for b in benchmarks])
+    print(f"{'Stage':<{width}} {'Median (s)':>10} {'Min (s)':>9} {'Stdev':>7} {'Baseline':>9} {'Change':>8}")
+
+    for bench in benchmarks:
+        res = run_benchmark(bench, args.iterations, args.warmup)
+        results[bench.name] = res
+
+        line = f"{bench.name:<{width}} {res['median']:>10.4f} {res['min']:>9.4f} {res['stdev']:>7.4f}"
+        base = baseline.get(bench.name)
+        if base is not None:
+            change = (res["median"] - base["median"]) / base["median"] * 100
+            line += f" {base['median']:>9.4f} {change:>+7.1f}%"
+
+        print(line, flush=True)
+
+    data = {
+        "machine": {
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "python": platform.python_version(),
+        },
+        "results": results,
+    }
+
+    if args.output:
+        args.output.write_text(json.dumps(data, indent=2) + "\n")
+
+    if args.save or (args.save_missing and not baseline):
+        # Keep results of any stages that weren't run this time
+        data["results"] = {**baseline, **results}
+
+        baseline_file.parent.mkdir(parents=True, exist_ok=True)
+        baseline_file.write_text(json.dumps(data, indent=2) + "\n")
+        print(f"Saved baseline to {baseline_file}")
+        return
+
+    if not baseline:
+        sys.exit(f"No baseline found at {baseline_file}; run with --save to create one")
+
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"Regressed by more than {args.threshold}%: {', '.join(regressions)}")
+        sys.exit(1)
+
+    print("No regressions")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,280 @@
+from __future__ import annotations
+
+import dataclasses
+import hashlib
+import importlib.metadata
+import inspect
+import json
+import os
+import pathlib
+import tempfile
+import time
+import types
+import weakref
+from typing import TYPE_CHECKING, Any
+
+from . import kernel
+from .params import fingerprint
+from .serialize import ObjectData, SerializationError, Snapshot, dumps, loads
+
+if TYPE_CHECKING:
+    from .utils import DatumSet
+
+# Bump this when the on-disk layout changes
+CACHE_VERSION = 3
+
+# Subdirectory holding the inputs traced when each part was last built
+TRACES_DIR = "traces"
+
+
+def default_cache_dir() -> pathlib.Path:
+    base = os.environ.get("XDG_CACHE_HOME")
+    if base:
+        return pathlib.Path(base) / "echoplayer"
+
+    return pathlib.Path.home() / ".cache" / "echoplayer"
+
+
+def _code_names(code: types.CodeType) -> set[str]:
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= _code_names(const)
+
+    return names
+
+# inspect.getsource() is slow for classes, which it finds by parsing the
+# whole module. Functions and classes are replaced when their module is
+# reloaded, so the source of a given object never changes.
+_source_memo: weakref.WeakKeyDictionary[Any, str] = weakref.WeakKeyDictionary()
+
+def _getsource(obj: Any) -> str:
+    source = _source_memo.get(obj)
+    if source is None:
+        source = inspect.getsource(obj)
+        _source_memo[obj] = source
+
+    return source
+
+def source_hash(fn: Any) -> str:
+    """
+    Hash the source code of a function, together with the source of all
+    functions and classes from this package which it refers to (directly
+    or indirectly), and any plain data constants it uses.
+    """
+
+    package = __name__.rpartition(".")[0]
+    hasher = hashlib.sha256()
+    seen: set[int] = set()
+
+    def visit(obj: Any) -> None:
+        # Look through decorators to the original function
+        if inspect.isfunction(obj):
+            obj = inspect.unwrap(obj)
+
+        if id(obj) in seen:
+            return
+        seen.add(id(obj))
+
+        if isinstance(obj, (bool, int, float, str, tuple, list, dict)):
+            hasher.update(repr(obj).encode())
+            return
+
+        if not getattr(obj, "__module__", "").startswith(package):
+            return
+
+        if inspect.isfunction(obj):
+            functions = [obj]
+        elif inspect.isclass(obj):
+            functions = [f for f in vars(obj).values() if inspect.isfunction(f)]
+            functions += [p.fget for p in vars(obj).values()
+                          if isinstance(p, property) and inspect.isfunction(p.fget)]
+        else:
+            return
+
+        hasher.update(_getsource(obj).encode())
+
+        for f in functions:
+            for name in sorted(_code_names(f.__code__)):
+                if name in f.__globals__:
+                    visit(f.__globals__[name])
+
+    visit(fn)
+    return hasher.hexdigest()
+
+def datums_state(ds: DatumSet) -> dict[str, Any]:
+    """
+    Return all the values in a datum set, and the sets it references,
+    as plain data suitable for hashing
+    """
+
+    from .utils import datum_values, location_values
+
+    return {
+        "datums": {name: datum_values(d) for name, d in ds.datums.items()},
+        "aliases": ds.aliases,
+        "refs": {
+            name: {
+                "loc": location_values(ref.loc),
+                "datums": datums_state(ref.ref),
+            }
+            for name, ref in ds.refs.items() if ref.ref is not ds
+        },
+    }
+
+
+def _write_atomic(path: pathlib.Path, data: bytes) -> None:
+    # Write to a temporary file first, so that a partially written
+    # file is never visible under its final name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmpname = tempfile.mkstemp(dir=path.parent)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmpname, path)
+    except OSError:
+        pathlib.Path(tmpname).unlink(missing_ok=True)
+        raise
+
+
+@dataclasses.dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    stores: int = 0
+    bytes_read: int = 0
+    bytes_written: int = 0
+    load_time: float = 0
+    store_time: float = 0
+
+    def report(self) -> str:
+        return (f"Part cache: {self.hits} hits, {self.misses} misses, {self.stores} stores\n"
+                f"  read {self.bytes_read} bytes in {self.load_time:.3f}s\n"
+                f"  wrote {self.bytes_written} bytes in {self.store_time:.3f}s")
+
+
+class PartCache:
+    """
+    Content-addressed cache of built parts, stored on disk
+
+    Each entry is a file named by the part's key, holding the part's
+    objects in the format of the serialize module. Keys cover the source
+    code of the part's builder, and the parameters and datums it reads,
+    so stale entries are never matched and can simply be deleted.
+
+    Parts are traced when built (see parts.trace_part()), and the inputs
+    they read are kept alongside the entries. While a part's source and
+    the values of those inputs are unchanged, it is keyed on just those
+    values with inputs_key(), so changing a parameter it doesn't read
+    doesn't rebuild it. Parts without a trace are keyed on all the
+    parameters and datum sets they could read, with key().
+
+    The datum sets of a model are stored the same way for --datums-only,
+    so its report can be made without importing build123d.
+    """
+
+    path: pathlib.Path
+    stats: CacheStats
+
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+        self.stats = CacheStats()
+
+    def key(self,
+            builder: Any,
+            params: Any,
+            datums: dict[str, DatumSet],
+            datum_names: tuple[str, ...]) -> str:
+        state = {
+            "version": CACHE_VERSION,
+            "build123d": importlib.metadata.version("build123d"),
+            # Fuzzy booleans can change the geometry; other kernel
+            # settings only change how fast it's made
+            "fuzzy": kernel.options.fuzzy,
+            "params": fingerprint(params),
+            "datums": {name: datums_state(datums[name]) for name in datum_names},
+            "source": source_hash(builder),
+        }
+
+        data = json.dumps(state, sort_keys=True, default=repr)
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    def inputs_key(self, inputs: dict[str, Any]) -> str:
+        """
+        Return the key of a part given its traced inputs, as stored by
+        store_trace()
+        """
+
+        state = {
+            "version": CACHE_VERSION,
+            "build123d": importlib.metadata.version("build123d"),
+            "fuzzy": kernel.options.fuzzy,
+            "inputs": inputs,
+        }
+
+        data = json.dumps(state, sort_keys=True, default=repr)
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    def _trace(self, builder: str) -> pathlib.Path:
+        # Builders are named "module:function", which isn't a safe file name
+        return self.path / TRACES_DIR / f"{hashlib.sha256(builder.encode()).hexdigest()[:32]}.json"
+
+    def load_trace(self, builder: str) -> dict[str, Any] | None:
+        """
+        Load the inputs traced when the part with `builder` was last
+        built, or return None
+        """
+
+        try:
+            return json.loads(self._trace(builder).read_text())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def store_trace(self, builder: str, inputs: dict[str, Any]) -> None:
+        _write_atomic(self._trace(builder), (json.dumps(inputs) + "\n").encode())
+
+    def _entry(self, key: str) -> pathlib.Path:
+        return self.path / key[:2] / f"{key}.bin"
+
+    def load(self, key: str) -> list[ObjectData] | None:
+        """
+        Load the packed objects stored under `key`, or return None
+        """
+
+        start = time.perf_counter()
+
+        try:
+            data = self._entry(key).read_bytes()
+            records = loads(data).objects
+        except (FileNotFoundError, SerializationError):
+            # Unreadable entries are rebuilt and replaced
+            self.stats.misses += 1
+            return None
+
+        self.stats.hits += 1
+        self.stats.bytes_read += len(data)
+        self.stats.load_time += time.perf_counter() - start
+        return records
+
+    def store(self, key: str, records: list[ObjectData]) -> None:
+        start = time.perf_counter()
+
+        data = dumps(Snapshot(objects=records))
+        _write_atomic(self._entry(key), data)
+
+        self.stats.stores += 1
+        self.stats.bytes_written += len(data)
+        self.stats.store_time += time.perf_counter() - start
+
+    def load_datums(self, key: str) -> Snapshot | None:
+        """
+        Load the datum sets stored under `key`, or return None
+        """
+
+        try:
+            return loads(self._entry(key).read_bytes())
+        except (FileNotFoundError, SerializationError):
+            return None
+
+    def store_datums(self, key: str, snapshot: Snapshot) -> None:
+        _write_atomic(self._entry(key), dumps(snapshot))
@@ -0,0 +1,116 @@
+"""
+Declarative constraints on model parameters
+
+Constraints are checked on the plain parameter values before any datums
+or geometry are computed, so impossible parameter combinations are
+reported in milliseconds instead of failing halfway through a build.
+All violations are collected and reported together.
+
+This module does not depend on build123d.
+"""
+
+import dataclasses
+import fnmatch
+import operator
+from collections.abc import Callable, Iterator, Mapping
+from dataclasses import dataclass
+from typing import Any, TypeAlias
+
+Quantity: TypeAlias = Callable[[Any], float] | float
+
+OPS: dict[str, Callable[[float, float], bool]] = {
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+
+class ConstraintError(ValueError):
+    violations: list[str]
+
+    def __init__(self, violations: list[str]):
+        self.violations = violations
+        super().__init__("parameter constraints violated:\n" +
+                         "\n".join(f"  {v}" for v in violations))
+
+
+def _eval(quantity: Quantity, params: Any) -> float:
+    if callable(quantity):
+        return quantity(params)
+
+    return quantity
+
+def _fmt(value: float) -> str:
+    return f"{value:.6g}"
+
+
+@dataclass
+class Constraint:
+    """
+    A relation "lhs op rhs" between two quantities, each of which is
+    either a constant or a function of the parameters
+    """
+
+    description: str
+    lhs: Quantity
+    op: str
+    rhs: Quantity
+
+    def violations(self, params: Any) -> list[str]:
+        lhs = _eval(self.lhs, params)
+        rhs = _eval(self.rhs, params)
+
+        if OPS[self.op](lhs, rhs):
+            return []
+
+        return [f"{self.description}: need {_fmt(lhs)} {self.op} {_fmt(rhs)}"]
+
+@dataclass
+class FieldConstraint:
+    """
+    A relation "field op limit" which must hold for every numeric
+    parameter whose dotted path (eg. "lcd.cover_thickness") matches
+    the glob pattern
+    """
+
+    pattern: str
+    op: str
+    limit: float
+
+    def violations(self, params: Any) -> list[str]:
+        return [f"{path}: need {_fmt(value)} {self.op} {_fmt(self.limit)}"
+                for path, value in numeric_fields(params)
+                if fnmatch.fnmatchcase(path, self.pattern)
+                and not OPS[self.op](value, self.limit)]
+
+
+def numeric_fields(value: Any, path: str = "") -> Iterator[tuple[str, float]]:
+    """
+    Yield the dotted path and value of every number in a parameter tree
+    """
+
+    def child(name: Any) -> str:
+        return f"{path}.{name}" if path else str(name)
+
+    if isinstance(value, bool):
+        return
+    if isinstance(value, (int, float)):
+        yield path, value
+    elif dataclasses.is_dataclass(value) and not isinstance(value, type):
+        for f in dataclasses.fields(value):
+            yield from numeric_fields(getattr(value, f.name), child(f.name))
+    elif isinstance(value, Mapping):
+        for k, v in value.items():
+            yield from numeric_fields(v, child(k))
+
+def check_constraints(constraints: list[Constraint | FieldConstraint],
+                      params: Any) -> None:
+    """
+    Check all constraints and raise ConstraintError listing every
+    violation, if there are any
+    """
+
+    violations = [v for c in constraints for v in c.violations(params)]
+    if violations:
+        raise ConstraintError(violations)
@@ -0,0 +1,178 @@
+"""
+Planning of boolean operations on shapes
+
+Shell builders describe the tools cut from and fused to a shape with a
+Csg plan instead of chains of `-=` and `+=`, which run one boolean per
+tool on an ever more complex shape. When the plan is run, consecutive
+operations of the same kind are merged into a single OCCT boolean with
+all of their tools as arguments, and cutting tools whose bounding box
+misses the shape are dropped beforehand. Booleans use the OCCT settings
+of the kernel module like any other.
+
+Operations are applied in the order they were added, so the result is
+the same as applying them one at a time.
+"""
+
+import contextlib
+import dataclasses
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass
+from typing import Any, TypeAlias
+
+from build123d import Shape
+from build123d.topology import SkipClean
+from OCP.BRepAlgoAPI import BRepAlgoAPI_Cut, BRepAlgoAPI_Fuse  # type: ignore
+
+from . import oprecord
+from .profiling import stage
+
+# Iterables aren't typed further, as build123d often types placed shapes
+# (eg. `Pos(...) * shape`) as a union with locations and planes
+ToolLike: TypeAlias = Shape | Iterable[Any] | None
+
+
+@dataclass
+class CsgOptions:
+    # Merge consecutive operations of the same kind into one boolean.
+    # Without this, each cut() or fuse() is a boolean of its own, with
+    # all of its tools, as `-=` and `+=` with the same tools would be.
+    merge: bool = True
+
+    # Drop cutting tools whose bounding box misses the shape
+    cull: bool = True
+
+
+options = CsgOptions()
+
+
+@dataclass
+class CsgCall:
+    """
+    The tools of one cut() or fuse(), and the model code which called it
+    when recording operations
+    """
+
+    tools: list[Shape]
+    caller: str | None = None
+
+
+@contextlib.contextmanager
+def csg_options(**changes: Any) -> Iterator[None]:
+    """
+    Temporarily change the CSG options
+    """
+
+    global options
+
+    saved = options
+    options = dataclasses.replace(options, **changes)
+    try:
+        yield
+    finally:
+        options = saved
+
+
+def _flatten(tools: tuple[ToolLike, ...]) -> list[Shape]:
+    shapes: list[Shape] = []
+    for tool in tools:
+        if tool is None:
+            continue
+        for t in [tool] if isinstance(tool, Shape) else tool:
+            if t is not None:
+                assert isinstance(t, Shape), f"bad CSG tool {type(t)}"
+                shapes += t.get_top_level_shapes()
+
+    return shapes
+
+def _bbox(shape: Shape) -> Any:
+    # Boxes that aren't optimal are larger, so culling with them never
+    # drops a tool which touches the shape
+    box = shape.bounding_box(optimal=False).wrapped
+    assert box is not None
+    return box
+
+
+class Csg:
+    """
+    A shape with a list of cuts and fuses to apply to it
+    """
+
+    name: str
+    shape: Shape
+    # Kind of each run of operations, and the calls making it
+    steps: list[tuple[str, list[CsgCall]]]
+
+    def __init__(self, shape: Shape, name: str = "csg"):
+        self.name = name
+        self.shape = shape
+        self.steps = []
+
+    def _add(self, kind: str, tools: tuple[ToolLike, ...]) -> "Csg":
+        shapes = _flatten(tools)
+        if not shapes:
+            return self
+
+        # Booleans are made by result(), so recorded ones are attributed
+        # to the model code adding them here
+        call = CsgCall(shapes, oprecord.call_site() if oprecord.recording_dir() else None)
+
+        if self.steps and self.steps[-1][0] == kind:
+            self.steps[-1][1].append(call)
+        else:
+            self.steps.append((kind, [call]))
+
+        return self
+
+    def cut(self, *tools: ToolLike) -> "Csg":
+        """
+        Cut tools (shapes or iterables of shapes) from the shape
+        """
+        return self._add("cut", tools)
+
+    def fuse(self, *tools: ToolLike) -> "Csg":
+        """
+        Fuse tools (shapes or iterables of shapes) to the shape
+        """
+        return self._add("fuse", tools)
+
+    def _boolean(self, shape: Shape, kind: str, tools: list[Shape]) -> Shape:
+        op = BRepAlgoAPI_Cut() if kind == "cut" else BRepAlgoAPI_Fuse()
+        result = shape._bool_op((shape,), tools, op)
+
+        # As done by Shape.__add__()
+        if kind == "fuse" and SkipClean.clean and isinstance(result, Shape):
+            result = result.clean()
+
+        assert isinstance(result, Shape), "boolean produced several shapes"
+        return result
+
+    def result(self) -> Shape:
+        """
+        Apply all operations and return the resulting shape
+        """
+
+        shape = self.shape
+
+        for kind, calls in self.steps:
+            if options.merge:
+                callers = [c.caller for c in calls if c.caller is not None]
+                calls = [CsgCall([t for c in calls for t in c.tools],
+                                 ", ".join(dict.fromkeys(callers)) or None)]
+
+            for call in calls:
+                tools = call.tools
+                culled = 0
+                if kind == "cut" and options.cull:
+                    bbox = _bbox(shape)
+                    kept = [t for t in tools if not bbox.IsOut(_bbox(t))]
+                    culled = len(tools) - len(kept)
+                    tools = kept
+
+                if not tools:
+                    continue
+
+                with (stage(f"{self.name}: {kind}", "csg", tools=len(tools), culled=culled),
+                      oprecord.called_from(call.caller)):
+                    shape = self._boolean(shape, kind, tools)
+
+        return shape
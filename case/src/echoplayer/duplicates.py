@@ -0,0 +1,166 @@
+"""
+Detection of congruent objects for exporting
+
+Objects are compared by properties of their BREP which don't depend on
+where they are placed: volume, area, moments of inertia, topology
+counts, and the bounding box in their principal axes. A handedness term
+keeps mirror images apart, since a left part can't be printed in place
+of a right one. Tessellations aren't used, so finding duplicates
+doesn't need meshes.
+
+Congruent objects are exported once, with the number of copies listed
+in the export manifest, so the model doesn't need to mark which copies
+to export.
+"""
+
+import hashlib
+import json
+from dataclasses import dataclass, field
+
+import numpy as np
+from OCP.Bnd import Bnd_Box  # type: ignore
+from OCP.BRepBndLib import BRepBndLib  # type: ignore
+from OCP.BRepGProp import BRepGProp  # type: ignore
+from OCP.gp import gp_Ax3, gp_Dir, gp_Trsf  # type: ignore
+from OCP.GProp import GProp_GProps  # type: ignore
+from OCP.TopLoc import TopLoc_Location  # type: ignore
+
+from .utils import Object
+
+# Relative difference allowed between the properties of copies, which
+# differ by rounding noise when made in different places
+RELATIVE_TOLERANCE = 1e-6
+
+# Significant digits kept of each property in fingerprints
+DIGITS = 6
+
+
+@dataclass
+class ExportGroup:
+    """
+    Congruent objects, which are exported as the first one
+    """
+
+    fingerprint: str
+    objects: list[Object] = field(default_factory=list)
+
+    @property
+    def name(self) -> str:
+        return self.objects[0].name
+
+    @property
+    def names(self) -> list[str]:
+        """
+        Names of every copy: instances of instanced objects, or objects
+        """
+        return [name for obj in self.objects for name in obj.instances or [obj.name]]
+
+    @property
+    def count(self) -> int:
+        return len(self.names)
+
+
+def _round(value: float) -> float:
+    return float(f"{value:.{DIGITS}g}")
+
+@dataclass
+class Features:
+    """
+    Properties of an object which are the same for congruent objects
+    however they are placed
+    """
+
+    topology: tuple[int, ...]
+    handedness: int
+    # Volume, area, principal moments and extents
+    values: np.ndarray
+
+    def matches(self, other: "Features") -> bool:
+        return (self.topology == other.topology and
+                self.handedness == other.handedness and
+                bool(np.allclose(self.values, other.values,
+                                 rtol=RELATIVE_TOLERANCE, atol=0)))
+
+    def fingerprint(self) -> str:
+        """
+        Hash of the rounded properties, to name the objects' group. Only
+        used as a name, since rounding can tell apart copies which
+        matches() doesn't.
+        """
+
+        data = {
+            "topology": self.topology,
+            "handedness": self.handedness,
+            "values": [_round(v) for v in self.values],
+        }
+        return hashlib.sha256(json.dumps(data).encode()).hexdigest()
+
+def features(obj: Object) -> Features:
+    """
+    Return the properties of the object's compound to compare it by
+    """
+
+    shape = obj.compound
+    assert shape is not None and shape.wrapped is not None
+
+    props = GProp_GProps()
+    BRepGProp.VolumeProperties_s(shape.wrapped, props)
+    center = props.CentreOfMass()
+
+    inertia = props.MatrixOfInertia()
+    matrix = np.array([[inertia.Value(r, c) for c in range(1, 4)] for r in range(1, 4)])
+    moments, axes = np.linalg.eigh(matrix)
+
+    # Bounding box in the principal axes, as a right-handed system
+    frame = gp_Ax3(center, gp_Dir(*axes[:, 2]), gp_Dir(*axes[:, 0]))
+    trsf = gp_Trsf()
+    trsf.SetTransformation(frame)
+    box = Bnd_Box()
+    BRepBndLib.AddOptimal_s(shape.wrapped.Moved(TopLoc_Location(trsf)), box, False, False)
+    corners = np.array(box.Get()).reshape(2, 3)
+    extents = corners[1] - corners[0]
+
+    # Point each axis towards the side the box reaches further to. If it
+    # reaches as far both ways, the axis has no direction to tell a
+    # mirror image by.
+    lopsided = np.abs(corners[1] + corners[0])
+    signs = np.where(corners[1] + corners[0] < 0, -1, 1)
+    symmetric = bool(np.any(lopsided <= RELATIVE_TOLERANCE * np.max(extents)))
+
+    # Axes with equal moments can be anywhere in their plane, so their
+    # extents don't describe the object
+    for i, j in ((0, 1), (0, 2), (1, 2)):
+        if np.isclose(moments[i], moments[j], rtol=RELATIVE_TOLERANCE):
+            extents[i] = extents[j] = 0
+            symmetric = True
+
+    # A mirror image only differs in handedness, which is meaningless
+    # if the object is symmetric about one of its principal planes
+    handedness = 0 if symmetric else int(np.prod(signs))
+
+    return Features(
+        topology = (len(shape.solids()), len(shape.faces()),
+                    len(shape.edges()), len(shape.vertices())),
+        handedness = handedness,
+        values = np.concatenate([[props.Mass(), shape.area], moments, extents]),
+    )
+
+def group_duplicates(objects: list[Object]) -> list[ExportGroup]:
+    """
+    Group congruent objects, in order of their first object
+    """
+
+    groups: list[tuple[Features, ExportGroup]] = []
+    for obj in objects:
+        if obj.compound is None:
+            continue
+
+        obj_features = features(obj)
+        for group_features, group in groups:
+            if obj_features.matches(group_features):
+                group.objects.append(obj)
+                break
+        else:
+            groups.append((obj_features, ExportGroup(obj_features.fingerprint(), [obj])))
+
+    return [group for _, group in groups]
@@ -0,0 +1,154 @@
+"""
+OpenCASCADE threading and boolean settings
+
+The settings are applied process-wide with apply_kernel_options(), so
+they cover every boolean, fillet and tessellation made while building,
+including those made through build123d's shape algebra, and they are
+passed on to pool workers.
+
+This module can be imported without build123d, which is only loaded
+once the settings are applied.
+"""
+
+from __future__ import annotations
+
+import argparse
+import dataclasses
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from build123d import Shape
+
+
+@dataclass
+class KernelOptions:
+    # Number of threads in the OCCT thread pool, or 0 for the OCCT
+    # default of one per logical processor
+    threads: int = 0
+
+    # Run booleans in parallel mode
+    boolean_parallel: bool = True
+
+    # Fuzzy tolerance for booleans, or 0 for exact booleans
+    fuzzy: float = 0
+
+    # Tessellate faces in parallel
+    mesh_parallel: bool = True
+
+options = KernelOptions()
+
+_bool_op: Any = None
+
+
+class _SerialOperation:
+    """
+    Wraps a boolean operation so that build123d's request to run it in
+    parallel mode is ignored
+    """
+
+    def __init__(self, operation: Any):
+        self._operation = operation
+
+    def SetRunParallel(self, _flag: bool) -> None:
+        self._operation.SetRunParallel(False)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._operation, name)
+
+def _tuned_bool_op(self: Shape, args: Any, tools: Any, operation: Any) -> Any:
+    if options.fuzzy > 0:
+        operation.SetFuzzyValue(options.fuzzy)
+    if not options.boolean_parallel:
+        operation = _SerialOperation(operation)
+
+    return _bool_op(self, args, tools, operation)
+
+def apply_kernel_options(new_options: KernelOptions) -> None:
+    """
+    Make `new_options` the settings of this process
+    """
+
+    global options, _bool_op
+
+    from build123d import Shape
+    from OCP.BOPAlgo import BOPAlgo_Options  # type: ignore
+    from OCP.OSD import OSD_Parallel, OSD_ThreadPool  # type: ignore
+
+    options = new_options
+
+    # Algorithms parallelized with OSD_Parallel (eg. meshing) then use
+    # the OCCT thread pool, rather than TBB when OCCT is built with it
+    OSD_Parallel.SetUseOcctThreads_s(True)
+    OSD_ThreadPool.DefaultPool_s().Init(options.threads or -1)
+
+    # Default for boolean algorithms not run through Shape._bool_op()
+    BOPAlgo_Options.SetParallelMode_s(options.boolean_parallel)
+
+    # Every build123d boolean goes through Shape._bool_op(), which always
+    # asks for parallel mode, so hook it rather than each call site
+    if _bool_op is None:
+        _bool_op = Shape._bool_op
+        Shape._bool_op = _tuned_bool_op # type: ignore[method-assign]
+
+def effective_settings() -> dict[str, Any]:
+    """
+    Return the settings in effect, as recorded in profiles
+    """
+
+    from OCP.OSD import OSD_Parallel, OSD_ThreadPool  # type: ignore
+
+    return {
+        **dataclasses.asdict(options),
+        "threads": OSD_ThreadPool.DefaultPool_s().NbThreads(),
+        "logical_processors": OSD_Parallel.NbLogicalProcessors_s(),
+        "occt_threads": OSD_Parallel.ToUseOcctThreads_s(),
+    }
+
+def mesh(shape: Shape, tolerance: float, angular_tolerance: float) -> None:
+    """
+    Tessellate a shape, as Shape.mesh() does but with parallel meshing
+    set by the options
+
+    Any triangulation already on the shape is replaced. OCCT can only
+    tell whether one meets the linear deflection, not the angular one,
+    so reusing it could leave a coarser mesh than asked for.
+    """
+
+    from OCP.BRepMesh import BRepMesh_IncrementalMesh  # type: ignore
+    from OCP.BRepTools import BRepTools  # type: ignore
+
+    if shape.wrapped is None:
+        raise ValueError("Cannot mesh an empty shape")
+
+    BRepTools.Clean_s(shape.wrapped)
+    BRepMesh_IncrementalMesh(shape.wrapped, tolerance, True,
+                             angular_tolerance, options.mesh_parallel)
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    group = parser.add_argument_group(title="OpenCASCADE")
+    group.add_argument("--occt-threads", metavar="N", type=int, default=0,
+                       help="Number of OCCT threads in each process (default: one per logical processor)")
+    group.add_argument("--boolean-parallel", action=argparse.BooleanOptionalAction, default=True,
+                       help="Run booleans in parallel mode (default: yes)")
+    group.add_argument("--fuzzy", metavar="TOL", type=float, default=0,
+                       help="Fuzzy tolerance for booleans (default: exact booleans)")
+    group.add_argument("--mesh-parallel", action=argparse.BooleanOptionalAction, default=True,
+                       help="Tessellate faces in parallel (default: yes)")
+
+def options_from_args(parser: argparse.ArgumentParser,
+                      args: argparse.Namespace) -> KernelOptions:
+    """
+    Return the options given by the arguments added by add_arguments()
+    """
+
+    if args.occt_threads < 0:
+        parser.error("--occt-threads must not be negative")
+
+    if args.fuzzy < 0:
+        parser.error("--fuzzy must not be negative")
+
+    return KernelOptions(threads = args.occt_threads,
+                         boolean_parallel = args.boolean_parallel,
+                         fuzzy = args.fuzzy,
+                         mesh_parallel = args.mesh_parallel)
@@ -1,19 +1,60 @@
+from __future__ import annotations
+
 import argparse
+import dataclasses
+import importlib
+import json
+import os
 import pathlib
 import sys
-from typing import Any
-
-from .utils import Object, datum_transform
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import TYPE_CHECKING, Any
+
+from . import kernel, oprecord, profiling
+from .cache import PartCache, default_cache_dir
+from .constraints import ConstraintError, check_constraints
+from .parts import (
+    DatumGraph,
+    PartInputs,
+    PartSelectionError,
+    affected_parts,
+    load_cached_datums,
+    load_dependencies,
+    select_parts,
+    store_cached_datums,
+)
+from .profiling import Profiler, set_profiler, stage
+from .serialize import Snapshot, snapshot_datums
+from .tessellation import (
+    DEFAULT_MESH_QUALITY,
+    MESH_QUALITIES,
+    MESH_WRITERS,
+    MeshQuality,
+)
+from .watch import watch
+
+# build123d takes seconds to import, so it's only loaded once a model is
+# actually built. Nothing else imported here may depend on it.
+if TYPE_CHECKING:
+    from build123d import Compound
+
+    from .parts import Part
+    from .tessellation import Mesh
+    from .utils import Object
 
 
 def gen_ocp_objlist(objects: list[Object],
                     show_datums: bool = False) -> dict[str, Any]:
-    tree = {}
+    tree: dict[str, Any] = {}
 
     for o in objects:
         om: dict[str, Any] = {}
 
-        if not o.renderable:
+        # Instances are references to the same geometry, which the
+        # viewer recognizes and only tessellates once
+        if o.instances:
+            tree.update(o.placed())
             continue
 
         if o.compound:
@@ -22,8 +63,10 @@ def gen_ocp_objlist(objects: list[Object],
         if o.datums and show_datums:
             datums: list[dict[str, Any]] = []
 
-            for n, dt in o.datums.datums.items():
-                datums.append({n: datum_transform(dt, o.datums_xform)})
+            # Transform the whole set at once, as arrays
+            xformed = o.datums.arrays().transform(o.datums_xform)
+            for n, dt in xformed.to_datums().items():
+                datums.append({n: dt})
 
             om["datums"] = datums
 
@@ -43,38 +86,336 @@ def ocp_vscode_show(objects: list[Object],
     objlist = gen_ocp_objlist(objects, show_datums=show_datums)
 
     set_defaults(reset_camera=Camera.KEEP, axes=True, axes0=True, grid=True)
-    show(objlist, names=["root"])
+
+    # The viewer still converts the shapes itself, but reuses the
+    # triangulation left on them by the mesh stage wherever it is at
+    # least as fine as the viewer's own
+    with stage("ocp_vscode show", "tessellate"):
+        show(objlist, names=["root"])
+
+def exported_objects(objects: list[Object], export_all: bool) -> list[Object]:
+    return [obj for obj in objects
+            if obj.compound is not None and (obj.manufacturable or export_all)]
+
+def tessellate_brep(brep: bytes,
+                    color: tuple[float, ...] | None,
+                    label: str,
+                    name: str,
+                    quality: MeshQuality) -> tuple[Mesh, list[dict[str, Any]]]:
+    from .tessellation import tessellate
+    from .utils import compound_from_brep
+
+    compound = compound_from_brep(brep, color=color, label=label)
+    with stage(f"tessellate {name}", "tessellate"):
+        mesh = tessellate(compound, quality)
+
+    return mesh, profiling.take_worker_records()
+
+def mesh_objects(objects: list[Object],
+                 quality: MeshQuality,
+                 jobs: int = 1) -> dict[int, Mesh]:
+    """
+    Tessellate each object once, for the mesh writers, duplicate detection
+    and the viewer. Meshes are keyed by the id() of their object, since
+    names needn't be unique.
+
+    With several jobs, objects are tessellated in worker processes. They
+    are sent as binary BREP, which is exact, so the meshes are the same
+    as with one job. The triangulations stay in the workers, so the
+    viewer meshes the shapes again.
+    """
+
+    from .tessellation import tessellate
+
+    objects = [obj for obj in objects if obj.compound is not None]
+
+    meshes = {}
+    if jobs <= 1:
+        for obj in objects:
+            assert obj.compound is not None
+            with stage(f"tessellate {obj.name}", "tessellate"):
+                meshes[id(obj)] = tessellate(obj.compound, quality)
+
+        return meshes
+
+    from .utils import compound_to_brep
+
+    profiler = profiling.get_profiler()
+
+    with ProcessPoolExecutor(max_workers=jobs,
+                             initializer=init_export_worker,
+                             initargs=(profiler is not None, kernel.options)) as pool:
+        futures = {}
+        for obj in objects:
+            compound = obj.compound
+            assert compound is not None
+            color = compound.color.to_tuple() if compound.color else None
+            future = pool.submit(tessellate_brep,
+                                 compound_to_brep(compound),
+                                 color, compound.label, obj.name, quality)
+            futures[future] = obj
+
+        for future in as_completed(futures):
+            mesh, stages = future.result()
+            if profiler is not None:
+                profiler.merge(stages)
+
+            meshes[id(futures[future])] = mesh
+
+    return meshes
+
+def write_mesh_file(mesh: Mesh,
+                    file_name: pathlib.Path,
+                    output_format: str) -> tuple[float, int]:
+    """
+    Write a mesh file, and return the time taken and its size in bytes
+    """
+
+    start = time.perf_counter()
+
+    with stage(f"export {file_name.name}", "export"):
+        size = MESH_WRITERS[output_format](mesh, file_name)
+
+    return time.perf_counter() - start, size
+
+def mesh_report(rows: list[tuple[str, Mesh, int]]) -> str:
+    """
+    Return a table of the deflections, triangle count, tessellation time
+    and file size of each part
+    """
+
+    name_width = max([len(name) for name, _, _ in rows] + [4])
+
+    header = (f"{'Part':<{name_width}}  {'Tolerance':>9} {'Angle':>6} "
+              f"{'Triangles':>9} {'Size (KiB)':>10} {'Mesh (s)':>8}")
+    lines = [header]
+
+    for name, mesh, size in rows:
+        lines.append(f"{name:<{name_width}}  {mesh.tolerance:>9.3g} {mesh.angular_tolerance:>6.2g} "
+                     f"{mesh.triangle_count:>9} {size / 1024:>10.1f} {mesh.elapsed:>8.3f}")
+
+    lines.append(f"{'Total':<{name_width}}  {'':>9} {'':>6} "
+                 f"{sum(m.triangle_count for _, m, _ in rows):>9} "
+                 f"{sum(size for _, _, size in rows) / 1024:>10.1f} "
+                 f"{sum(m.elapsed for _, m, _ in rows):>8.3f}")
+
+    return "\n".join(lines)
+
+def export_file(compound: Compound, file_name: pathlib.Path) -> float:
+    """
+    Write a STEP file, and return the time taken. Mesh formats are
+    written from meshes, with write_mesh_file().
+    """
+
+    from build123d import export_step
+
+    start = time.perf_counter()
+
+    with stage(f"export {file_name.name}", "export"):
+        export_step(compound, file_name)
+
+    return time.perf_counter() - start
+
+def export_file_brep(brep: bytes,
+                     color: tuple[float, ...] | None,
+                     label: str,
+                     file_name: pathlib.Path) -> tuple[float, list[dict[str, Any]]]:
+    from .utils import compound_from_brep
+
+    compound = compound_from_brep(brep, color=color, label=label)
+    elapsed = export_file(compound, file_name)
+
+    return elapsed, profiling.take_worker_records()
+
+def init_export_worker(profile: bool, kernel_options: kernel.KernelOptions) -> None:
+    profiling.init_worker(profile)
+    kernel.apply_kernel_options(kernel_options)
 
 def export_objects(objects: list[Object],
+                   meshes: dict[int, Mesh],
                    output_dir: pathlib.Path,
                    output_format: str,
                    output_prefix: str,
-                   export_all: bool = False):
-    from build123d import (
-        export_gltf,
-        export_step,
-        export_stl,
-    )
-
-    exporters = {
-        "gltf": export_gltf,
-        "step": export_step,
-        "stp": export_step,
-        "stl": export_stl,
-    }
+                   export_all: bool = False,
+                   mesh_store: pathlib.Path | None = None,
+                   part_names: dict[str, str] | None = None,
+                   only: list[str] | None = None,
+                   jobs: int = 1):
+    from .duplicates import group_duplicates
 
     output_dir.mkdir(parents=True, exist_ok=True)
 
-    for obj in objects:
-        if not obj.exportable or obj.compound is None:
-            continue
-        if not obj.manufacturable and not export_all:
-            continue
+    start = time.perf_counter()
+
+    # Congruent objects are only exported once
+    with stage("find duplicates", "export"):
+        groups = group_duplicates(exported_objects(objects, export_all))
+
+    work: list[tuple[pathlib.Path, Object]] = []
+    manifest = []
+    for group in groups:
+        file_name = output_dir / f"{output_prefix}-{group.name}.{output_format}"
+        work.append((file_name, group.objects[0]))
+        manifest.append({
+            "file": file_name.name,
+            "count": group.count,
+            "copies": group.names,
+        })
+
+        if group.count > 1:
+            print(f"{file_name.name} is used {group.count} times: {', '.join(group.names)}")
+
+    if output_format in MESH_WRITERS:
+        # Already tessellated, so writing is quick and done here
+        report = []
+        for file_name, obj in work:
+            print(f"Writing {file_name}")
+            elapsed, size = write_mesh_file(meshes[id(obj)], file_name, output_format)
+            print(f"Wrote {file_name} in {elapsed:.2f}s")
+            report.append((obj.name, meshes[id(obj)], size))
+
+        print(mesh_report(report))
+    elif jobs <= 1:
+        for file_name, obj in work:
+            assert obj.compound is not None
+            print(f"Writing {file_name}")
+            elapsed = export_file(obj.compound, file_name)
+            print(f"Wrote {file_name} in {elapsed:.2f}s")
+    else:
+        from .utils import compound_to_brep
+
+        # Shapes are handed to the workers as BREP, which doesn't carry
+        # color or label so those are passed along separately
+        profiler = profiling.get_profiler()
+
+        with ProcessPoolExecutor(max_workers=jobs,
+                                 initializer=init_export_worker,
+                                 initargs=(profiler is not None, kernel.options)) as pool:
+            futures = {}
+            for file_name, obj in work:
+                compound = obj.compound
+                assert compound is not None
+                print(f"Writing {file_name}")
+                color = compound.color.to_tuple() if compound.color else None
+                future = pool.submit(export_file_brep,
+                                     compound_to_brep(compound),
+                                     color, compound.label, file_name)
+                futures[future] = file_name
+
+            for future in as_completed(futures):
+                elapsed, stages = future.result()
+                if profiler is not None:
+                    profiler.merge(stages)
+
+                print(f"Wrote {futures[future]} in {elapsed:.2f}s")
+
+    if mesh_store is not None:
+        from .meshstore import write_mesh_store
+
+        with stage("mesh store", "export"):
+            written, removed = write_mesh_store(mesh_store, groups, meshes,
+                                                part_names or {}, only)
+        print(f"Stored {written} meshes in {mesh_store} ({len(groups) - written} unchanged, "
+              f"{removed} stale files removed)")
+
+    manifest_file = output_dir / f"{output_prefix}-manifest.json"
+    manifest_file.write_text(json.dumps({"format": output_format, "files": manifest}, indent=2) + "\n")
+    print(f"Wrote {manifest_file}")
+
+    print(f"Exported {len(work)} files in {time.perf_counter() - start:.2f}s")
+
+def write_profile(profiler: Profiler | None,
+                  path: pathlib.Path | None) -> None:
+    if profiler is None or path is None:
+        return
+
+    profiler.write_chrome_trace(path)
+    print(profiler.summary())
+    print(f"Wrote profile to {path}")
+
+def list_parts(parts: list[Part], params: Any) -> None:
+    for part in parts:
+        print(part.name)
+        for name in part.object_names(params):
+            if name != part.name:
+                print(f"  {name}")
+
+def print_params(params: Any) -> None:
+    print(json.dumps(dataclasses.asdict(params), indent=2))
+
+def datums_report(params: Any, snapshot: Snapshot) -> dict[str, Any]:
+    """
+    Return every datum and box dimension of the datum sets, and every
+    derived parameter, as plain data
+    """
+
+    from .params import derived_values
+    from .serialize import AXIS, PLANE, POINT
+
+    kinds = {POINT: "point", AXIS: "axis", PLANE: "plane"}
+    report: dict[str, Any] = {"datums": {}, "boxes": {}, "params": {}}
+
+    for set_name, index in snapshot.named.items():
+        ds = snapshot.sets[index]
+        for name in snapshot.datum_names(set_name):
+            report["datums"][f"{set_name}.{name}"] = {
+                "kind": kinds[snapshot.datum_kind(set_name, name)],
+                "values": snapshot.datum_values(set_name, name),
+            }
+
+        for prefix, box in ds.boxes.items():
+            report["boxes"][f"{set_name}.{prefix}"] = {
+                axis: float(box[1, i] - box[0, i]) for i, axis in enumerate("xyz")
+            }
+
+    report["params"] = dict(derived_values(params))
+    return report
+
+def print_datums_report(report: dict[str, Any]) -> None:
+    def fmt(value: Any) -> str:
+        if isinstance(value, float):
+            return f"{value + 0.0:.6g}"
+        if isinstance(value, (tuple, list)):
+            return "(" + ", ".join(fmt(v) for v in value) + ")"
+        return str(value)
+
+    def table(title: str, rows: list[tuple[str, ...]]) -> None:
+        if not rows:
+            return
+
+        width = max(len(row[0]) for row in rows)
+        print(title)
+        for name, *cols in rows:
+            print(f"  {name:<{width}}  {'  '.join(cols)}")
+        print()
+
+    table("Datums", [(name, f"{d['kind']:<5}", fmt(d["values"]))
+                     for name, d in report["datums"].items()])
+    table("Box dimensions", [(name, " x ".join(fmt(box[axis]) for axis in "xyz"))
+                             for name, box in report["boxes"].items()])
+    table("Derived parameters", [(name, fmt(value))
+                                 for name, value in report["params"].items()])
+
+def write_datums_report(report: dict[str, Any],
+                        json_path: pathlib.Path | None) -> None:
+    if json_path:
+        json_path.write_text(json.dumps(report, indent=2) + "\n")
+        print(f"Wrote {len(report['datums'])} datums to {json_path}")
+    else:
+        print_datums_report(report)
 
-        file_name = output_dir / f"{output_prefix}-{obj.name}.{output_format}"
+def print_affected_parts(affected: dict[str, list[str]],
+                         parts: list[Part]) -> None:
+    for name, changes in affected.items():
+        shown = ", ".join(changes[:5])
+        if len(changes) > 5:
+            shown += f" and {len(changes) - 5} more"
+        print(f"{name}: {shown}")
 
-        print(f"Writing {file_name}")
-        exporters[output_format](obj.compound, file_name) # type: ignore
+    unaffected = [part.name for part in parts if part.name not in affected]
+    print(f"{len(affected)} of {len(parts)} parts need rebuilding")
+    if unaffected:
+        print(f"Unaffected: {', '.join(unaffected)}")
 
 def show_warning():
     print("""
@@ -91,6 +432,24 @@ def main():
     case_group.add_argument("--r1-rev1", action="store_true",
                             help="R1-Rev1 / R1-Rev1.1")
 
+    parser.add_argument("--jobs", "-j", metavar="N", type=int, default=1,
+                        help="Number of worker processes used for building and exporting (default: 1)")
+
+    parser.add_argument("--only", metavar="PARTS", action="append",
+                        help="Only build the parts producing the comma-separated parts or objects (glob patterns allowed); "
+                             "whole parts are built, but only the matching objects are shown or exported")
+
+    parser.add_argument("--list-parts", action="store_true",
+                        help="List the parts and objects of the model, then exit")
+    parser.add_argument("--print-params", action="store_true",
+                        help="Print the model parameters as JSON, then exit")
+    parser.add_argument("--datums-only", action="store_true",
+                        help="Only compute datums, and print them with box dimensions and derived parameters")
+    parser.add_argument("--datums-json", metavar="FILE", type=pathlib.Path,
+                        help="With --datums-only, write the datums to FILE as JSON instead of printing them")
+    parser.add_argument("--watch", action="store_true",
+                        help="Rebuild whenever the model source code changes")
+
     viz_group = parser.add_argument_group(title="Visualization")
     viz_group.add_argument("--ocp-vscode", action="store_true",
                                   help="Visualize with ocp_vscode")
@@ -106,6 +465,35 @@ def main():
                               help="Set export format (default: .stl)")
     export_group.add_argument("--export-all", action="store_true",
                               help="Also export mockup objects that are not manufacturable")
+    export_group.add_argument("--mesh-quality", default=DEFAULT_MESH_QUALITY,
+                              choices=tuple(MESH_QUALITIES),
+                              help=f"Set tessellation quality of mesh formats and the viewer (default: {DEFAULT_MESH_QUALITY})")
+    export_group.add_argument("--mesh-store", metavar="DIR", type=pathlib.Path,
+                              help="Also store the mesh of each exported part in DIR as memory-mappable arrays")
+
+    kernel.add_arguments(parser)
+
+    profile_group = parser.add_argument_group(title="Profiling")
+    profile_group.add_argument("--profile", metavar="FILE", type=pathlib.Path,
+                               help="Profile the build and write a Chrome trace to FILE")
+
+    record_group = parser.add_argument_group(title="Operation recording")
+    record_group.add_argument("--record-ops", metavar="DIR", type=pathlib.Path,
+                              help="Record every boolean, fillet, chamfer, extrude and loft to DIR for echoplayer-replay")
+
+    deps_group = parser.add_argument_group(title="Dependency tracing")
+    deps_group.add_argument("--save-deps", metavar="FILE", type=pathlib.Path,
+                            help="Record the parameters and datums read by each part and save them to FILE")
+    deps_group.add_argument("--affected-by", metavar="FILE", type=pathlib.Path,
+                            help="Print the parts affected by changes since FILE was saved, then exit")
+
+    cache_group = parser.add_argument_group(title="Caching")
+    cache_group.add_argument("--cache-dir", metavar="DIR", type=pathlib.Path,
+                             help=f"Set part cache directory (default: {default_cache_dir()})")
+    cache_group.add_argument("--no-cache", action="store_true",
+                             help="Always rebuild parts and don't update the cache")
+    cache_group.add_argument("--cache-stats", action="store_true",
+                             help="Print part cache statistics")
 
     test_group = parser.add_argument_group()
     test_group.add_argument("--test", action="store_true",
@@ -113,32 +501,215 @@ def main():
 
     args = parser.parse_args()
 
-    print("Building model...")
+    profiler = None
+    if args.profile:
+        profiler = Profiler()
+        profiler.metadata["argv"] = sys.argv
+        profiler.metadata["python"] = sys.version
+        profiler.metadata["cpu_count"] = os.cpu_count()
+        set_profiler(profiler)
 
-    if args.r1_rev1:
-        from . import r1_rev1
+    # Test builds need to exercise the builders, so never use the cache
+    cache = None
+    if not args.no_cache and not args.test:
+        cache = PartCache(args.cache_dir or default_cache_dir())
 
-        if args.export:
-            show_warning()
+    only = None
+    if args.only:
+        only = [pat for arg in args.only for pat in arg.split(",") if pat]
+
+    if args.watch and args.test:
+        parser.error("--watch can't be used with --test")
+
+    if args.datums_json and not args.datums_only:
+        parser.error("--datums-json requires --datums-only")
 
-        objects = r1_rev1.build()
+    if args.mesh_store and not args.export:
+        parser.error("--mesh-store requires --export")
+
+    kernel_options = kernel.options_from_args(parser, args)
+
+    if args.r1_rev1:
+        from . import r1_rev1_params as model_params
+        model_name = "r1_rev1"
         file_prefix = "echoplayer-r1-rev1"
     else:
         assert False, "Unknown case type"
 
-    if args.test:
-        print("Success!")
-        sys.exit(0)
+    params = model_params.get_params()
 
-    if args.ocp_vscode:
-        ocp_vscode_show(objects, show_datums=args.show_datums)
+    if args.list_parts:
+        list_parts(model_params.PARTS, params)
+        return
+
+    if args.print_params:
+        print_params(params)
+        return
+
+    # Check parameters and selection before spending time loading build123d
+    try:
+        check_constraints(model_params.CONSTRAINTS, params)
+    except ConstraintError as e:
+        sys.exit(f"{parser.prog}: error: {e}")
+
+    if only is not None:
+        try:
+            select_parts(model_params.PARTS, params, only)
+        except PartSelectionError as e:
+            parser.error(str(e))
+
+    deps: dict[str, PartInputs] | None = None
+    if args.affected_by:
+        try:
+            deps = load_dependencies(args.affected_by)
+        except (OSError, ValueError) as e:
+            sys.exit(f"{parser.prog}: error: {e}")
 
     if args.export:
-        export_objects(objects,
-                       output_dir = args.export,
-                       output_format = args.export_format,
-                       output_prefix = file_prefix,
-                       export_all = args.export_all)
+        show_warning()
+
+    # Datum sets stored by an earlier run can be reported without
+    # importing the model, which needs build123d
+    if args.datums_only and not args.watch and cache is not None:
+        start = time.perf_counter()
+        with stage("datums", "datums"):
+            snapshot = load_cached_datums(cache, model_name, params)
+
+        if snapshot is not None:
+            write_datums_report(datums_report(params, snapshot), args.datums_json)
+            print(f"Loaded datums from cache in {time.perf_counter() - start:.3f}s")
+            write_profile(profiler, args.profile)
+            return
+
+    # Reloaded in place by watch mode, so look up build() each time
+    model = importlib.import_module(f".{model_name}", __package__)
+
+    # Keep datums between rebuilds, so only those affected by an edit
+    # are recomputed
+    datum_graph = DatumGraph() if args.watch else None
+
+    if deps is not None:
+        datums = model.get_datums(params)
+        print_affected_parts(affected_parts(model_params.PARTS, params, datums, deps),
+                             model_params.PARTS)
+        return
+
+    # Watch mode reloads the model modules and those they use, so
+    # functions and exceptions of those modules are looked up on every
+    # rebuild rather than imported once above
+
+    def datums_only() -> None:
+        from .parts import report_datum_changes
+
+        params = model.get_params()
+        check_constraints(model.CONSTRAINTS, params)
+
+        graph = datum_graph if datum_graph is not None else DatumGraph()
+
+        start = time.perf_counter()
+        with stage("datums", "datums"):
+            datums = graph.resolve(model.DATUM_SETS, params)
+            if datum_graph is not None:
+                report_datum_changes(datum_graph, model_params.PARTS)
+        elapsed = time.perf_counter() - start
+
+        # In dependency order, rather than the order they were computed
+        snapshot = snapshot_datums({spec.name: datums[spec.name]
+                                    for spec in model.DATUM_SETS})
+        if cache is not None:
+            store_cached_datums(cache, model_name, graph, snapshot)
+
+        write_datums_report(datums_report(params, snapshot), args.datums_json)
+        print(f"Computed datums in {elapsed:.3f}s")
+        write_profile(profiler, args.profile)
+
+    def rebuild() -> None:
+        if profiler is not None:
+            # Only keep the stages of the latest build
+            profiler.take_records()
+
+        if args.datums_only:
+            datums_only()
+            return
+
+        print("Building model...")
+
+        kernel.apply_kernel_options(kernel_options)
+        if profiler is not None:
+            profiler.metadata["kernel"] = kernel.effective_settings()
+
+        if args.record_ops:
+            oprecord.start_recording(args.record_ops)
+
+        from . import parts
+        from .utils import resolution_stats
+
+        deps: dict[str, PartInputs] | None = {} if args.save_deps else None
+
+        try:
+            objects = model.build(jobs=args.jobs, cache=cache, only=only,
+                                  datum_graph=datum_graph, deps=deps)
+        except parts.PartSelectionError as e:
+            # Only possible if a rebuild in watch mode changed the parts,
+            # so keep watching for a fix
+            print(f"{parser.prog}: error: {e}")
+            return
+
+        if args.record_ops:
+            count = len(oprecord.load_records(args.record_ops))
+            print(f"Recorded {count} operations to {args.record_ops}")
+
+        if deps is not None:
+            parts.save_dependencies(args.save_deps, deps)
+            print(f"Wrote dependencies of {len(deps)} parts to {args.save_deps}")
+
+        if args.cache_stats:
+            if cache is not None:
+                print(cache.stats.report())
+            print(resolution_stats.report())
+
+        if profiler is not None:
+            profiler.metadata["datum_resolution"] = dataclasses.asdict(resolution_stats)
+
+        if args.test:
+            write_profile(profiler, args.profile)
+            print("Success!")
+            sys.exit(0)
+
+        # Everything shown or exported as a mesh is tessellated once, up
+        # front. The viewer reuses triangulations left on the shapes, so
+        # they are only made by workers when exporting.
+        meshes: dict[int, Mesh] = {}
+        quality = MESH_QUALITIES[args.mesh_quality]
+        if args.ocp_vscode:
+            meshes = mesh_objects(objects, quality)
+        elif args.export and (args.export_format in MESH_WRITERS or args.mesh_store):
+            meshes = mesh_objects(exported_objects(objects, args.export_all), quality,
+                                  jobs = args.jobs)
+
+        if args.ocp_vscode:
+            ocp_vscode_show(objects, show_datums=args.show_datums)
+
+        if args.export:
+            params = model.get_params()
+            part_names = {name: part.name for part in model.PARTS
+                          for name in part.object_names(params)}
+            export_objects(objects, meshes,
+                           output_dir = args.export,
+                           output_format = args.export_format,
+                           output_prefix = file_prefix,
+                           export_all = args.export_all,
+                           mesh_store = args.mesh_store,
+                           part_names = part_names,
+                           only = only,
+                           jobs = args.jobs)
+
+        write_profile(profiler, args.profile)
+
+    rebuild()
+
+    if args.watch:
+        watch(rebuild)
 
 if __name__ == '__main__':
     pass
@@ -0,0 +1,283 @@
+"""
+On-disk store of exported meshes, for other tools to memory-map
+
+Each exported part is stored under its fingerprint from the duplicates
+module, as `<fingerprint>.json`, a header, and two `.npy` files named
+after a hash of their contents:
+
+- `<fingerprint>-<hash>-vertices.npy`: float32 vertex coordinates in mm,
+  (n, 3)
+- `<fingerprint>-<hash>-triangles.npy`: uint32 vertex indices, (m, 3),
+  counter-clockwise seen from outside
+
+The header gives the dtype, shape and data offset of each array, so they
+can be opened with `np.memmap` without parsing the `.npy` header (or with
+`np.load(..., mmap_mode="r")`), as load_mesh() does. `index.json` maps
+the name of every part and copy to its fingerprint, and to the model
+part and object it came from.
+
+Fingerprints don't depend on where a part is placed, but the stored
+vertices do, so a part is written again whenever its arrays change.
+New arrays get new file names, and are written before the header is
+atomically replaced, so a header always refers to complete arrays
+which match each other. Arrays superseded by the new header are
+removed afterwards.
+
+Each export replaces the index entries of everything it covers: all
+parts, or those selected with --only. Meshes and arrays which the index
+no longer refers to are then removed, so the store only holds what the
+latest exports produced.
+
+This module only needs numpy, so other tools can use it without
+build123d.
+"""
+
+from __future__ import annotations
+
+import fnmatch
+import hashlib
+import io
+import json
+import os
+import pathlib
+import tempfile
+from typing import TYPE_CHECKING, Any
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from .duplicates import ExportGroup
+    from .tessellation import Mesh
+
+STORE_FORMAT = 1
+
+INDEX_FILE = "index.json"
+
+# Array dtypes, as stored
+VERTEX_DTYPE = np.dtype("<f4")
+INDEX_DTYPE = np.dtype("<u4")
+
+
+class MeshStoreError(Exception):
+    pass
+
+
+def _write_atomic(path: pathlib.Path, data: bytes) -> None:
+    fd, tmpname = tempfile.mkstemp(dir=path.parent)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmpname, path)
+    except OSError:
+        pathlib.Path(tmpname).unlink(missing_ok=True)
+        raise
+
+def _encode_array(fingerprint: str, kind: str, array: np.ndarray) -> tuple[dict[str, Any], bytes]:
+    """
+    Return the header entry and `.npy` contents of an array
+    """
+
+    buf = io.BytesIO()
+    np.lib.format.write_array(buf, np.ascontiguousarray(array), allow_pickle=False)
+    data = buf.getvalue()
+    digest = hashlib.sha256(data).hexdigest()[:16]
+
+    info = {
+        "file": f"{fingerprint}-{digest}-{kind}.npy",
+        "dtype": array.dtype.str,
+        "shape": list(array.shape),
+        "offset": len(data) - array.nbytes,
+    }
+    return info, data
+
+def _read_json(path: pathlib.Path) -> Any:
+    try:
+        return json.loads(path.read_text())
+    except FileNotFoundError:
+        return None
+    except ValueError as e:
+        raise MeshStoreError(f"{path}: {e}") from e
+
+def header_path(store_dir: pathlib.Path, fingerprint: str) -> pathlib.Path:
+    return store_dir / f"{fingerprint}.json"
+
+def store_mesh(store_dir: pathlib.Path,
+               fingerprint: str,
+               mesh: Mesh,
+               name: str,
+               copies: list[str]) -> bool:
+    """
+    Store a part's mesh under its fingerprint, unless the same mesh
+    already is. Return whether it was written.
+    """
+
+    header_file = header_path(store_dir, fingerprint)
+
+    try:
+        existing = _read_json(header_file)
+    except MeshStoreError:
+        existing = None
+
+    arrays = {}
+    contents = {}
+    for kind, array in (("vertices", mesh.vertices.astype(VERTEX_DTYPE)),
+                        ("triangles", mesh.triangles.astype(INDEX_DTYPE))):
+        arrays[kind], contents[arrays[kind]["file"]] = _encode_array(fingerprint, kind, array)
+
+    header = {
+        "format": STORE_FORMAT,
+        "fingerprint": fingerprint,
+        "name": name,
+        "copies": copies,
+        "units": "mm",
+        "tolerance": mesh.tolerance,
+        "angular_tolerance": mesh.angular_tolerance,
+        "arrays": arrays,
+    }
+
+    if existing == header and all((store_dir / file).exists() for file in contents):
+        return False
+
+    # Array files are named after their contents, so any existing one
+    # already holds the same data
+    for file, data in contents.items():
+        if not (store_dir / file).exists():
+            _write_atomic(store_dir / file, data)
+
+    _write_atomic(header_file, (json.dumps(header, indent=2) + "\n").encode())
+
+    if isinstance(existing, dict):
+        for info in existing.get("arrays", {}).values():
+            if info.get("file") not in contents:
+                (store_dir / info["file"]).unlink(missing_ok=True)
+
+    return True
+
+def _covered(name: str, source: list[str] | None, only: list[str] | None) -> bool:
+    """
+    Return whether an index entry is for a part or copy selected by the
+    --only patterns, given the names of the model part and object it
+    came from if they're known
+    """
+
+    if only is None:
+        return True
+
+    names = [name] + (source or [])
+    return any(fnmatch.fnmatchcase(n, pat) for n in names for pat in only)
+
+def _prune(store_dir: pathlib.Path, fingerprints: set[str]) -> int:
+    """
+    Remove the headers of meshes not in `fingerprints`, and the arrays
+    no remaining header refers to. Return the number of files removed.
+    """
+
+    referenced: set[str] = set()
+    removed = 0
+    for header_file in store_dir.glob("*.json"):
+        if header_file.name == INDEX_FILE:
+            continue
+
+        if header_file.stem not in fingerprints:
+            header_file.unlink(missing_ok=True)
+            removed += 1
+            continue
+
+        try:
+            header = _read_json(header_file)
+        except MeshStoreError:
+            header = None
+        if isinstance(header, dict):
+            referenced.update(info.get("file") for info in header.get("arrays", {}).values())
+
+    for array_file in store_dir.glob("*.npy"):
+        if array_file.name not in referenced:
+            array_file.unlink(missing_ok=True)
+            removed += 1
+
+    return removed
+
+def write_mesh_store(store_dir: pathlib.Path,
+                     groups: list[ExportGroup],
+                     meshes: dict[int, Mesh],
+                     part_names: dict[str, str],
+                     only: list[str] | None = None) -> tuple[int, int]:
+    """
+    Store the mesh of each group of exported objects, given the mesh of
+    each object keyed by its id(), and update the index. `part_names`
+    maps the name of each object and copy to the model part building
+    it, and `only` gives the --only patterns of the export, if any.
+
+    Index entries of the parts and copies the export covered are
+    replaced, so those which are no longer built are removed too, and
+    then meshes and arrays which the index doesn't refer to any more
+    are removed. Return the number of meshes written and of files
+    removed.
+    """
+
+    store_dir.mkdir(parents=True, exist_ok=True)
+
+    written = 0
+    for group in groups:
+        mesh = meshes[id(group.objects[0])]
+        if store_mesh(store_dir, group.fingerprint, mesh, group.name, group.names):
+            written += 1
+
+    # Parts not covered by this export (eg. with --only) stay in the
+    # index. Each entry keeps the names of the model part and object it
+    # came from, to know which entries a later export covers.
+    data = _read_json(store_dir / INDEX_FILE)
+    index = load_index(store_dir)
+    sources = data.get("sources", {}) if isinstance(data, dict) else {}
+    for name in list(index):
+        if _covered(name, sources.get(name), only):
+            del index[name]
+            sources.pop(name, None)
+
+    for group in groups:
+        for obj in group.objects:
+            for name in obj.instances or [obj.name]:
+                index[name] = group.fingerprint
+                sources[name] = [part_names.get(name, ""), obj.name]
+
+    data = {
+        "format": STORE_FORMAT,
+        "parts": dict(sorted(index.items())),
+        "sources": {name: sources[name] for name in sorted(index) if name in sources},
+    }
+    _write_atomic(store_dir / INDEX_FILE, (json.dumps(data, indent=2) + "\n").encode())
+
+    removed = _prune(store_dir, set(index.values()))
+
+    return written, removed
+
+def load_index(store_dir: pathlib.Path) -> dict[str, str]:
+    """
+    Return the fingerprint of each part and copy in the store
+    """
+
+    data = _read_json(store_dir / INDEX_FILE)
+    if data is None:
+        return {}
+    if data.get("format") != STORE_FORMAT:
+        raise MeshStoreError(f"{store_dir / INDEX_FILE}: unsupported format {data.get('format')}")
+
+    return dict(data["parts"])
+
+def load_mesh(store_dir: pathlib.Path, fingerprint: str) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Memory-map the vertices and triangles stored under `fingerprint`
+    """
+
+    header_file = header_path(store_dir, fingerprint)
+    header = _read_json(header_file)
+    if header is None:
+        raise MeshStoreError(f"No mesh stored for {fingerprint}")
+    if header.get("format") != STORE_FORMAT:
+        raise MeshStoreError(f"{header_file}: unsupported format {header.get('format')}")
+
+    def open_array(info: dict[str, Any]) -> np.ndarray:
+        return np.memmap(store_dir / info["file"], dtype=np.dtype(info["dtype"]), mode="r",
+                         offset=info["offset"], shape=tuple(info["shape"]))
+
+    return open_array(header["arrays"]["vertices"]), open_array(header["arrays"]["triangles"])
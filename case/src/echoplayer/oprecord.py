@@ -0,0 +1,446 @@
+"""
+Recording and replay of single kernel operations
+
+While recording, every boolean, fillet, chamfer, extrude and loft is
+written to a directory, with one subdirectory per part: its operands
+as binary BREP, and as JSON its arguments, the face and edge counts of its
+operands and result, its duration, and the line of model code that
+made it. `echoplayer-replay` then re-runs any recorded operation on its
+own, so a slow operation can be benchmarked and bisected outside of the
+full build.
+
+Operations are recorded at the level of build123d's topology methods,
+so booleans made with shape algebra and by Csg plans are recorded the
+same way. When one recorded operation calls another, only the outer one
+is recorded.
+
+This module can be imported without build123d.
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import dataclasses
+import fnmatch
+import functools
+import importlib
+import json
+import pathlib
+import shutil
+import statistics
+import sys
+import time
+from collections.abc import Callable, Iterator
+from typing import TYPE_CHECKING, Any
+
+from . import kernel
+
+if TYPE_CHECKING:
+    from build123d import Shape
+
+# Bump this when the record format changes; older records are rejected
+RECORD_VERSION = 2
+
+# Recorded methods, by the name used in records
+HOOKS = {
+    "Shape._bool_op": "build123d.topology.shape_core",
+    "Mixin3D.fillet": "build123d.topology.three_d",
+    "Mixin3D.chamfer": "build123d.topology.three_d",
+    "Face.fillet_2d": "build123d.topology.two_d",
+    "Face.chamfer_2d": "build123d.topology.two_d",
+    "Wire.fillet_2d": "build123d.topology.one_d",
+    "Wire.chamfer_2d": "build123d.topology.one_d",
+    "Solid.extrude": "build123d.topology.three_d",
+    "Solid.extrude_taper": "build123d.topology.three_d",
+    "Solid.make_loft": "build123d.topology.three_d",
+}
+
+# Kinds of boolean, by OCCT operation class
+BOOLEAN_KINDS = {
+    "BRepAlgoAPI_Cut": "cut",
+    "BRepAlgoAPI_Fuse": "fuse",
+    "BRepAlgoAPI_Common": "common",
+    "BRepAlgoAPI_Section": "section",
+    "BRepAlgoAPI_Splitter": "split",
+}
+
+# Source files skipped when looking for the model code making an operation
+_SKIPPED_SOURCES = {str(pathlib.Path(__file__).with_name(name))
+                    for name in ("csg.py", "kernel.py", "oprecord.py")}
+
+
+class ReplayError(ValueError):
+    pass
+
+
+def _kind(method: str, args: tuple[Any, ...]) -> str:
+    if method == "Shape._bool_op":
+        operation = args[3] if len(args) > 3 else None
+        return BOOLEAN_KINDS.get(type(operation).__name__, "boolean")
+
+    name = method.partition(".")[2]
+    if name == "make_loft":
+        return "loft"
+
+    return name.partition("_")[0]
+
+def _encode(value: Any, shapes: list[Shape]) -> Any:
+    from build123d import Shape, Vector
+
+    if isinstance(value, Shape) and value.wrapped is not None:
+        for i, shape in enumerate(shapes):
+            if shape is value:
+                return {"shape": i}
+
+        shapes.append(value)
+        return {"shape": len(shapes) - 1}
+
+    if isinstance(value, Vector):
+        return {"vector": list(value.to_tuple())}
+    if isinstance(value, tuple):
+        return {"tuple": [_encode(v, shapes) for v in value]}
+    if isinstance(value, list):
+        return [_encode(v, shapes) for v in value]
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if type(value).__name__ in BOOLEAN_KINDS:
+        return {"operation": type(value).__name__}
+
+    return {"unsupported": repr(value)}
+
+def _decode(value: Any, shapes: list[Shape]) -> Any:
+    from build123d import Vector
+
+    if isinstance(value, list):
+        return [_decode(v, shapes) for v in value]
+    if not isinstance(value, dict):
+        return value
+
+    if "shape" in value:
+        return shapes[value["shape"]]
+    if "vector" in value:
+        return Vector(*value["vector"])
+    if "tuple" in value:
+        return tuple(_decode(v, shapes) for v in value["tuple"])
+    if "operation" in value:
+        import OCP.BRepAlgoAPI  # type: ignore
+        return getattr(OCP.BRepAlgoAPI, value["operation"])()
+
+    raise ReplayError(f"can't replay argument {value['unsupported']}")
+
+def _counts(value: Any) -> dict[str, Any]:
+    from build123d import Shape
+
+    shapes = [value] if isinstance(value, Shape) else value if isinstance(value, list) else []
+    shapes = [s for s in shapes if isinstance(s, Shape) and s.wrapped is not None]
+
+    return {
+        "type": type(value).__name__,
+        "faces": sum(len(s.faces()) for s in shapes),
+        "edges": sum(len(s.edges()) for s in shapes),
+    }
+
+def _shapes_to_brep(shapes: list[Shape]) -> bytes:
+    from build123d import Compound
+    from OCP.BRep import BRep_Builder  # type: ignore
+    from OCP.TopoDS import TopoDS_Compound  # type: ignore
+
+    from .utils import compound_to_brep
+
+    # Written as one compound so that shapes shared between operands,
+    # such as the edges of a solid being filleted, stay shared
+    compound = TopoDS_Compound()
+    builder = BRep_Builder()
+    builder.MakeCompound(compound)
+    for shape in shapes:
+        builder.Add(compound, shape.wrapped)
+
+    return compound_to_brep(Compound(compound))
+
+def _shapes_from_brep(data: bytes) -> list[Shape]:
+    from build123d import Compound
+    from OCP.TopoDS import TopoDS_Iterator  # type: ignore
+
+    from .utils import compound_from_brep
+
+    # The compound must outlive the iterator
+    compound = compound_from_brep(data)
+
+    shapes = []
+    it = TopoDS_Iterator(compound.wrapped)
+    while it.More():
+        shapes.append(Compound.cast(it.Value()))
+        it.Next()
+
+    return shapes
+
+# Call site of the operations being made, set when the code making them
+# isn't where they were asked for, as when a Csg plan is run
+_call_site: str | None = None
+
+def call_site() -> str:
+    """
+    Return the line of model code which called into the module calling
+    this, skipping build123d and this package's kernel wrappers
+    """
+
+    import build123d
+
+    library = pathlib.Path(build123d.__file__).parent
+
+    def skipped(filename: str) -> bool:
+        return filename in _SKIPPED_SOURCES or library in pathlib.Path(filename).parents
+
+    frame = sys._getframe(1)
+    while frame.f_back is not None and skipped(frame.f_code.co_filename):
+        frame = frame.f_back
+
+    return f"{pathlib.Path(frame.f_code.co_filename).name}:{frame.f_lineno} {frame.f_code.co_name}"
+
+@contextlib.contextmanager
+def called_from(site: str | None) -> Iterator[None]:
+    """
+    Attribute operations made in the block to `site`, as returned by
+    call_site(), rather than to the code making them
+    """
+
+    global _call_site
+
+    saved = _call_site
+    _call_site = site
+    try:
+        yield
+    finally:
+        _call_site = saved
+
+
+class OpRecorder:
+    """
+    Writes operations to a directory, in a subdirectory per part.
+    Operations made outside of any part go to "model".
+    """
+
+    path: pathlib.Path
+    part: str
+    counts: dict[str, int]
+    depth: int
+
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+        self.part = "model"
+        self.counts = {}
+        self.depth = 0
+
+    def record(self,
+               method: str,
+               fn: Callable[..., Any],
+               args: tuple[Any, ...],
+               kwargs: dict[str, Any]) -> Any:
+        self.depth += 1
+        try:
+            start = time.perf_counter()
+            result = fn(*args, **kwargs)
+            duration = time.perf_counter() - start
+        finally:
+            self.depth -= 1
+
+        index = self.counts.get(self.part, 0) + 1
+        self.counts[self.part] = index
+        kind = _kind(method, args)
+        name = f"{index:04d}-{kind}"
+
+        shapes: list[Shape] = []
+        record = {
+            "version": RECORD_VERSION,
+            "id": f"{self.part}/{name}",
+            "kind": kind,
+            "method": method,
+            "caller": _call_site or call_site(),
+            "duration": duration,
+            "kernel": dataclasses.asdict(kernel.options),
+            "args": [_encode(a, shapes) for a in args],
+            "kwargs": {k: _encode(v, shapes) for k, v in kwargs.items()},
+            "result": _counts(result),
+        }
+        record["operands"] = [_counts(s) for s in shapes]
+
+        directory = self.path / self.part
+        directory.mkdir(parents=True, exist_ok=True)
+        (directory / f"{name}.brep").write_bytes(_shapes_to_brep(shapes))
+        (directory / f"{name}.json").write_text(json.dumps(record, indent=2) + "\n")
+
+        return result
+
+_recorder: OpRecorder | None = None
+_hooked = False
+
+def _hook(method: str, attr: Any) -> Any:
+    if isinstance(attr, classmethod):
+        fn = attr.__func__
+
+        @functools.wraps(fn)
+        def class_wrapper(cls: type, *args: Any, **kwargs: Any) -> Any:
+            if _recorder is None or _recorder.depth:
+                return fn(cls, *args, **kwargs)
+            return _recorder.record(method, functools.partial(fn, cls), args, kwargs)
+
+        return classmethod(class_wrapper)
+
+    @functools.wraps(attr)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        if _recorder is None or _recorder.depth:
+            return attr(*args, **kwargs)
+
+        # Operands may be iterators, which would be used up by the call
+        args = tuple(list(a) if isinstance(a, Iterator) else a for a in args)
+        return _recorder.record(method, attr, args, kwargs)
+
+    return wrapper
+
+def _owner(method: str) -> type:
+    cls_name = method.partition(".")[0]
+    return getattr(importlib.import_module(HOOKS[method]), cls_name)
+
+def start_recording(path: pathlib.Path) -> None:
+    """
+    Record operations to `path` from now on. Call this after applying
+    the kernel options, so the recorded operations are those the
+    kernel module hands to OCCT.
+    """
+
+    global _recorder, _hooked
+
+    if not _hooked:
+        for method in HOOKS:
+            owner = _owner(method)
+            name = method.partition(".")[2]
+            setattr(owner, name, _hook(method, vars(owner)[name]))
+        _hooked = True
+
+    _recorder = OpRecorder(path)
+
+def recording_dir() -> pathlib.Path | None:
+    return None if _recorder is None else _recorder.path
+
+@contextlib.contextmanager
+def recording_part(name: str) -> Iterator[None]:
+    """
+    Record operations made in the block as those of the part `name`,
+    replacing any earlier recording of the part
+    """
+
+    if _recorder is None:
+        yield
+        return
+
+    shutil.rmtree(_recorder.path / name, ignore_errors=True)
+    saved = _recorder.part
+    _recorder.part = name
+    _recorder.counts[name] = 0
+    try:
+        yield
+    finally:
+        _recorder.part = saved
+
+
+def load_records(path: pathlib.Path) -> list[dict[str, Any]]:
+    """
+    Load the records of all operations recorded to `path`
+    """
+
+    records = []
+    for file in sorted(path.glob("*/*.json")):
+        record = json.loads(file.read_text())
+        if record.get("version") != RECORD_VERSION:
+            raise ReplayError(f"{file}: unsupported record version {record.get('version')}")
+        records.append(record)
+
+    return records
+
+def replay(path: pathlib.Path,
+           record: dict[str, Any],
+           iterations: int = 1) -> tuple[list[float], dict[str, Any]]:
+    """
+    Re-run a recorded operation `iterations` times, and return the time
+    taken by each run and the counts of the last result
+    """
+
+    shapes = _shapes_from_brep((path / f"{record['id']}.brep").read_bytes())
+    fn = getattr(_owner(record["method"]), record["method"].partition(".")[2])
+
+    times = []
+    result = None
+    for _ in range(iterations):
+        # Decoded every time since boolean operations can't be reused
+        args = _decode(record["args"], shapes)
+        kwargs = {k: _decode(v, shapes) for k, v in record["kwargs"].items()}
+
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        times.append(time.perf_counter() - start)
+
+    return times, _counts(result)
+
+def _summary(counts: dict[str, Any]) -> str:
+    return f"{counts['faces']}F/{counts['edges']}E"
+
+def list_records(records: list[dict[str, Any]]) -> None:
+    width = max([2] + [len(r["id"]) for r in records])
+    print(f"{'Op':<{width}} {'Time (s)':>9} {'Operands':>18} {'Result':>12}  Caller")
+    for r in sorted(records, key=lambda r: r["duration"], reverse=True):
+        operands = ",".join(_summary(c) for c in r["operands"][:2])
+        if len(r["operands"]) > 2:
+            operands += f" +{len(r['operands']) - 2}"
+        print(f"{r['id']:<{width}} {r['duration']:>9.4f} {operands:>18} "
+              f"{_summary(r['result']):>12}  {r['caller']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay kernel operations recorded with --record-ops")
+    parser.add_argument("path", metavar="DIR", type=pathlib.Path,
+                        help="Directory the operations were recorded to")
+    parser.add_argument("ops", metavar="OP", nargs="*",
+                        help="Operations to replay (glob patterns allowed); if none, list the recorded operations")
+    parser.add_argument("-n", "--iterations", metavar="N", type=int, default=5,
+                        help="Timed runs per operation (default: 5)")
+    kernel.add_arguments(parser)
+
+    # Options may follow the operations, as in `DIR -n 2 'op*'`
+    args = parser.parse_intermixed_args()
+
+    if args.iterations < 1:
+        parser.error("need at least one iteration")
+
+    try:
+        records = load_records(args.path)
+    except (OSError, ValueError) as e:
+        sys.exit(f"{parser.prog}: error: {e}")
+
+    if not args.ops:
+        list_records(records)
+        return
+
+    selected = [r for r in records
+                if any(fnmatch.fnmatchcase(r["id"], pat) for pat in args.ops)]
+    if not selected:
+        parser.error("no recorded operations match")
+
+    kernel.apply_kernel_options(kernel.options_from_args(parser, args))
+
+    mismatched = False
+    for record in selected:
+        try:
+            times, counts = replay(args.path, record, args.iterations)
+        except ReplayError as e:
+            sys.exit(f"{parser.prog}: error: {record['id']}: {e}")
+
+        line = (f"{record['id']}: {record['kind']} at {record['caller']}, "
+                f"median {statistics.median(times):.4f}s, min {min(times):.4f}s "
+                f"(recorded {record['duration']:.4f}s), result {_summary(counts)}")
+        if counts != record["result"]:
+            line += f", recorded {_summary(record['result'])}"
+            mismatched = True
+        print(line)
+
+    if mismatched:
+        sys.exit("Some replayed results differ from the recorded ones")
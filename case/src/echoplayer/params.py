@@ -0,0 +1,337 @@
+"""
+Fingerprints and immutable views of parameter trees
+
+Model parameters are plain dataclasses which may contain numbers,
+strings, nested dataclasses, and dicts or lists of those. They are
+mutable and not hashable, so they can't be used directly as keys for
+caching anything derived from the parameters.
+
+This module provides a canonical fingerprint of a parameter tree, a
+frozen view that can be hashed and compared, and a tracing view that
+records which parameters are read. It does not depend on build123d, so
+it's cheap to import.
+"""
+
+import copy
+import dataclasses
+import hashlib
+import json
+from collections.abc import Iterator, Mapping
+from typing import Any, TypeAlias
+
+
+def canonical(value: Any) -> Any:
+    """
+    Convert a parameter tree to a canonical form of plain JSON data
+
+    The result does not depend on dataclass field order or dict
+    insertion order, and numbers compare by value (so 2 and 2.0 are
+    the same).
+    """
+
+    if isinstance(value, FrozenView):
+        value = value._value
+
+    if value is None or isinstance(value, (bool, str)):
+        return value
+    if isinstance(value, (int, float)):
+        # Encode exactly, and normalize -0.0 to 0.0
+        return "f:" + (float(value) + 0.0).hex()
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return {
+            "__type__": type(value).__qualname__,
+            "fields": {f.name: canonical(getattr(value, f.name))
+                       for f in dataclasses.fields(value)},
+        }
+    if isinstance(value, Mapping):
+        items = [[canonical(k), canonical(v)] for k, v in value.items()]
+        items.sort(key=lambda kv: json.dumps(kv[0], sort_keys=True))
+        return {"__map__": items}
+    if isinstance(value, (list, tuple)):
+        return [canonical(v) for v in value]
+
+    raise TypeError(f"cannot fingerprint {type(value).__qualname__}")
+
+def fingerprint(value: Any) -> str:
+    """
+    Return a stable hex digest identifying a parameter tree
+
+    Equal parameters always have the same fingerprint, across processes
+    and Python versions.
+    """
+
+    if isinstance(value, FrozenView):
+        return value.fingerprint()
+
+    data = json.dumps(canonical(value), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+class FrozenView:
+    """
+    Read-only, hashable view of a parameter tree
+
+    Attribute access (including properties) and mapping access work as
+    on the underlying parameters, but nested values are returned as
+    frozen views and nothing can be modified. Views compare and hash by
+    fingerprint, which is only computed once, so they are cheap keys
+    for memoization.
+
+    The view assumes the underlying parameters aren't changed while it
+    is in use; take a copy first if that isn't guaranteed.
+    """
+
+    __slots__ = ("_fingerprint", "_value")
+
+    _value: Any
+    _fingerprint: str | None
+
+    def __init__(self, value: Any):
+        object.__setattr__(self, "_value", value)
+        object.__setattr__(self, "_fingerprint", None)
+
+    def fingerprint(self) -> str:
+        if self._fingerprint is None:
+            object.__setattr__(self, "_fingerprint", fingerprint(self._value))
+        assert self._fingerprint is not None
+        return self._fingerprint
+
+    def unfreeze(self) -> Any:
+        """
+        Return the underlying parameters
+        """
+        return self._value
+
+    def __getattr__(self, name: str) -> Any:
+        # Evaluate properties on the view so they see frozen values too
+        attr = getattr(type(self._value), name, None)
+        if isinstance(attr, property) and attr.fget is not None:
+            return freeze(attr.fget(self))
+
+        return freeze(getattr(self._value, name))
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise dataclasses.FrozenInstanceError(f"cannot assign to field '{name}'")
+
+    def __delattr__(self, name: str) -> None:
+        raise dataclasses.FrozenInstanceError(f"cannot delete field '{name}'")
+
+    def __hash__(self) -> int:
+        return hash(self.fingerprint())
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, FrozenView):
+            return NotImplemented
+        return self.fingerprint() == other.fingerprint()
+
+    def __repr__(self) -> str:
+        return f"frozen({self._value!r})"
+
+
+class FrozenMapping(FrozenView, Mapping[Any, Any]):
+    __slots__ = ()
+
+    def __getitem__(self, key: Any) -> Any:
+        return freeze(self._value[key])
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(self._value)
+
+    def __len__(self) -> int:
+        return len(self._value)
+
+    # Mapping defines these, but views always compare by fingerprint
+    __eq__ = FrozenView.__eq__
+    __hash__ = FrozenView.__hash__
+
+
+def freeze(value: Any) -> Any:
+    """
+    Return a frozen view of a parameter tree
+
+    Plain values are returned as-is, lists are converted to tuples,
+    and dataclasses and mappings are wrapped in a FrozenView.
+    """
+
+    if isinstance(value, FrozenView):
+        return value
+    if isinstance(value, Mapping):
+        return FrozenMapping(value)
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return FrozenView(value)
+    if isinstance(value, list):
+        return tuple(freeze(v) for v in value)
+
+    return value
+
+
+def derived_values(value: Any, path: str = "") -> Iterator[tuple[str, Any]]:
+    """
+    Yield the dotted path and value of every property of the dataclasses
+    in a parameter tree
+    """
+
+    def child(name: Any) -> str:
+        return f"{path}.{name}" if path else str(name)
+
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        for name, attr in vars(type(value)).items():
+            if isinstance(attr, property):
+                yield child(name), getattr(value, name)
+        for f in dataclasses.fields(value):
+            yield from derived_values(getattr(value, f.name), child(f.name))
+    elif isinstance(value, Mapping):
+        for k, v in value.items():
+            yield from derived_values(v, child(k))
+
+
+# Path component recording that the keys of a mapping were read
+KEYS = "<keys>"
+
+Path: TypeAlias = tuple[Any, ...]
+
+class TracingView:
+    """
+    View of a parameter tree which records every value read through it
+
+    Reads are recorded in a dict mapping the path of each value (a tuple
+    of attribute names and mapping keys) to its canonical form. Nested
+    dataclasses and mappings are returned as tracing views too, and
+    properties are evaluated on the view, so only the underlying plain
+    values are recorded. Iterating over a mapping records its keys.
+    Views of dataclasses work with dataclasses.fields() and asdict(), and
+    copying a view returns a plain copy of the value.
+
+    Use changed_reads() to find out whether the recorded values are
+    still the same in another parameter tree.
+    """
+
+    __slots__ = ("_path", "_reads", "_value")
+
+    _value: Any
+    _reads: dict[Path, Any]
+    _path: Path
+
+    def __init__(self, value: Any, reads: dict[Path, Any], path: Path = ()):
+        object.__setattr__(self, "_value", value)
+        object.__setattr__(self, "_reads", reads)
+        object.__setattr__(self, "_path", path)
+
+    def _child(self, key: Any, value: Any) -> Any:
+        path = self._path + (key,)
+
+        if isinstance(value, Mapping):
+            return TracingMapping(value, self._reads, path)
+        if dataclasses.is_dataclass(value) and not isinstance(value, type):
+            return _view_class(type(value))(value, self._reads, path)
+
+        self._reads[path] = canonical(value)
+        return value
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(type(self._value), name, None)
+        if isinstance(attr, property) and attr.fget is not None:
+            return attr.fget(self)
+
+        return self._child(name, getattr(self._value, name))
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise dataclasses.FrozenInstanceError(f"cannot assign to field '{name}'")
+
+    # Copies are plain values which may be modified, and they could
+    # be read in any way, so copying counts as reading everything
+    def __copy__(self) -> Any:
+        self._reads[self._path] = canonical(self._value)
+        return copy.copy(self._value)
+
+    def __deepcopy__(self, memo: dict[int, Any]) -> Any:
+        self._reads[self._path] = canonical(self._value)
+        return copy.deepcopy(self._value, memo)
+
+    def __repr__(self) -> str:
+        return f"traced({self._value!r})"
+
+
+_view_classes: dict[type, type[TracingView]] = {}
+
+def _view_class(cls: type) -> type[TracingView]:
+    # Views of dataclasses carry the dataclass fields, so that fields()
+    # and asdict() work on them (and record the fields they read)
+    view_class = _view_classes.get(cls)
+    if view_class is None:
+        view_class = type(f"Traced{cls.__name__}", (TracingView,), {
+            "__slots__": (),
+            "__dataclass_fields__": vars(cls)["__dataclass_fields__"],
+        })
+        _view_classes[cls] = view_class
+
+    return view_class
+
+
+class TracingMapping(TracingView, Mapping[Any, Any]):
+    __slots__ = ()
+
+    def _read_keys(self) -> None:
+        self._reads[self._path + (KEYS,)] = canonical(list(self._value))
+
+    def __getitem__(self, key: Any) -> Any:
+        return self._child(key, self._value[key])
+
+    def __iter__(self) -> Iterator[Any]:
+        self._read_keys()
+        return iter(self._value)
+
+    def __len__(self) -> int:
+        self._read_keys()
+        return len(self._value)
+
+
+def trace(value: Any, reads: dict[Path, Any]) -> Any:
+    """
+    Return a tracing view of a parameter tree, recording reads in `reads`
+    """
+
+    if isinstance(value, Mapping):
+        return TracingMapping(value, reads)
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return _view_class(type(value))(value, reads)
+
+    return TracingView(value, reads)
+
+def lookup(value: Any, path: Path) -> Any:
+    """
+    Return the value at `path` in a parameter tree
+    """
+
+    for key in path:
+        if key == KEYS:
+            return list(value)
+        if isinstance(value, Mapping):
+            value = value[key]
+        else:
+            value = getattr(value, key)
+
+    return value
+
+def format_path(path: Path) -> str:
+    return ".".join(str(key) for key in path)
+
+def changed_reads(reads: dict[Path, Any], value: Any) -> list[Path]:
+    """
+    Return the paths of recorded reads whose value is different (or
+    missing) in the parameter tree `value`
+    """
+
+    changed = []
+
+    for path, old in reads.items():
+        try:
+            new = canonical(lookup(value, path))
+        except (AttributeError, KeyError):
+            changed.append(path)
+            continue
+
+        if new != old:
+            changed.append(path)
+
+    return changed
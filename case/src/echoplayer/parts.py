@@ -0,0 +1,725 @@
+from __future__ import annotations
+
+import fnmatch
+import hashlib
+import importlib
+import json
+import pathlib
+import time
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, replace
+from typing import TYPE_CHECKING, Any, TypeAlias, cast
+
+from . import kernel, oprecord, profiling
+from .cache import PartCache, source_hash
+from .params import Path, changed_reads, format_path, trace
+from .profiling import stage
+from .serialize import (
+    ObjectData,
+    Snapshot,
+    dumps,
+    loads,
+    pack_object,
+    snapshot_datums,
+    unpack_object,
+)
+
+# Part tables must be loadable without build123d, so geometry modules
+# are only imported when parts are built
+if TYPE_CHECKING:
+    from .utils import DatumRead, DatumSet, Object
+
+DatumSets: TypeAlias = "dict[str, DatumSet]"
+BuilderFn: TypeAlias = "Callable[[Any, DatumSets], list[Object]]"
+NamesFn: TypeAlias = Callable[[Any], list[str]]
+
+
+class PartSelectionError(ValueError):
+    pass
+
+class ObjectNamesError(ValueError):
+    """
+    A part produced objects other than those it declares
+    """
+
+
+@dataclass
+class DatumSetSpec:
+    """
+    Describes how to compute a datum set. The builder is called with the
+    model parameters followed by the datum sets named in `deps`.
+    """
+
+    name: str
+    builder: Callable[..., DatumSet]
+    deps: tuple[str, ...] = ()
+
+@dataclass
+class Part:
+    """
+    A Part is a unit of work in a model build. It is built by calling
+    the builder function with the model parameters and resolved datum
+    sets, and produces one or more Objects.
+
+    The builder is given as "module:function", with the module relative
+    to this package, and is only imported when the part is built.
+
+    Builders must treat the parameters and datums as read-only. Parts
+    don't depend on each other so they can be built in any order.
+    The datum sets used by the builder must be listed in `datums`;
+    only those (and their dependencies) are guaranteed to be resolved.
+
+    If the part produces objects with names other than the part name,
+    `objects` must return the object names for the given parameters.
+    """
+
+    name: str
+    builder: str
+    datums: tuple[str, ...] = ()
+    objects: NamesFn | None = None
+
+    def load_builder(self) -> BuilderFn:
+        module, _, name = self.builder.partition(":")
+        return getattr(importlib.import_module(module, __package__), name)
+
+    def object_names(self, params: Any) -> list[str]:
+        if self.objects is None:
+            return [self.name]
+
+        return self.objects(params)
+
+
+@dataclass
+class _DatumNode:
+    datums: DatumSet
+    # Builder, parameter reads, and generations of the sets it was
+    # built from, to decide whether it needs to be recomputed
+    builder: Callable[..., DatumSet]
+    reads: dict[Path, Any]
+    deps: dict[str, int]
+    # Values of all datums and references, to find what changed
+    values: dict[str, tuple[float, ...]]
+    # Incremented whenever the values change
+    generation: int = 0
+
+def _datum_set_values(ds: DatumSet) -> dict[str, tuple[float, ...]]:
+    from .utils import datum_values, location_values
+
+    values = {name: datum_values(d) for name, d in ds.datums.items()}
+    for name in ds.aliases:
+        datum = ds.get_datum(name)
+        if datum is not None:
+            values[name] = datum_values(datum)
+    values.update({f"{name}@": location_values(ref.loc)
+                   for name, ref in ds.refs.items() if ref.ref is not ds})
+    return values
+
+class DatumGraph:
+    """
+    Datum sets computed on demand, with their dependencies tracked,
+    for reuse across builds
+
+    Each datum set depends on the parameters its builder reads (which
+    are traced), the builder's source code, and the datum sets it is
+    built from. Resolving again with different parameters recomputes
+    only the sets whose inputs changed. If a recomputed set comes out
+    the same, the sets built from it are not recomputed either.
+
+    After each resolve(), `changes` maps the names of datum sets whose
+    values changed to the names of the changed datums (references are
+    suffixed with "@"), and `reasons` maps each recomputed set to what
+    caused it.
+    """
+
+    specs: list[DatumSetSpec]
+    nodes: dict[str, _DatumNode]
+    changes: dict[str, list[str]]
+    reasons: dict[str, str]
+
+    def __init__(self):
+        self.specs = []
+        self.nodes = {}
+        self.changes = {}
+        self.reasons = {}
+
+    def _stale(self, spec: DatumSetSpec, params: Any) -> str | None:
+        node = self.nodes.get(spec.name)
+        if node is None:
+            return "not built"
+
+        # Builders are only replaced by reloading their module, and
+        # hashing the source is slow, so only do it if that happened
+        if (node.builder is not spec.builder and
+                source_hash(node.builder) != source_hash(spec.builder)):
+            return "source changed"
+
+        for dep in spec.deps:
+            if node.deps.get(dep) != self.nodes[dep].generation:
+                return f"{dep} changed"
+
+        changed = changed_reads(node.reads, params)
+        if changed:
+            return ", ".join(format_path(path) for path in changed)
+
+        return None
+
+    def _build(self, spec: DatumSetSpec, params: Any) -> None:
+        reads: dict[Path, Any] = {}
+        deps = [self.nodes[dep].datums for dep in spec.deps]
+        datums = spec.builder(trace(params, reads), *deps)
+        values = _datum_set_values(datums)
+
+        old = self.nodes.get(spec.name)
+        generation = 0
+        if old is not None:
+            changed = [name for name in values.keys() | old.values.keys()
+                       if values.get(name) != old.values.get(name)]
+            if changed:
+                self.changes[spec.name] = sorted(changed)
+
+            # The new set references the new dependencies, so it must
+            # replace the old one in dependents if they were replaced
+            deps_changed = any(old.deps.get(dep) != self.nodes[dep].generation
+                               for dep in spec.deps)
+            generation = old.generation
+            if changed or deps_changed:
+                generation += 1
+
+        self.nodes[spec.name] = _DatumNode(
+            datums = datums,
+            builder = spec.builder,
+            reads = reads,
+            deps = {dep: self.nodes[dep].generation for dep in spec.deps},
+            values = values,
+            generation = generation,
+        )
+
+    def resolve(self,
+                specs: list[DatumSetSpec],
+                params: Any,
+                names: set[str] | None = None) -> DatumSets:
+        """
+        Return the named datum sets and all the sets they depend on, or
+        all datum sets if `names` is None, recomputing them as needed
+        """
+
+        self.specs = specs
+        by_name = {spec.name: spec for spec in self.specs}
+        done: set[str] = set()
+        self.changes = {}
+        self.reasons = {}
+
+        def resolve(name: str) -> None:
+            if name in done:
+                return
+
+            spec = by_name[name]
+            for dep in spec.deps:
+                resolve(dep)
+
+            reason = self._stale(spec, params)
+            if reason is not None:
+                self.reasons[name] = reason
+                self._build(spec, params)
+
+            done.add(name)
+
+        for spec in self.specs:
+            if names is None or spec.name in names:
+                resolve(spec.name)
+
+        return {name: self.nodes[name].datums for name in done}
+
+    def touched_parts(self, parts: list[Part]) -> list[str]:
+        """
+        Return the names of the parts using a datum set which changed in
+        the last resolve(), directly or through its dependencies
+        """
+        by_name = {spec.name: spec for spec in self.specs}
+
+        def changed(name: str) -> bool:
+            return (name in self.changes or
+                    any(changed(dep) for dep in by_name[name].deps))
+
+        return [part.name for part in parts
+                if any(changed(name) for name in part.datums)]
+
+def report_datum_changes(graph: DatumGraph, parts: list[Part]) -> None:
+    for name, reason in graph.reasons.items():
+        if reason != "not built":
+            print(f"Recomputed datums {name}: {reason}")
+
+    for name, changed in graph.changes.items():
+        shown = ", ".join(changed[:5])
+        if len(changed) > 5:
+            shown += f" and {len(changed) - 5} more"
+        print(f"Changed datums in {name}: {shown}")
+
+    if graph.changes:
+        print(f"Parts affected by datum changes: {', '.join(graph.touched_parts(parts))}")
+
+def resolve_datums(specs: list[DatumSetSpec],
+                   params: Any,
+                   names: set[str] | None = None) -> DatumSets:
+    """
+    Compute the named datum sets and all the sets they depend on, or
+    all datum sets if `names` is None
+    """
+
+    return DatumGraph().resolve(specs, params, names)
+
+# Bump this when the dependency file format changes
+DEPENDENCIES_VERSION = 1
+
+@dataclass
+class PartInputs:
+    """
+    Everything a part's builder read while building it: the source hash
+    of the builder, and the parameters and datum queries it read, with
+    their values
+    """
+
+    source: str
+    params: dict[Path, Any]
+    datums: dict[DatumRead, Any]
+
+def trace_part(part: Part,
+               params: Any,
+               datums: DatumSets) -> tuple[list[Object], PartInputs]:
+    """
+    Build a part, recording the parameters and datums the builder reads
+    """
+
+    from .utils import TracingDatumSet, trace_datums
+
+    builder = part.load_builder()
+    param_reads: dict[Path, Any] = {}
+    datum_reads: dict[DatumRead, Any] = {}
+
+    # The tracing views stand in for the datum sets
+    traced = cast("DatumSets", trace_datums(datums, datum_reads))
+    objects = builder(trace(params, param_reads), traced)
+
+    # Objects must refer to the datum sets themselves, see pack_objects()
+    for obj in objects:
+        if isinstance(obj.datums, TracingDatumSet):
+            obj.datums = obj.datums.untraced()
+
+    return objects, PartInputs(source_hash(builder), param_reads, datum_reads)
+
+def affected_parts(parts: list[Part],
+                   params: Any,
+                   datums: DatumSets,
+                   deps: dict[str, PartInputs]) -> dict[str, list[str]]:
+    """
+    Return the parts which must be rebuilt because their inputs changed
+    since `deps` were recorded, mapped to descriptions of the changes
+    """
+
+    from .utils import changed_datum_reads, format_datum_read
+
+    affected = {}
+
+    for part in parts:
+        inputs = deps.get(part.name)
+        if inputs is None:
+            affected[part.name] = ["not traced"]
+            continue
+
+        changes = []
+        if source_hash(part.load_builder()) != inputs.source:
+            changes.append("source changed")
+        changes += [format_path(path) for path in changed_reads(inputs.params, params)]
+        changes += [format_datum_read(read)
+                    for read in changed_datum_reads(inputs.datums, datums)]
+
+        if changes:
+            affected[part.name] = changes
+
+    return affected
+
+def _tuples(value: Any) -> Any:
+    # JSON turns tuples into lists
+    if isinstance(value, list):
+        return tuple(_tuples(v) for v in value)
+
+    return value
+
+def pack_inputs(inputs: PartInputs) -> dict[str, Any]:
+    """
+    Convert a part's inputs to plain data for JSON. Values are kept in
+    the canonical form of params.canonical(), so they compare exactly
+    when unpacked.
+    """
+
+    return {
+        "source": inputs.source,
+        "params": [[list(p), value] for p, value in inputs.params.items()],
+        "datums": [[list(p), method, list(args), value]
+                   for (p, method, args), value in inputs.datums.items()],
+    }
+
+def unpack_inputs(data: dict[str, Any]) -> PartInputs:
+    """
+    Inverse of pack_inputs()
+    """
+
+    return PartInputs(
+        source = data["source"],
+        params = {_tuples(p): value for p, value in data["params"]},
+        datums = {(_tuples(p), method, _tuples(args)): value
+                  for p, method, args, value in data["datums"]},
+    )
+
+def save_dependencies(path: pathlib.Path, deps: dict[str, PartInputs]) -> None:
+    """
+    Save the inputs of parts as JSON, see pack_inputs()
+    """
+
+    data = {
+        "version": DEPENDENCIES_VERSION,
+        "parts": {name: pack_inputs(inputs) for name, inputs in deps.items()},
+    }
+
+    path.write_text(json.dumps(data, indent=1) + "\n")
+
+def load_dependencies(path: pathlib.Path) -> dict[str, PartInputs]:
+    """
+    Inverse of save_dependencies(). Raises ValueError if the file is
+    in an unsupported format.
+    """
+
+    data = json.loads(path.read_text())
+    if data.get("version") != DEPENDENCIES_VERSION:
+        raise ValueError(f"{path}: unsupported dependency file version")
+
+    return {name: unpack_inputs(part) for name, part in data["parts"].items()}
+
+def cache_key(cache: PartCache,
+              part: Part,
+              params: Any,
+              datums: DatumSets) -> str:
+    """
+    Return the cache key of a part: from the inputs it read when last
+    built if none of them changed since, otherwise from all parameters
+    and the datum sets it uses
+    """
+
+    from .utils import changed_datum_reads
+
+    builder = part.load_builder()
+
+    data = cache.load_trace(part.builder)
+    if data is not None:
+        try:
+            inputs = unpack_inputs(data)
+        except (KeyError, TypeError, ValueError):
+            inputs = None
+
+        if (inputs is not None
+                and inputs.source == source_hash(builder)
+                and not changed_reads(inputs.params, params)
+                and not changed_datum_reads(inputs.datums, datums)):
+            return cache.inputs_key(data)
+
+    return cache.key(builder, params, datums, part.datums)
+
+def datum_source_hash(model_name: str) -> str:
+    """
+    Hash the source files of a model and of the datum code, which are
+    what its datum sets depend on besides the parameters. Files are
+    hashed rather than the builders, so that this doesn't need to
+    import the model (and build123d).
+    """
+
+    package_dir = pathlib.Path(__file__).parent
+    hasher = hashlib.sha256()
+    for module in (model_name, "utils"):
+        hasher.update((package_dir / f"{module}.py").read_bytes())
+
+    return hasher.hexdigest()
+
+def load_cached_datums(cache: PartCache,
+                       model_name: str,
+                       params: Any) -> Snapshot | None:
+    """
+    Load the datum sets of a model stored by store_cached_datums(), if
+    neither the parameters they read nor the model's source changed
+    since, or return None
+    """
+
+    data = cache.load_trace(f"{model_name}:datums")
+    if data is None:
+        return None
+
+    try:
+        inputs = unpack_inputs(data)
+    except (KeyError, TypeError, ValueError):
+        return None
+
+    if (inputs.source != datum_source_hash(model_name)
+            or changed_reads(inputs.params, params)):
+        return None
+
+    return cache.load_datums(cache.inputs_key(data))
+
+def store_cached_datums(cache: PartCache,
+                        model_name: str,
+                        graph: DatumGraph,
+                        snapshot: Snapshot) -> None:
+    """
+    Store the datum sets resolved by `graph`, keyed on the parameters
+    their builders read
+    """
+
+    reads: dict[Path, Any] = {}
+    for node in graph.nodes.values():
+        reads.update(node.reads)
+
+    data = pack_inputs(PartInputs(source = datum_source_hash(model_name),
+                                  params = reads,
+                                  datums = {}))
+    cache.store_datums(cache.inputs_key(data), snapshot)
+    cache.store_trace(f"{model_name}:datums", data)
+
+def _matches(name: str, patterns: list[str]) -> bool:
+    return any(fnmatch.fnmatchcase(name, pat) for pat in patterns)
+
+def select_parts(parts: list[Part],
+                 params: Any,
+                 patterns: list[str]) -> dict[str, list[str] | None]:
+    """
+    Select the parts needed to build objects matching any of the glob
+    patterns. Patterns can match part names, to select all objects of
+    a part, or object names, including the names of instances of an
+    object (see Object.instances).
+
+    Returns a dict mapping the names of selected parts to the list of
+    requested objects of the part, or None if all objects are wanted.
+    """
+
+    selected: dict[str, list[str] | None] = {}
+
+    for part in parts:
+        if _matches(part.name, patterns):
+            selected[part.name] = None
+            continue
+
+        names = [n for n in part.object_names(params) if _matches(n, patterns)]
+        if names:
+            selected[part.name] = names
+
+    if not selected:
+        available = [n for part in parts for n in [part.name] + part.object_names(params)]
+        raise PartSelectionError(f"nothing matches {','.join(patterns)}; "
+                                 f"available parts and objects: {', '.join(dict.fromkeys(available))}")
+
+    return selected
+
+
+def check_object_names(part: Part, params: Any, objects: list[Object]) -> None:
+    """
+    Check that the objects and instances built by a part have exactly
+    the names it declares, since those are used to select parts and
+    name exported files, and that the names are unique. An instance may
+    have the name of its own object.
+    """
+
+    built = sorted(name for obj in objects
+                   for name in dict.fromkeys([obj.name, *obj.instances]))
+    repeated = sorted({name for name in built if built.count(name) > 1})
+    if repeated:
+        raise ObjectNamesError(f"part {part.name} built several objects named {', '.join(repeated)}")
+
+    declared = sorted(part.object_names(params))
+    if built != declared:
+        raise ObjectNamesError(f"part {part.name} declares objects {', '.join(declared)} "
+                               f"but built {', '.join(built)}")
+
+
+def pack_objects(objects: list[Object],
+                 datums: DatumSets) -> list[ObjectData]:
+    """
+    Convert objects to plain data, with datum sets replaced by their
+    name in `datums`. See serialize.pack_object().
+    """
+
+    datum_names = {id(ds): name for name, ds in datums.items()}
+    return [pack_object(obj, datum_names) for obj in objects]
+
+def unpack_objects(records: list[ObjectData],
+                   datums: DatumSets) -> list[Object]:
+    """
+    Inverse of pack_objects(), using the datum sets in `datums`
+    """
+
+    return [unpack_object(rec, datums) for rec in records]
+
+
+# State of pool worker processes
+_worker_params: Any = None
+_worker_datums: DatumSets = {}
+
+def _worker_init(params: Any,
+                 datums: bytes,
+                 profile: bool,
+                 kernel_options: kernel.KernelOptions,
+                 record_dir: pathlib.Path | None) -> None:
+    global _worker_params, _worker_datums
+
+    profiling.init_worker(profile)
+    kernel.apply_kernel_options(kernel_options)
+    if record_dir is not None:
+        oprecord.start_recording(record_dir)
+
+    # Datum sets can't be pickled, so they are passed serialized
+    _worker_params = params
+    with stage("datums", "datums"):
+        _worker_datums = loads(datums).datum_sets()
+
+def _worker_build(part: Part, traced: bool) -> tuple[list[ObjectData], float,
+                                                   list[dict[str, Any]], PartInputs | None]:
+    start = time.perf_counter()
+    inputs = None
+    with stage(part.name, "part"), oprecord.recording_part(part.name):
+        if traced:
+            objects, inputs = trace_part(part, _worker_params, _worker_datums)
+        else:
+            objects = part.load_builder()(_worker_params, _worker_datums)
+    elapsed = time.perf_counter() - start
+
+    return (pack_objects(objects, _worker_datums), elapsed,
+            profiling.take_worker_records(), inputs)
+
+
+def build_parts(parts: list[Part],
+                params: Any,
+                datum_specs: list[DatumSetSpec],
+                jobs: int = 1,
+                cache: PartCache | None = None,
+                only: list[str] | None = None,
+                datum_graph: DatumGraph | None = None,
+                deps: dict[str, PartInputs] | None = None) -> list[Object]:
+    """
+    Build a list of parts and return their objects in order
+
+    If `jobs` is greater than one, each part is built as a separate
+    task in a pool of `jobs` worker processes.
+
+    If a cache is given, parts found in the cache are loaded instead of
+    being built and newly built parts are added to the cache.
+
+    If `only` is given, only the objects matching those glob patterns
+    are returned, and only the parts and datum sets needed to build
+    them are computed. See select_parts().
+
+    If a datum graph is given, datum sets are resolved with it so only
+    those affected by changes since the previous build are recomputed,
+    and the changes are reported.
+
+    If `deps` is given, the inputs read by each part are traced and
+    added to it, see trace_part(). Parts are never loaded from the
+    cache then, since they must be built to be traced. The same goes
+    for recording operations, see oprecord.start_recording(). Parts are
+    also traced when there is a cache, which keys them on their inputs,
+    see cache_key().
+    """
+
+    recording = oprecord.recording_dir() is not None
+
+    wanted: dict[str, list[str] | None] = {part.name: None for part in parts}
+    if only is not None:
+        wanted = select_parts(parts, params, only)
+        parts = [part for part in parts if part.name in wanted]
+
+    datum_names = {name for part in parts for name in part.datums}
+    with stage("datums", "datums"):
+        if datum_graph is None:
+            datums = resolve_datums(datum_specs, params, datum_names)
+        else:
+            datums = datum_graph.resolve(datum_specs, params, datum_names)
+            report_datum_changes(datum_graph, parts)
+
+    results: dict[str, list[Object]] = {}
+
+    start = time.perf_counter()
+
+    if cache is not None and deps is None and not recording:
+        for part in parts:
+            with stage(f"{part.name}: cache load", "cache"):
+                records = cache.load(cache_key(cache, part, params, datums))
+                if records is not None:
+                    results[part.name] = unpack_objects(records, datums)
+
+            if records is not None:
+                print(f"Loaded {part.name} from cache")
+
+    pending = [part for part in parts if part.name not in results]
+    profiler = profiling.get_profiler()
+
+    traced = deps is not None or cache is not None
+    inputs: dict[str, PartInputs] = {}
+
+    def store(part: Part, records: list[ObjectData]) -> None:
+        # Stored under the key of the inputs just read, which is the key
+        # the part will be looked up with until they change
+        if cache is not None:
+            data = pack_inputs(inputs[part.name])
+            cache.store(cache.inputs_key(data), records)
+            cache.store_trace(part.builder, data)
+
+    if jobs <= 1:
+        for part in pending:
+            part_start = time.perf_counter()
+            with stage(part.name, "part"), oprecord.recording_part(part.name):
+                if traced:
+                    results[part.name], inputs[part.name] = trace_part(part, params, datums)
+                else:
+                    results[part.name] = part.load_builder()(params, datums)
+            print(f"Built {part.name} in {time.perf_counter() - part_start:.2f}s")
+
+            store(part, pack_objects(results[part.name], datums))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs,
+                                 initializer=_worker_init,
+                                 initargs=(params, dumps(snapshot_datums(datums)),
+                                           profiler is not None,
+                                           kernel.options,
+                                           oprecord.recording_dir())) as pool:
+            futures = [(part, pool.submit(_worker_build, part, traced))
+                       for part in pending]
+
+            for part, future in futures:
+                records, elapsed, stages, part_inputs = future.result()
+                if profiler is not None:
+                    profiler.merge(stages)
+                if part_inputs is not None:
+                    inputs[part.name] = part_inputs
+
+                results[part.name] = unpack_objects(records, datums)
+                print(f"Built {part.name} in {elapsed:.2f}s")
+
+                store(part, records)
+
+    if deps is not None:
+        deps.update(inputs)
+
+    print(f"Built {len(pending)} of {len(parts)} parts in {time.perf_counter() - start:.2f}s")
+
+    for part in parts:
+        check_object_names(part, params, results[part.name])
+
+    objects = []
+    for part in parts:
+        names = wanted[part.name]
+        for obj in results[part.name]:
+            if names is None or obj.name in names:
+                objects.append(obj)
+            elif any(name in names for name in obj.instances):
+                # Only some copies of an instanced object are wanted
+                objects.append(replace(obj, instances={
+                    name: loc for name, loc in obj.instances.items() if name in names
+                }))
+
+    return objects
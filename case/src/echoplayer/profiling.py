@@ -0,0 +1,212 @@
+"""
+Build stage profiling
+
+Stages are recorded with the stage() context manager or the @profiled
+decorator. They cost almost nothing unless a Profiler has been activated
+with set_profiler(), in which case wall time, CPU time and peak RSS are
+recorded for every stage. Results can be written as a Chrome trace-event
+file (viewable in chrome://tracing or https://ui.perfetto.dev) and
+summarized as a table.
+"""
+
+import functools
+import json
+import os
+import pathlib
+import sys
+import threading
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Any, ParamSpec, TypeVar
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None # type: ignore
+
+
+def peak_rss() -> int:
+    """
+    Return the peak resident set size of this process in bytes, or 0
+    if it isn't known
+    """
+
+    if resource is None:
+        return 0
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Linux reports kilobytes, macOS reports bytes
+    if sys.platform != "darwin":
+        rss *= 1024
+
+    return rss
+
+
+@dataclass
+class StageRecord:
+    name: str
+    category: str
+    start: float
+    wall: float
+    cpu: float
+    peak_rss: int
+    pid: int
+    tid: int
+    args: dict[str, Any] = field(default_factory=dict)
+
+
+class Profiler:
+    records: list[StageRecord]
+    metadata: dict[str, Any]
+
+    def __init__(self):
+        self.records = []
+        self.metadata = {}
+
+    @contextmanager
+    def stage(self, name: str, category: str = "build", **args: Any) -> Iterator[None]:
+        start = time.time()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+
+        try:
+            yield
+        finally:
+            self.records.append(StageRecord(
+                name = name,
+                category = category,
+                start = start,
+                wall = time.perf_counter() - wall_start,
+                cpu = time.process_time() - cpu_start,
+                peak_rss = peak_rss(),
+                pid = os.getpid(),
+                tid = threading.get_ident(),
+                args = args,
+            ))
+
+    def merge(self, records: list[dict[str, Any]]) -> None:
+        """
+        Add records collected in another process, eg. by a pool worker
+        """
+        self.records += [StageRecord(**r) for r in records]
+
+    def take_records(self) -> list[dict[str, Any]]:
+        """
+        Remove all records and return them in a picklable form
+        """
+        records = [asdict(r) for r in self.records]
+        self.records = []
+        return records
+
+    def write_chrome_trace(self, path: pathlib.Path) -> None:
+        events = []
+
+        for r in self.records:
+            events.append({
+                "name": r.name,
+                "cat": r.category,
+                "ph": "X",
+                "ts": r.start * 1e6,
+                "dur": r.wall * 1e6,
+                "pid": r.pid,
+                "tid": r.tid,
+                "args": {
+                    "cpu_ms": r.cpu * 1e3,
+                    "peak_rss_mb": r.peak_rss / 2**20,
+                    **r.args,
+                },
+            })
+
+        with open(path, "w") as f:
+            json.dump({
+                "traceEvents": events,
+                "displayTimeUnit": "ms",
+                "otherData": self.metadata,
+            }, f, indent=1)
+
+    def summary(self) -> str:
+        """
+        Return a table of stages sorted by total wall time. Stages with
+        the same name are combined.
+        """
+
+        totals: dict[tuple[str, str], list[float]] = {}
+        for r in self.records:
+            row = totals.setdefault((r.category, r.name), [0, 0, 0, 0])
+            row[0] += 1
+            row[1] += r.wall
+            row[2] += r.cpu
+            row[3] = max(row[3], r.peak_rss)
+
+        name_width = max([len(name) for _, name in totals] + [5])
+
+        header = (f"{'Stage':<{name_width}}  {'Category':<10} {'Calls':>5} "
+                  f"{'Wall (s)':>9} {'CPU (s)':>9} {'Peak RSS (MB)':>14}")
+        lines = [header]
+
+        for (category, name), (calls, wall, cpu, rss) in \
+                sorted(totals.items(), key=lambda kv: -kv[1][1]):
+            lines.append(f"{name:<{name_width}}  {category:<10} {calls:>5} "
+                         f"{wall:>9.3f} {cpu:>9.3f} {rss / 2**20:>14.1f}")
+
+        return "\n".join(lines)
+
+
+_profiler: Profiler | None = None
+
+def set_profiler(profiler: Profiler | None) -> None:
+    global _profiler
+    _profiler = profiler
+
+def get_profiler() -> Profiler | None:
+    return _profiler
+
+def init_worker(enabled: bool) -> None:
+    """
+    Set up profiling in a pool worker process. Workers should send the
+    results of take_worker_records() back to the parent for merging.
+    """
+
+    # Forked workers inherit the parent's profiler, so always replace it
+    set_profiler(Profiler() if enabled else None)
+
+def take_worker_records() -> list[dict[str, Any]]:
+    if _profiler is None:
+        return []
+
+    return _profiler.take_records()
+
+@contextmanager
+def stage(name: str, category: str = "build", **args: Any) -> Iterator[None]:
+    """
+    Record a stage with the active profiler, if there is one
+    """
+
+    if _profiler is None:
+        yield
+    else:
+        with _profiler.stage(name, category, **args):
+            yield
+
+
+P = ParamSpec("P")
+R = TypeVar("R")
+
+def profiled(category: str = "build") -> Callable[[Callable[P, R]], Callable[P, R]]:
+    """
+    Decorator to record each call of a function as a stage
+    """
+
+    def decorator(fn: Callable[P, R]) -> Callable[P, R]:
+        @functools.wraps(fn)
+        def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+            with stage(fn.__name__, category):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
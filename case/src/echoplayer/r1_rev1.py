@@ -1,11 +1,9 @@
 #!/usr/bin/env python3
 
 import dataclasses
-import itertools
 import math as m
 from collections.abc import Callable
 from copy import copy
-from dataclasses import dataclass
 from build123d import (
     Align,
     Axis,
@@ -20,6 +18,7 @@ from build123d import (
     Pos,
     Rectangle,
     RectangleRounded,
+    Rot,
     Sketch,
     Vector,
     extrude,
@@ -29,511 +28,30 @@ from build123d import (
     make_face,
 )
 
+from .cache import PartCache
+from .constraints import check_constraints
+from .csg import Csg
+from .parts import DatumGraph, DatumSetSpec, PartInputs, build_parts, resolve_datums
+from .profiling import profiled
+from .r1_rev1_params import (
+    CONSTRAINTS,
+    DOME_BUTTON_TABLE,
+    PARTS,
+    SIDE_BUTTON_TABLE,
+    DpadButtonParams,
+    Params,
+    PcbParams,
+    dome_button_model_name,
+    dome_button_name,
+    get_params,
+    pcb_button_name,
+    side_button_model_name,
+    side_button_name,
+)
 from .utils import Object, DatumSet, plane_at
 
 
-@dataclass
-class LcdParams:
-    module_width: float
-    module_height: float
-    module_thickness: float
-    module_side_clearance: float
-    module_front_clearance: float
-    module_back_clearance: float
-    module_support_thickness: float
-    module_support_gap_size: float
-    cover_thickness: float
-    cover_support_size: float
-    cover_back_clearance: float
-    cover_side_clearance: float
-    bezel_size: float
-
-    @property
-    def module_pocket_width(self) -> float:
-        return self.module_width + self.module_side_clearance*2
-
-    @property
-    def module_pocket_height(self) -> float:
-        return self.module_height + self.module_side_clearance*2
-
-    @property
-    def module_pocket_depth(self) -> float:
-        return (self.module_thickness +
-                self.module_front_clearance +
-                self.module_back_clearance)
-
-    @property
-    def cover_pocket_width(self) -> float:
-        return (self.module_pocket_width +
-                self.cover_support_size*2 +
-                self.cover_side_clearance*2)
-
-    @property
-    def cover_pocket_height(self) -> float:
-        return (self.module_pocket_height +
-                self.cover_support_size +
-                self.cover_side_clearance)
-
-    @property
-    def cover_pocket_depth(self) -> float:
-        return self.cover_thickness + self.cover_back_clearance
-
-    @property
-    def cover_width(self) -> float:
-        return self.cover_pocket_width - self.cover_side_clearance*2
-
-    @property
-    def cover_height(self) -> float:
-        return self.cover_pocket_height - self.cover_side_clearance*2
-
-@dataclass
-class HoleParams:
-    d: float
-    x: float
-    y: float
-
-@dataclass
-class ButtonPosParams:
-    x: float
-    y: float
-
-@dataclass
-class PcbParams:
-    width: float
-    height: float
-    thickness: float
-
-    clearance_top: float
-    clearance_bottom: float
-    clearance_front: float
-
-    edge_clearance_front: float
-
-    lo_jack_dx: float
-    hp_jack_dx: float
-    usbc_conn_dx: float
-    card_conn_dx: float
-
-    vol_button_dx: float
-    vol_up_button_dy: float
-    vol_dn_button_dy: float
-    power_button_dx: float
-    power_button_dy: float
-    hold_sw_pos1_dx: float
-    hold_sw_pos2_dx: float
-
-    buttons: dict[str, ButtonPosParams]
-    holes: dict[str, HoleParams]
-
-    @property
-    def hold_sw_center_dx(self) -> float:
-        return (self.hold_sw_pos1_dx + self.hold_sw_pos2_dx) / 2
-
-@dataclass
-class DpadButtonParams:
-    width: float
-    height: float
-    center_to_origin_dist: float
-    center_to_top_dist: float
-    edge_to_diagonal_dist: float
-
-@dataclass
-class ContactDomeParams:
-    height: float
-    tip_height: float
-    tip_diameter: float
-    rim_diameter: float
-    travel: float
-
-@dataclass
-class Params:
-    lcd: LcdParams
-    pcb: PcbParams
-
-    outer_depth: float
-
-    wall_thickness_top: float
-    wall_thickness_bottom: float
-    wall_thickness_front: float
-    wall_thickness_back: float
-    wall_thickness_side: float
-
-    h3_support_diameter: float
-    volume_support_diameter: float
-    h5_support_diameter: float
-    dpad_support_diameter: float
-
-    debug_header_dx: float
-    debug_header_width: float
-    debug_header_height: float
-    debug_header_clearance_side: float
-
-    jack_diameter: float
-    jack_diameter_clearance: float
-
-    usbc_width: float
-    usbc_height: float
-    usbc_flat_side_length: float
-    usbc_clearance: float
-
-    card_width: float
-    card_height: float
-    card_corner_radius: float
-    card_clearance: float
-    card_slot_dz: float
-
-    support_screw_diameter: float
-    support_screw_head_diameter: float
-    support_heat_insert_diameter: float
-    support_screw_depth: float
-
-    face_button_diameter: dict[str, float]
-    dpad_button: DpadButtonParams
-
-    contact_dome: ContactDomeParams
-    face_button_lip_size: float
-    face_button_lip_height: float
-    face_button_case_clearance: float
-    face_button_dome_tip_clearance: float
-
-    startsel_button_smd_height: float
-    startsel_button_outer_height: float
-
-    side_pcb_button_body_width: float
-    side_pcb_button_body_height: float
-    side_pcb_button_body_depth: float
-    side_pcb_button_presser_width: float
-    side_pcb_button_presser_height: float
-    side_pcb_button_presser_depth: float
-
-    side_button_width: float
-    side_button_height: float
-    side_button_corner_radius: float
-    side_button_clearance: float
-    side_button_inner_clearance: float
-    side_button_lip_pocket_depth: float
-
-    side_button_presser_width: float
-    side_button_presser_height: float
-    side_button_presser_length: float
-    side_button_lip_size: float
-    side_button_lip_chamfer_size: float
-    side_button_lip_extra_length: float
-    side_button_outer_extra_length: float
-
-    side_button_support_dz: float
-    side_button_support_pcb_clearance: float
-    side_button_support_width: float
-    side_button_support_depth: float
-
-    battery_dx: float
-    battery_dy: float
-    battery_dz: float
-    battery_width: float
-    battery_height: float
-    battery_thickness: float
-
-    bconn_dx: float
-    bconn_dy: float
-    bconn_width: float
-    bconn_height: float
-    bconn_depth: float
-
-    batt_spring_dist: float
-    batt_spring_tolerance: float
-
-    battbox_thickness: float
-    battbox_depth: float
-    battbox_clearance_xz: float
-    battbox_clearance_y: float
-    bconn_clearance: float
-
-    battframe_thickness: float
-    battframe_wall_height: float
-    battframe_support_diameter: float
-    battframe_support_hole_diameter: float
-    battframe_support_above_hole_diameter: float
-    battframe_support_z_clearance: float
-    battframe_connector_y_clearance: float
-
-    lshell_wall_clearance: float
-    lshell_shadowline_depth: float
-    lshell_cornersquare_thickness: float
-    lshell_cornersquare_diameter: float
-    lshell_cornersquare_y_extend: float
-    lshell_debugheader_side_clearance: float
-    lshell_debugheader_top_clearance: float
-
-    @property
-    def pcb_attachment_offset_dx(self) -> float:
-        return (self.inner_width - self.pcb.width)/2
-
-    @property
-    def inner_width(self) -> float:
-        return self.outer_width - self.wall_thickness_side*2
-
-    @property
-    def inner_height(self) -> float:
-        return (self.pcb.height +
-                self.pcb.clearance_top +
-                self.pcb.clearance_bottom)
-
-    @property
-    def inner_origin_dx(self) -> float:
-        return self.wall_thickness_side
-
-    @property
-    def inner_origin_dy(self) -> float:
-        return self.wall_thickness_bottom
-
-    @property
-    def outer_width(self) -> float:
-        return self.lcd.cover_pocket_width + self.lcd.bezel_size*2
-
-    @property
-    def outer_height(self) -> float:
-        return (self.inner_height +
-                self.wall_thickness_bottom +
-                self.wall_thickness_top)
-
-    @property
-    def jack_slot_radius(self) -> float:
-        return self.jack_diameter/2 + self.jack_diameter_clearance
-
-    @property
-    def jack_slot_dz(self) -> float:
-        return self.jack_diameter/2
-
-    @property
-    def usbc_corner_radius(self) -> float:
-        return (self.usbc_height - self.usbc_flat_side_length) / 2
-
-    @property
-    def usbc_slot_width(self) -> float:
-        return self.usbc_width + self.usbc_clearance*2
-
-    @property
-    def usbc_slot_height(self) -> float:
-        return self.usbc_height + self.usbc_clearance*2
-
-    @property
-    def usbc_slot_corner_radius(self) -> float:
-        return self.usbc_corner_radius + self.usbc_clearance
-
-    @property
-    def usbc_slot_dz(self) -> float:
-        return self.usbc_height/2
-
-    @property
-    def card_slot_width(self) -> float:
-        return self.card_width + self.card_clearance*2
-
-    @property
-    def card_slot_height(self) -> float:
-        return self.card_height + self.card_clearance*2
-
-    @property
-    def card_slot_corner_radius(self) -> float:
-        return self.card_corner_radius + self.card_clearance
-
-    @property
-    def side_button_lip_width(self) -> float:
-        return self.side_button_width + 2*(self.side_button_lip_size + self.side_button_clearance)
-
-    @property
-    def side_button_lip_height(self) -> float:
-        return self.side_button_height + 2*(self.side_button_lip_size + self.side_button_clearance)
-
-
-def get_params() -> Params:
-    abxy_button_diameter = 7
-    startsel_button_diameter = 4
-
-    dpad_center_x = 27.5
-    dpad_center_y = 25.5
-    dpad_button_to_center_dist = 10
-
-    return Params(
-        lcd = LcdParams(
-            module_width = 50.9,
-            module_height = 45.8,
-            module_thickness = 2.4,
-            module_side_clearance = 0.5,
-            module_front_clearance = 0.4,
-            module_back_clearance = 0.2,
-            module_support_thickness = 1.4,
-            module_support_gap_size = 5.0,
-            cover_thickness = 1.0,
-            cover_support_size = 3.5,
-            cover_back_clearance = 0.1,
-            cover_side_clearance = 0.2,
-            bezel_size = 1.5,
-        ),
-        pcb = PcbParams(
-            width = 55,
-            height = 95,
-            thickness = 1.6,
-            clearance_top = 0.8,
-            clearance_bottom = 0.2,
-            clearance_front = 3,
-            edge_clearance_front = 0.6,
-            lo_jack_dx = 5,
-            hp_jack_dx = 15,
-            usbc_conn_dx = 27.5,
-            card_conn_dx = 46.9,
-            vol_button_dx = 51.15,
-            vol_up_button_dy = 77.5,
-            vol_dn_button_dy = 62.5,
-            power_button_dx = 7.5,
-            power_button_dy = 91.15,
-            hold_sw_pos1_dx = 16.7,
-            hold_sw_pos2_dx = 18.3,
-            buttons = {
-                "a":          ButtonPosParams(x=49.0, y=35.0),
-                "b":          ButtonPosParams(x=40.0, y=41.0),
-                "x":          ButtonPosParams(x= 6.0, y=35.0),
-                "y":          ButtonPosParams(x=15.0, y=41.0),
-                "start":      ButtonPosParams(x=42.8, y= 5.5),
-                "select":     ButtonPosParams(x=12.2, y= 5.5),
-                "dpad_up":    ButtonPosParams(x=dpad_center_x,
-                                              y=dpad_center_y + dpad_button_to_center_dist),
-                "dpad_down":  ButtonPosParams(x=dpad_center_x,
-                                              y=dpad_center_y - dpad_button_to_center_dist),
-                "dpad_left":  ButtonPosParams(x=dpad_center_x - dpad_button_to_center_dist,
-                                              y=dpad_center_y),
-                "dpad_right": ButtonPosParams(x=dpad_center_x + dpad_button_to_center_dist,
-                                              y=dpad_center_y),
-            },
-            holes = {
-                "dpad":   HoleParams(d=4.0, x=dpad_center_x, y=dpad_center_y),
-                "volume": HoleParams(d=4.0, x=51.0, y=70.00),
-                "h3":     HoleParams(d=2.2, x= 4.0, y=86.00),
-                "h5":     HoleParams(d=2.2, x=35.0, y= 2.00),
-                "h6":     HoleParams(d=2.2, x=13.0, y=31.75)
-            },
-        ),
-        wall_thickness_top = 2,
-        wall_thickness_bottom = 2,
-        wall_thickness_front = 2,
-        wall_thickness_back = 2,
-        wall_thickness_side = 2.4,
-        outer_depth = 21.1,
-        h3_support_diameter = 7,
-        volume_support_diameter = 8,
-        h5_support_diameter = 4.8,
-        dpad_support_diameter = 6,
-        debug_header_dx = 0.73,
-        debug_header_height = 2.5,
-        debug_header_width = 15.24,
-        debug_header_clearance_side = 0.5,
-        jack_diameter = 5,
-        jack_diameter_clearance = 0.5,
-        usbc_width = 8.94,
-        usbc_height = 3.26,
-        usbc_flat_side_length = 0.7,
-        usbc_clearance = 0.5,
-        card_width = 12,
-        card_height = 1.8,
-        card_corner_radius = 0.5,
-        card_clearance = 0.5,
-        card_slot_dz = 1.8,
-        support_screw_diameter = 2,
-        support_screw_head_diameter = 3.8,
-        support_heat_insert_diameter = 3,
-        support_screw_depth = 3,
-        face_button_diameter = {
-            "a": abxy_button_diameter,
-            "b": abxy_button_diameter,
-            "x": abxy_button_diameter,
-            "y": abxy_button_diameter,
-            "start": startsel_button_diameter,
-            "select": startsel_button_diameter,
-        },
-        dpad_button = DpadButtonParams(
-            width = 9,
-            height = 8.5,
-            center_to_origin_dist = dpad_button_to_center_dist,
-            center_to_top_dist = 3.5,
-            edge_to_diagonal_dist = 2,
-        ),
-        contact_dome = ContactDomeParams(
-            height = 5,
-            tip_height = 2.2,
-            tip_diameter = 3,
-            rim_diameter = 5,
-            travel = 2,
-        ),
-        face_button_lip_size = 1,
-        face_button_lip_height = 1.4,
-        face_button_case_clearance = 0.25,
-        face_button_dome_tip_clearance = 0.1,
-        startsel_button_smd_height = 2.4, # includes case clearance
-        startsel_button_outer_height = 1.5,
-        side_pcb_button_body_width = 4.7,
-        side_pcb_button_body_height = 2.3,
-        side_pcb_button_body_depth = 1.9,
-        side_pcb_button_presser_width = 1.8,
-        side_pcb_button_presser_height = 1.2,
-        side_pcb_button_presser_depth = 0.8,
-        side_button_width = 10,
-        side_button_height = 2.5,
-        side_button_corner_radius = 1,
-        side_button_clearance = 0.3,
-        side_button_inner_clearance = 0.5,
-        # Lip pocket depth minus extra length needs
-        # to be >= PCB button face to PCB edge distance
-        side_button_lip_pocket_depth = 1,
-        side_button_presser_width = 4,
-        side_button_presser_height = 1.5,
-        # Presser length needs to be >= A+B where
-        #   A = PCB button face to PCB edge distance
-        #   B = PCB button travel distance
-        side_button_presser_length = 1,
-        side_button_lip_size = 0.5,
-        side_button_lip_chamfer_size = 0.5,
-        # Extra length added to lip to increase part thickness
-        side_button_lip_extra_length = 0.2,
-        # Must be >= PCB button travel distance
-        side_button_outer_extra_length = 1.0,
-        side_button_support_dz = 0.3,
-        side_button_support_pcb_clearance = 0.3,
-        side_button_support_width = 15,
-        side_button_support_depth = 6,
-
-        battery_dx = 17.2,
-        battery_dy = 28.7,
-        battery_dz = 2.8,
-        battery_width = 34.3,
-        battery_height = 53.5,
-        battery_thickness = 5.8,
-        bconn_dx = 39.5,
-        bconn_dy = 24.4,
-        bconn_width = 9,
-        bconn_height = 3.5,
-        bconn_depth = 6.8,
-        batt_spring_dist = 0.8,
-        batt_spring_tolerance = 0.2,
-        battbox_thickness = 2,
-        battbox_depth = 2,
-        battbox_clearance_xz = 0.4,
-        battbox_clearance_y = 0.1,
-        bconn_clearance = 0.8,
-        battframe_thickness = 1,
-        battframe_wall_height = 3.5,
-        battframe_support_diameter = 3.8,
-        battframe_support_hole_diameter = 2.2,
-        battframe_support_above_hole_diameter = 10,
-        battframe_support_z_clearance = 0.2,
-        battframe_connector_y_clearance = 2,
-        lshell_wall_clearance = 0.3,
-        lshell_shadowline_depth = 1.0,
-        lshell_cornersquare_diameter = 6,
-        lshell_cornersquare_y_extend = 3,
-        lshell_cornersquare_thickness = 2.5,
-        lshell_debugheader_top_clearance = 0.3,
-        lshell_debugheader_side_clearance = 0.3,
-    )
-
+@profiled("datums")
 def get_pcb_datums(params: Params) -> DatumSet:
     ds = DatumSet()
 
@@ -654,6 +172,7 @@ def get_pcb_datums(params: Params) -> DatumSet:
 
     return ds
 
+@profiled("datums")
 def get_upper_shell_datums(params: Params,
                            pcb_ds: DatumSet) -> DatumSet:
     ds = DatumSet()
@@ -772,6 +291,7 @@ def get_upper_shell_datums(params: Params,
 
     return ds
 
+@profiled("datums")
 def get_lower_shell_datums(params: Params,
                            ushell_ds: DatumSet) -> DatumSet:
     ds = DatumSet()
@@ -790,6 +310,7 @@ def get_lower_shell_datums(params: Params,
 
     return ds
 
+@profiled("datums")
 def get_battery_frame_datums(params: Params,
                              ushell_ds: DatumSet) -> DatumSet:
     ds = DatumSet()
@@ -809,6 +330,7 @@ def get_battery_frame_datums(params: Params,
     return ds
 
 
+@profiled("make")
 def make_dpad_arrow_face(width: float,
                          height: float,
                          center_to_origin_dist: float,
@@ -842,6 +364,7 @@ def make_dpad_arrow_face(width: float,
 
     return make_face([Line(v, vn) for v, vn in zip(verts, verts[1:])])
 
+@profiled("make")
 def make_side_button_face(width: float,
                           height: float,
                           corner_radius: float,
@@ -853,6 +376,7 @@ def make_side_button_face(width: float,
 
     return RectangleRounded(width, height, corner_radius)
 
+@profiled("make")
 def make_side_button_inner_face(width: float,
                                 height: float,
                                 chamfer_size: float,
@@ -867,6 +391,7 @@ def make_side_button_inner_face(width: float,
 
 
 
+@profiled("make")
 def make_upper_shell(params: Params, datums: DatumSet) -> Compound:
     # Flag for LCD cover / no cover
     has_lcd_cover = True
@@ -1006,10 +531,10 @@ def make_upper_shell(params: Params, datums: DatumSet) -> Compound:
                 amount = -params.wall_thickness_bottom)
     )
 
-    # Make the front wall a reasonable thickness
+    # Make the front wall a reasonable thickness (the pocket is always
+    # deeper than the wall, see CONSTRAINTS)
     lower_inner_pocket_maxdepth = (datums.outer_wall_front.origin.Z -
                                    datums.lcd_support_back.origin.Z)
-    assert lower_inner_pocket_maxdepth > params.wall_thickness_front
 
     lower_inner_pocket_pcb_edge_offset_x = params.pcb_attachment_offset_dx + params.pcb.edge_clearance_front
     lower_inner_pocket_pcb_edge_offset_y = params.pcb.clearance_bottom + params.pcb.edge_clearance_front
@@ -1115,6 +640,7 @@ def make_upper_shell(params: Params, datums: DatumSet) -> Compound:
 
     # Cut holes for face buttons
     face_button_holes = []
+    button_pos = datums.get_points("pcb_button_*_pos")
 
     for b_name in params.pcb.buttons:
         diam = params.face_button_diameter.get(b_name)
@@ -1123,7 +649,7 @@ def make_upper_shell(params: Params, datums: DatumSet) -> Compound:
 
         face_button_holes.append(
             plane_at(datums.outer_wall_front,
-                     projected_origin = datums.point(f"pcb_button_{b_name}_pos")) *
+                     projected_origin = button_pos[f"pcb_button_{b_name}_pos"]) *
             Cylinder(
                 radius = diam/2,
                 height = params.wall_thickness_front,
@@ -1143,7 +669,7 @@ def make_upper_shell(params: Params, datums: DatumSet) -> Compound:
     for b_name, rotation in dpad_button_data:
         face_button_holes.append(
             plane_at(datums.outer_wall_front,
-                     projected_origin = datums.point(f"pcb_button_{b_name}_pos")) *
+                     projected_origin = button_pos[f"pcb_button_{b_name}_pos"]) *
             extrude(
                 dpad_button_face.rotate(Axis.Z, rotation),
                 amount = -params.wall_thickness_front,
@@ -1225,10 +751,12 @@ def make_upper_shell(params: Params, datums: DatumSet) -> Compound:
         corner_holes.append(Pos(pos) * hole)
 
     # CSG to generate case
+    csg = Csg(shell, "upper-shell")
+
     if has_lcd_cover:
-        shell -= lcd_cover_pocket
+        csg.cut(lcd_cover_pocket)
 
-    shell -= itertools.chain(
+    csg.cut(
         face_button_holes,
         side_button_holes,
         corner_holes,
@@ -1245,31 +773,30 @@ def make_upper_shell(params: Params, datums: DatumSet) -> Compound:
         ],
     )
 
-    shell += itertools.chain(
+    csg.fuse(
         upper_pcb_supports,
         lower_pcb_supports,
         side_button_supports,
-        [
-            lower_pcb_edge_support,
-        ]
+        lower_pcb_edge_support,
     )
 
-    shell -= support_holes
+    csg.cut(support_holes)
 
-    return shell
+    return csg.result()
 
 
+@profiled("make")
 def make_lower_shell(params: Params, datums: DatumSet) -> Compound:
-    shell = Box(
+    shell = Csg(Box(
         datums.box_dimension("plate", "x"),
         datums.box_dimension("plate", "y"),
         datums.box_dimension("plate", "z"),
         align = Align.MIN,
-    )
+    ), "lower-shell")
 
     # Shadow line to minimize visibility of seam with front shell
     pos = datums.ushell.inner_origin.project_to_plane(datums.plate_front)
-    shell += (
+    shell.fuse(
         Pos(X = pos.X + params.lshell_wall_clearance,
             Y = pos.Y + params.lshell_wall_clearance,
             Z = datums.box_dimension("plate", "z")) *
@@ -1283,7 +810,7 @@ def make_lower_shell(params: Params, datums: DatumSet) -> Compound:
 
     # Plate for covering debug header
     pos = datums.ushell.pcb.debug_header_left.origin.project_to_plane(datums.plate_front)
-    shell += (
+    shell.fuse(
         Pos(X = pos.X, Z = pos.Z) *
         Pos(X = params.lshell_debugheader_side_clearance,
             Y = datums.ushell.box_dimension("outer_wall", "y")) *
@@ -1301,7 +828,7 @@ def make_lower_shell(params: Params, datums: DatumSet) -> Compound:
     )
 
     # Battery box
-    battbox = (
+    battbox = Csg(
         Pos(datums.ushell.pcb_battery_origin.project_to_plane(datums.plate_front)) *
         Pos(X = -params.battbox_thickness,
             Y = -params.battbox_thickness) *
@@ -1310,7 +837,8 @@ def make_lower_shell(params: Params, datums: DatumSet) -> Compound:
             datums.ushell.box_dimension("pcb_battery", "y") + params.battbox_thickness*2,
             params.battbox_depth,
             align = Align.MIN,
-        )
+        ),
+        "battery-box",
     )
 
     # Space for the battery
@@ -1327,17 +855,14 @@ def make_lower_shell(params: Params, datums: DatumSet) -> Compound:
         )
     )
 
-    shell -= battbox_hole
-    battbox -= battbox_hole
+    shell.cut(battbox_hole)
+    battbox.cut(battbox_hole)
 
-    # Battery connector
+    # Battery connector (spring compression is checked by CONSTRAINTS)
     bconn_to_batt_dist_y = (datums.ushell.pcb.battery_bottom.origin.Y -
                             datums.ushell.pcb.bconn_top.origin.Y)
 
-    # Specified spring compression is 0.8mm +/- 0.2mm
-    assert abs(bconn_to_batt_dist_y - params.batt_spring_dist) <= params.batt_spring_tolerance
-
-    battbox -= (
+    battbox.cut(
         Pos(datums.ushell.pcb_bconn_origin.project_to_plane(datums.ushell.pcb_bconn_back)) *
         Pos(X = -params.bconn_clearance,
             Y = -params.bconn_clearance,
@@ -1384,25 +909,26 @@ def make_lower_shell(params: Params, datums: DatumSet) -> Compound:
 
         squares.append(Pos(pos) * msquare)
 
-    shell += itertools.chain(
+    shell.fuse(
         squares,
-        battbox,
+        battbox.result(),
     )
 
-    return shell
+    return shell.result()
 
+@profiled("make")
 def make_battery_frame(params: Params, datums: DatumSet) -> Compound:
     thickness = params.battframe_thickness + params.battframe_wall_height
 
     # Main body supporting the battery
-    frame = Box(
+    frame = Csg(Box(
         datums.ushell.box_dimension("pcb_battery", "x") + params.battbox_thickness*2,
         datums.ushell.box_dimension("pcb_battery", "y") + params.battbox_thickness*2,
         thickness,
         align = Align.MIN,
-    )
+    ), "battery-frame")
 
-    frame -= (
+    frame.cut(
         Pos(X = params.battbox_thickness,
             Y = params.battbox_thickness) *
         Box(
@@ -1415,7 +941,7 @@ def make_battery_frame(params: Params, datums: DatumSet) -> Compound:
 
     # Avoid volume up/down buttons
     for pos in (datums.ushell.pcb.button_vol_up_pos, datums.ushell.pcb.button_vol_dn_pos):
-        frame -= (
+        frame.cut(
             Pos(X = pos.X - params.bconn_clearance,
                 Y = pos.Y) *
             Box(
@@ -1435,7 +961,7 @@ def make_battery_frame(params: Params, datums: DatumSet) -> Compound:
 
     for pos, zoffset in table:
         loc = Pos(X = pos.X, Y = pos.Y, Z = zoffset)
-        frame += loc * (
+        frame.fuse(loc * (
             Pos(Y = params.battframe_support_diameter/4) *
             Box(
                 params.battframe_support_diameter,
@@ -1448,62 +974,62 @@ def make_battery_frame(params: Params, datums: DatumSet) -> Compound:
                 support_length - zoffset,
                 align = (Align.CENTER, Align.CENTER, Align.MIN),
             )
-        )
+        ))
 
         # add this to volume support for pressing the PCB down
         if zoffset != 0:
-            frame += loc * Cylinder(
+            frame.fuse(loc * Cylinder(
                 params.battframe_support_diameter/2 + 0.6,
                 support_length - zoffset - 1.4,
                 align = (Align.CENTER, Align.CENTER, Align.MIN),
-            )
+            ))
 
-            frame -= loc * Pos(Z = -zoffset) * Box(
+            frame.cut(loc * Pos(Z = -zoffset) * Box(
                 params.battframe_support_above_hole_diameter,
                 params.battframe_support_above_hole_diameter,
                 zoffset,
                 align = (Align.CENTER, Align.CENTER, Align.MIN),
-            )
+            ))
 
             # HACK provide clearance between head of screw and battery
             s_head_thickness = 0.6
 
-            frame -= loc * Cylinder(
+            frame.cut(loc * Cylinder(
                 radius = 6,
                 height = s_head_thickness,
                 align = (Align.CENTER, Align.CENTER, Align.MIN),
-            )
+            ))
 
             # reinforce very thin piece created by above hack
             for dy in (-1.85, 1.85):
-                frame += loc * Pos(Y = dy, Z = s_head_thickness) * Box(
+                frame.fuse(loc * Pos(Y = dy, Z = s_head_thickness) * Box(
                     5, 5, 1.8,
                     align = (Align.CENTER, Align.CENTER, Align.MIN),
-                )
+                ))
 
             # main reinforcement
-            frame += loc * Pos(X = -0.65, Z = s_head_thickness) * Box(
+            frame.fuse(loc * Pos(X = -0.65, Z = s_head_thickness) * Box(
                 5, 18, 1.8,
                 align = (Align.MAX, Align.CENTER, Align.MIN),
-            )
+            ))
         else:
             # HACK needed so dpad pivot screw isn't overly long
-            frame -= loc * Box(
+            frame.cut(loc * Box(
                 5, 8, 1.5,
                 align = (Align.CENTER, Align.CENTER, Align.MIN),
-            )
+            ))
 
-        frame -= loc * Cylinder(
+        frame.cut(loc * Cylinder(
             params.battframe_support_hole_diameter/2,
             support_length,
             align = (Align.CENTER, Align.CENTER, Align.MIN),
-        )
+        ))
 
     # Battery connector
     bconn_to_batt_dist_y = (datums.ushell.pcb.battery_bottom.origin.Y -
                             datums.ushell.pcb.bconn_top.origin.Y)
 
-    frame -= (
+    frame.cut(
         Pos(datums.ushell.pcb_bconn_origin.project_to_plane(datums.ushell.pcb_bconn_back)) *
         Pos(X = -params.bconn_clearance,
             Y = -params.bconn_clearance,
@@ -1518,7 +1044,7 @@ def make_battery_frame(params: Params, datums: DatumSet) -> Compound:
         )
     )
 
-    return frame
+    return frame.result()
 
 
 def mkface_dpad(params: DpadButtonParams,
@@ -1536,6 +1062,7 @@ def mkface_circle(diameter: float,
 
     return fn
 
+@profiled("make")
 def make_dome_button(
     mkface: Callable[[float], Sketch],
     dome_height: float,
@@ -1586,6 +1113,7 @@ def make_dome_button(
     # Assemble part
     return btn_part + lip_part + press_part - tip_hole
 
+@profiled("make")
 def make_startselect_button(
     mkface: Callable[[float], Sketch],
     smd_button_height: float,
@@ -1613,6 +1141,7 @@ def make_startselect_button(
     return btn_part + press_part
 
 
+@profiled("make")
 def make_dome_buttons(params: Params, upper_shell_datums: DatumSet) -> list[Object]:
     objects: list[Object] = []
 
@@ -1640,12 +1169,6 @@ def make_dome_buttons(params: Params, upper_shell_datums: DatumSet) -> list[Obje
                                  clearance = params.face_button_case_clearance)
     dpad_button = make_dome_button(mkface_dpad_fn, **dome_args)
 
-    objects.append(Object(
-        name = "button-dpad",
-        compound = dpad_button,
-        renderable = False,
-    ))
-
     # Now handle the ABXY buttons
     circ_dome_button_diameter = copy(params.face_button_diameter)
     del circ_dome_button_diameter["start"]
@@ -1687,52 +1210,39 @@ def make_dome_buttons(params: Params, upper_shell_datums: DatumSet) -> list[Obje
         for bdiam, mkface_startsel in mkface_startsel_fn.items()
     }
 
-    for diam, button in itertools.chain(circ_button.items(), startsel_button.items()):
-        objects.append(Object(
-            name = f"button-dome-circular-{diam}mm",
-            compound = button,
-            renderable = False,
-        ))
-
-    # Generate renderable buttons
-    dome_button_data = [
-        ("a",          0),
-        ("b",          0),
-        ("x",          0),
-        ("y",          0),
-        ("start",      0),
-        ("select",     0),
-        ("dpad_up",    0),
-        ("dpad_left",  90),
-        ("dpad_down",  180),
-        ("dpad_right", 270),
-    ]
-
-    for bname, rot_angle in dome_button_data:
-        if bname in "abxy":
-            button = circ_button[params.face_button_diameter[bname]]
-        elif bname in ["start", "select"]:
-            button = startsel_button[params.face_button_diameter[bname]]
+    def model_button(bname: str, model: str) -> Compound:
+        if model == "dpad":
+            return dpad_button
+        elif model == "circular":
+            return circ_button[params.face_button_diameter[bname]]
         else:
-            button = dpad_button
+            return startsel_button[params.face_button_diameter[bname]]
 
-        button = button.rotate(Axis.Z, rot_angle)
-        button = button.translate(upper_shell_datums.point(f"pcb_button_{bname}_pos"))
+    button_pos = upper_shell_datums.get_points("pcb_button_*_pos")
 
-        if bname not in ["start", "select"]:
-            button = button.translate(Vector(0, 0, params.contact_dome.height))
+    # One object per button model, with an instance for each button
+    models: dict[tuple[str, float], Object] = {}
+    for bname, model, rot_angle in DOME_BUTTON_TABLE:
+        key = (model, params.face_button_diameter.get(bname, 0))
+        obj = models.get(key)
+        if obj is None:
+            button = model_button(bname, model)
+            button.color = Color(0.6, 0.6, 0.6, 1)
+            obj = Object(name = dome_button_model_name(params, bname, model),
+                         compound = button)
+            models[key] = obj
+            objects.append(obj)
 
-        button.name = "button-" + bname.replace("_", "-")
-        button.color = Color(0.6, 0.6, 0.6, 1)
-        objects.append(Object(
-            name = button.name,
-            compound = button,
-            exportable = False,
-        ))
+        pos = button_pos[f"pcb_button_{bname}_pos"]
+        if model != "startsel":
+            pos = pos + Vector(0, 0, params.contact_dome.height)
+
+        obj.instances[dome_button_name(bname)] = Pos(pos) * Rot(Z = rot_angle)
 
     return objects
 
 
+@profiled("make")
 def make_side_button(params: Params,
                      wall_dist: float,
                      wall_thickness: float) -> Compound:
@@ -1765,6 +1275,7 @@ def make_side_button(params: Params,
     return part
 
 
+@profiled("make")
 def make_pcb(params: PcbParams,
              datums: DatumSet) -> Compound:
     pcb = Box(
@@ -1789,6 +1300,7 @@ def make_pcb(params: PcbParams,
     return pcb
 
 
+@profiled("make")
 def make_battery(params: Params) -> Compound:
     batt = (
         Pos(X = params.battery_thickness/2) *
@@ -1810,6 +1322,7 @@ def make_battery(params: Params) -> Compound:
 
     return batt
 
+@profiled("make")
 def make_battery_connector(params: Params) -> Compound:
     bconn = Box(params.bconn_width,
                 params.bconn_height,
@@ -1818,6 +1331,7 @@ def make_battery_connector(params: Params) -> Compound:
 
     return bconn
 
+@profiled("make")
 def make_side_pcb_button(params: Params) -> Compound:
     body = Box(params.side_pcb_button_body_width,
                params.side_pcb_button_body_height,
@@ -1835,41 +1349,66 @@ def make_side_pcb_button(params: Params) -> Compound:
 
     return body
 
-def build() -> list[Object]:
-    objects: list[Object] = []
-    params = get_params()
-    pcb_ds = get_pcb_datums(params)
-    ushell_ds = get_upper_shell_datums(params, pcb_ds)
-    lshell_ds = get_lower_shell_datums(params, ushell_ds)
-    bframe_ds = get_battery_frame_datums(params, ushell_ds)
+DATUM_SETS = [
+    DatumSetSpec("pcb",    get_pcb_datums),
+    DatumSetSpec("ushell", get_upper_shell_datums,   deps=("pcb",)),
+    DatumSetSpec("lshell", get_lower_shell_datums,   deps=("ushell",)),
+    DatumSetSpec("bframe", get_battery_frame_datums, deps=("ushell",)),
+]
+
+def get_datums(params: Params) -> dict[str, DatumSet]:
+    return resolve_datums(DATUM_SETS, params)
+
+def build_upper_shell(params: Params,
+                      datums: dict[str, DatumSet]) -> list[Object]:
+    ushell_ds = datums["ushell"]
 
     upper_shell = make_upper_shell(params, ushell_ds)
     upper_shell.color = Color(0.8, 0.8, 0.8, 1)
-    objects.append(Object(
+
+    return [Object(
         name = "upper-shell",
         compound = upper_shell,
         datums = ushell_ds,
-    ))
+    )]
+
+def build_lower_shell(params: Params,
+                      datums: dict[str, DatumSet]) -> list[Object]:
+    lshell_ds = datums["lshell"]
 
     lshell_loc = lshell_ds.get_ref("ushell").loc.inverse()
     lower_shell = lshell_loc * make_lower_shell(params, lshell_ds)
     lower_shell.color = Color(0.7, 0.5, 0.5, 1)
-    objects.append(Object(
+
+    return [Object(
         name = "lower-shell",
         datums = lshell_ds,
         datums_xform = lshell_loc,
         compound = lower_shell,
-    ))
+    )]
+
+def build_battery_frame(params: Params,
+                        datums: dict[str, DatumSet]) -> list[Object]:
+    bframe_ds = datums["bframe"]
 
     bframe_loc = bframe_ds.get_ref("ushell").loc.inverse()
     bframe = bframe_loc * make_battery_frame(params, bframe_ds)
     bframe.color = Color(0.5, 0.5, 0.7, 1)
-    objects.append(Object(
+
+    return [Object(
         name = "battery-frame",
         compound = bframe,
-    ))
+    )]
 
-    objects += make_dome_buttons(params, ushell_ds)
+def build_dome_buttons(params: Params,
+                       datums: dict[str, DatumSet]) -> list[Object]:
+    return make_dome_buttons(params, datums["ushell"])
+
+def build_mockups(params: Params,
+                  datums: dict[str, DatumSet]) -> list[Object]:
+    objects: list[Object] = []
+    pcb_ds = datums["pcb"]
+    ushell_ds = datums["ushell"]
 
     pcb = Pos(ushell_ds.pcb_back_origin) * make_pcb(params.pcb, pcb_ds)
     pcb.color = Color(0.2, 0.8, 0.2, 1)
@@ -1897,8 +1436,25 @@ def build() -> list[Object]:
         manufacturable = False,
     ))
 
-
     side_pcb_button = make_side_pcb_button(params)
+    side_pcb_button.color = Color(0.6, 0.6, 0.6, 1)
+    pcb_buttons = Object(
+        name = "pcb-button",
+        compound = side_pcb_button,
+        manufacturable = False,
+    )
+    objects.append(pcb_buttons)
+
+    for name, _, angle, dname in SIDE_BUTTON_TABLE:
+        pcb_pos = ushell_ds.pcb.get_point(f"button_{dname}_pos")
+        pcb_buttons.instances[pcb_button_name(name)] = Pos(pcb_pos) * Rot(Z = angle)
+
+    return objects
+
+def build_side_buttons(params: Params,
+                       datums: dict[str, DatumSet]) -> list[Object]:
+    objects: list[Object] = []
+    ushell_ds = datums["ushell"]
 
     wall_dist_vol = abs(ushell_ds.pcb.button_vol_up_press_pos.X - ushell_ds.inner_wall_right.origin.X)
     wall_dist_pwr = abs(ushell_ds.pcb.button_power_press_pos.Y - ushell_ds.inner_wall_top.origin.Y)
@@ -1906,35 +1462,28 @@ def build() -> list[Object]:
     side_vol_button = make_side_button(params, wall_dist_vol, params.wall_thickness_side)
     side_pwr_button = make_side_button(params, wall_dist_pwr, params.wall_thickness_top)
 
-    table = (
-        ("volume-up",   -90, "vol_up", side_vol_button, False, True),
-        ("volume-down", -90, "vol_dn", side_vol_button, False, True),
-        ("volume",        0, "vol_up", side_vol_button, True,  False),
-        ("power",         0, "power",  side_pwr_button, True,  True),
-    )
+    # Exported buttons are the models, which rendered buttons are
+    # instances of
+    bodies = {"power": side_pwr_button, "volume": side_vol_button}
+    models: dict[str, Object] = {}
+    for name, model, angle, dname in SIDE_BUTTON_TABLE:
+        if model not in models:
+            bodies[model].color = Color(0.2, 0.2, 0.2, 1)
+            models[model] = Object(name = side_button_model_name(model), compound = bodies[model])
+            objects.append(models[model])
 
-    for name, angle, dname, body, _, rendered in table:
-        if not rendered:
-            continue
-
-        pcb_pos = ushell_ds.pcb.get_point(f"button_{dname}_pos")
-        pcb_btn = Pos(pcb_pos) * side_pcb_button.rotate(Axis.Z, angle)
-        pcb_btn.color = Color(0.6, 0.6, 0.6, 1)
-        objects.append(Object(
-            name = f"pcb-button-{name}",
-            compound = pcb_btn,
-            manufacturable = False,
-        ))
-
-    for name, angle, dname, body, exported, rendered in table:
         press_pos = ushell_ds.pcb.get_point(f"button_{dname}_press_pos")
-        btn = Pos(press_pos) * body.rotate(Axis.Z, angle)
-        btn.color = Color(0.2, 0.2, 0.2, 1)
-        objects.append(Object(
-            name = f"button-{name}",
-            compound = btn,
-            exportable = exported,
-            renderable = rendered,
-        ))
+        models[model].instances[side_button_name(name)] = Pos(press_pos) * Rot(Z = angle)
 
     return objects
+
+def build(jobs: int = 1,
+          cache: PartCache | None = None,
+          only: list[str] | None = None,
+          datum_graph: DatumGraph | None = None,
+          deps: dict[str, PartInputs] | None = None) -> list[Object]:
+    params = get_params()
+    check_constraints(CONSTRAINTS, params)
+    return build_parts(PARTS, params, DATUM_SETS,
+                       jobs=jobs, cache=cache, only=only,
+                       datum_graph=datum_graph, deps=deps)
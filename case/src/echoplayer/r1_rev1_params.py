@@ -0,0 +1,648 @@
+"""
+Parameters and part table of the R1-Rev1 case
+
+These don't depend on build123d, so they can be loaded quickly to list
+parts or print parameters without importing the geometry kernel. The
+geometry itself is built by the r1_rev1 module.
+"""
+
+from dataclasses import dataclass
+
+from .constraints import Constraint, FieldConstraint
+from .parts import Part
+from .profiling import profiled
+
+
+@dataclass
+class LcdParams:
+    module_width: float
+    module_height: float
+    module_thickness: float
+    module_side_clearance: float
+    module_front_clearance: float
+    module_back_clearance: float
+    module_support_thickness: float
+    module_support_gap_size: float
+    cover_thickness: float
+    cover_support_size: float
+    cover_back_clearance: float
+    cover_side_clearance: float
+    bezel_size: float
+
+    @property
+    def module_pocket_width(self) -> float:
+        return self.module_width + self.module_side_clearance*2
+
+    @property
+    def module_pocket_height(self) -> float:
+        return self.module_height + self.module_side_clearance*2
+
+    @property
+    def module_pocket_depth(self) -> float:
+        return (self.module_thickness +
+                self.module_front_clearance +
+                self.module_back_clearance)
+
+    @property
+    def cover_pocket_width(self) -> float:
+        return (self.module_pocket_width +
+                self.cover_support_size*2 +
+                self.cover_side_clearance*2)
+
+    @property
+    def cover_pocket_height(self) -> float:
+        return (self.module_pocket_height +
+                self.cover_support_size +
+                self.cover_side_clearance)
+
+    @property
+    def cover_pocket_depth(self) -> float:
+        return self.cover_thickness + self.cover_back_clearance
+
+    @property
+    def cover_width(self) -> float:
+        return self.cover_pocket_width - self.cover_side_clearance*2
+
+    @property
+    def cover_height(self) -> float:
+        return self.cover_pocket_height - self.cover_side_clearance*2
+
+    @property
+    def stack_depth(self) -> float:
+        # Depth from the front of the case to the back of the LCD supports
+        return (self.cover_pocket_depth +
+                self.module_pocket_depth +
+                self.module_support_thickness)
+
+@dataclass
+class HoleParams:
+    d: float
+    x: float
+    y: float
+
+@dataclass
+class ButtonPosParams:
+    x: float
+    y: float
+
+@dataclass
+class PcbParams:
+    width: float
+    height: float
+    thickness: float
+
+    clearance_top: float
+    clearance_bottom: float
+    clearance_front: float
+
+    edge_clearance_front: float
+
+    lo_jack_dx: float
+    hp_jack_dx: float
+    usbc_conn_dx: float
+    card_conn_dx: float
+
+    vol_button_dx: float
+    vol_up_button_dy: float
+    vol_dn_button_dy: float
+    power_button_dx: float
+    power_button_dy: float
+    hold_sw_pos1_dx: float
+    hold_sw_pos2_dx: float
+
+    buttons: dict[str, ButtonPosParams]
+    holes: dict[str, HoleParams]
+
+    @property
+    def hold_sw_center_dx(self) -> float:
+        return (self.hold_sw_pos1_dx + self.hold_sw_pos2_dx) / 2
+
+@dataclass
+class DpadButtonParams:
+    width: float
+    height: float
+    center_to_origin_dist: float
+    center_to_top_dist: float
+    edge_to_diagonal_dist: float
+
+@dataclass
+class ContactDomeParams:
+    height: float
+    tip_height: float
+    tip_diameter: float
+    rim_diameter: float
+    travel: float
+
+@dataclass
+class Params:
+    lcd: LcdParams
+    pcb: PcbParams
+
+    outer_depth: float
+
+    wall_thickness_top: float
+    wall_thickness_bottom: float
+    wall_thickness_front: float
+    wall_thickness_back: float
+    wall_thickness_side: float
+
+    h3_support_diameter: float
+    volume_support_diameter: float
+    h5_support_diameter: float
+    dpad_support_diameter: float
+
+    debug_header_dx: float
+    debug_header_width: float
+    debug_header_height: float
+    debug_header_clearance_side: float
+
+    jack_diameter: float
+    jack_diameter_clearance: float
+
+    usbc_width: float
+    usbc_height: float
+    usbc_flat_side_length: float
+    usbc_clearance: float
+
+    card_width: float
+    card_height: float
+    card_corner_radius: float
+    card_clearance: float
+    card_slot_dz: float
+
+    support_screw_diameter: float
+    support_screw_head_diameter: float
+    support_heat_insert_diameter: float
+    support_screw_depth: float
+
+    face_button_diameter: dict[str, float]
+    dpad_button: DpadButtonParams
+
+    contact_dome: ContactDomeParams
+    face_button_lip_size: float
+    face_button_lip_height: float
+    face_button_case_clearance: float
+    face_button_dome_tip_clearance: float
+
+    startsel_button_smd_height: float
+    startsel_button_outer_height: float
+
+    side_pcb_button_body_width: float
+    side_pcb_button_body_height: float
+    side_pcb_button_body_depth: float
+    side_pcb_button_presser_width: float
+    side_pcb_button_presser_height: float
+    side_pcb_button_presser_depth: float
+
+    side_button_width: float
+    side_button_height: float
+    side_button_corner_radius: float
+    side_button_clearance: float
+    side_button_inner_clearance: float
+    side_button_lip_pocket_depth: float
+
+    side_button_presser_width: float
+    side_button_presser_height: float
+    side_button_presser_length: float
+    side_button_lip_size: float
+    side_button_lip_chamfer_size: float
+    side_button_lip_extra_length: float
+    side_button_outer_extra_length: float
+
+    side_button_support_dz: float
+    side_button_support_pcb_clearance: float
+    side_button_support_width: float
+    side_button_support_depth: float
+
+    battery_dx: float
+    battery_dy: float
+    battery_dz: float
+    battery_width: float
+    battery_height: float
+    battery_thickness: float
+
+    bconn_dx: float
+    bconn_dy: float
+    bconn_width: float
+    bconn_height: float
+    bconn_depth: float
+
+    batt_spring_dist: float
+    batt_spring_tolerance: float
+
+    battbox_thickness: float
+    battbox_depth: float
+    battbox_clearance_xz: float
+    battbox_clearance_y: float
+    bconn_clearance: float
+
+    battframe_thickness: float
+    battframe_wall_height: float
+    battframe_support_diameter: float
+    battframe_support_hole_diameter: float
+    battframe_support_above_hole_diameter: float
+    battframe_support_z_clearance: float
+    battframe_connector_y_clearance: float
+
+    lshell_wall_clearance: float
+    lshell_shadowline_depth: float
+    lshell_cornersquare_thickness: float
+    lshell_cornersquare_diameter: float
+    lshell_cornersquare_y_extend: float
+    lshell_debugheader_side_clearance: float
+    lshell_debugheader_top_clearance: float
+
+    @property
+    def pcb_attachment_offset_dx(self) -> float:
+        return (self.inner_width - self.pcb.width)/2
+
+    @property
+    def inner_width(self) -> float:
+        return self.outer_width - self.wall_thickness_side*2
+
+    @property
+    def inner_height(self) -> float:
+        return (self.pcb.height +
+                self.pcb.clearance_top +
+                self.pcb.clearance_bottom)
+
+    @property
+    def inner_origin_dx(self) -> float:
+        return self.wall_thickness_side
+
+    @property
+    def inner_origin_dy(self) -> float:
+        return self.wall_thickness_bottom
+
+    @property
+    def outer_width(self) -> float:
+        return self.lcd.cover_pocket_width + self.lcd.bezel_size*2
+
+    @property
+    def outer_height(self) -> float:
+        return (self.inner_height +
+                self.wall_thickness_bottom +
+                self.wall_thickness_top)
+
+    @property
+    def jack_slot_radius(self) -> float:
+        return self.jack_diameter/2 + self.jack_diameter_clearance
+
+    @property
+    def jack_slot_dz(self) -> float:
+        return self.jack_diameter/2
+
+    @property
+    def usbc_corner_radius(self) -> float:
+        return (self.usbc_height - self.usbc_flat_side_length) / 2
+
+    @property
+    def usbc_slot_width(self) -> float:
+        return self.usbc_width + self.usbc_clearance*2
+
+    @property
+    def usbc_slot_height(self) -> float:
+        return self.usbc_height + self.usbc_clearance*2
+
+    @property
+    def usbc_slot_corner_radius(self) -> float:
+        return self.usbc_corner_radius + self.usbc_clearance
+
+    @property
+    def usbc_slot_dz(self) -> float:
+        return self.usbc_height/2
+
+    @property
+    def card_slot_width(self) -> float:
+        return self.card_width + self.card_clearance*2
+
+    @property
+    def card_slot_height(self) -> float:
+        return self.card_height + self.card_clearance*2
+
+    @property
+    def card_slot_corner_radius(self) -> float:
+        return self.card_corner_radius + self.card_clearance
+
+    @property
+    def side_button_lip_width(self) -> float:
+        return self.side_button_width + 2*(self.side_button_lip_size + self.side_button_clearance)
+
+    @property
+    def side_button_lip_height(self) -> float:
+        return self.side_button_height + 2*(self.side_button_lip_size + self.side_button_clearance)
+
+    @property
+    def face_button_enclosed_height(self) -> float:
+        # From the PCB front to the inside of the front wall
+        return self.lcd.stack_depth + self.pcb.clearance_front - self.wall_thickness_front
+
+    @property
+    def dome_button_inside_height(self) -> float:
+        return (self.face_button_enclosed_height -
+                self.contact_dome.height + self.contact_dome.tip_height)
+
+    @property
+    def bconn_to_battery_dist(self) -> float:
+        return self.battery_dy - (self.bconn_dy + self.bconn_height)
+
+
+@profiled("params")
+def get_params() -> Params:
+    abxy_button_diameter = 7
+    startsel_button_diameter = 4
+
+    dpad_center_x = 27.5
+    dpad_center_y = 25.5
+    dpad_button_to_center_dist = 10
+
+    return Params(
+        lcd = LcdParams(
+            module_width = 50.9,
+            module_height = 45.8,
+            module_thickness = 2.4,
+            module_side_clearance = 0.5,
+            module_front_clearance = 0.4,
+            module_back_clearance = 0.2,
+            module_support_thickness = 1.4,
+            module_support_gap_size = 5.0,
+            cover_thickness = 1.0,
+            cover_support_size = 3.5,
+            cover_back_clearance = 0.1,
+            cover_side_clearance = 0.2,
+            bezel_size = 1.5,
+        ),
+        pcb = PcbParams(
+            width = 55,
+            height = 95,
+            thickness = 1.6,
+            clearance_top = 0.8,
+            clearance_bottom = 0.2,
+            clearance_front = 3,
+            edge_clearance_front = 0.6,
+            lo_jack_dx = 5,
+            hp_jack_dx = 15,
+            usbc_conn_dx = 27.5,
+            card_conn_dx = 46.9,
+            vol_button_dx = 51.15,
+            vol_up_button_dy = 77.5,
+            vol_dn_button_dy = 62.5,
+            power_button_dx = 7.5,
+            power_button_dy = 91.15,
+            hold_sw_pos1_dx = 16.7,
+            hold_sw_pos2_dx = 18.3,
+            buttons = {
+                "a":          ButtonPosParams(x=49.0, y=35.0),
+                "b":          ButtonPosParams(x=40.0, y=41.0),
+                "x":          ButtonPosParams(x= 6.0, y=35.0),
+                "y":          ButtonPosParams(x=15.0, y=41.0),
+                "start":      ButtonPosParams(x=42.8, y= 5.5),
+                "select":     ButtonPosParams(x=12.2, y= 5.5),
+                "dpad_up":    ButtonPosParams(x=dpad_center_x,
+                                              y=dpad_center_y + dpad_button_to_center_dist),
+                "dpad_down":  ButtonPosParams(x=dpad_center_x,
+                                              y=dpad_center_y - dpad_button_to_center_dist),
+                "dpad_left":  ButtonPosParams(x=dpad_center_x - dpad_button_to_center_dist,
+                                              y=dpad_center_y),
+                "dpad_right": ButtonPosParams(x=dpad_center_x + dpad_button_to_center_dist,
+                                              y=dpad_center_y),
+            },
+            holes = {
+                "dpad":   HoleParams(d=4.0, x=dpad_center_x, y=dpad_center_y),
+                "volume": HoleParams(d=4.0, x=51.0, y=70.00),
+                "h3":     HoleParams(d=2.2, x= 4.0, y=86.00),
+                "h5":     HoleParams(d=2.2, x=35.0, y= 2.00),
+                "h6":     HoleParams(d=2.2, x=13.0, y=31.75)
+            },
+        ),
+        wall_thickness_top = 2,
+        wall_thickness_bottom = 2,
+        wall_thickness_front = 2,
+        wall_thickness_back = 2,
+        wall_thickness_side = 2.4,
+        outer_depth = 21.1,
+        h3_support_diameter = 7,
+        volume_support_diameter = 8,
+        h5_support_diameter = 4.8,
+        dpad_support_diameter = 6,
+        debug_header_dx = 0.73,
+        debug_header_height = 2.5,
+        debug_header_width = 15.24,
+        debug_header_clearance_side = 0.5,
+        jack_diameter = 5,
+        jack_diameter_clearance = 0.5,
+        usbc_width = 8.94,
+        usbc_height = 3.26,
+        usbc_flat_side_length = 0.7,
+        usbc_clearance = 0.5,
+        card_width = 12,
+        card_height = 1.8,
+        card_corner_radius = 0.5,
+        card_clearance = 0.5,
+        card_slot_dz = 1.8,
+        support_screw_diameter = 2,
+        support_screw_head_diameter = 3.8,
+        support_heat_insert_diameter = 3,
+        support_screw_depth = 3,
+        face_button_diameter = {
+            "a": abxy_button_diameter,
+            "b": abxy_button_diameter,
+            "x": abxy_button_diameter,
+            "y": abxy_button_diameter,
+            "start": startsel_button_diameter,
+            "select": startsel_button_diameter,
+        },
+        dpad_button = DpadButtonParams(
+            width = 9,
+            height = 8.5,
+            center_to_origin_dist = dpad_button_to_center_dist,
+            center_to_top_dist = 3.5,
+            edge_to_diagonal_dist = 2,
+        ),
+        contact_dome = ContactDomeParams(
+            height = 5,
+            tip_height = 2.2,
+            tip_diameter = 3,
+            rim_diameter = 5,
+            travel = 2,
+        ),
+        face_button_lip_size = 1,
+        face_button_lip_height = 1.4,
+        face_button_case_clearance = 0.25,
+        face_button_dome_tip_clearance = 0.1,
+        startsel_button_smd_height = 2.4, # includes case clearance
+        startsel_button_outer_height = 1.5,
+        side_pcb_button_body_width = 4.7,
+        side_pcb_button_body_height = 2.3,
+        side_pcb_button_body_depth = 1.9,
+        side_pcb_button_presser_width = 1.8,
+        side_pcb_button_presser_height = 1.2,
+        side_pcb_button_presser_depth = 0.8,
+        side_button_width = 10,
+        side_button_height = 2.5,
+        side_button_corner_radius = 1,
+        side_button_clearance = 0.3,
+        side_button_inner_clearance = 0.5,
+        # Lip pocket depth minus extra length needs
+        # to be >= PCB button face to PCB edge distance
+        side_button_lip_pocket_depth = 1,
+        side_button_presser_width = 4,
+        side_button_presser_height = 1.5,
+        # Presser length needs to be >= A+B where
+        #   A = PCB button face to PCB edge distance
+        #   B = PCB button travel distance
+        side_button_presser_length = 1,
+        side_button_lip_size = 0.5,
+        side_button_lip_chamfer_size = 0.5,
+        # Extra length added to lip to increase part thickness
+        side_button_lip_extra_length = 0.2,
+        # Must be >= PCB button travel distance
+        side_button_outer_extra_length = 1.0,
+        side_button_support_dz = 0.3,
+        side_button_support_pcb_clearance = 0.3,
+        side_button_support_width = 15,
+        side_button_support_depth = 6,
+
+        battery_dx = 17.2,
+        battery_dy = 28.7,
+        battery_dz = 2.8,
+        battery_width = 34.3,
+        battery_height = 53.5,
+        battery_thickness = 5.8,
+        bconn_dx = 39.5,
+        bconn_dy = 24.4,
+        bconn_width = 9,
+        bconn_height = 3.5,
+        bconn_depth = 6.8,
+        batt_spring_dist = 0.8,
+        batt_spring_tolerance = 0.2,
+        battbox_thickness = 2,
+        battbox_depth = 2,
+        battbox_clearance_xz = 0.4,
+        battbox_clearance_y = 0.1,
+        bconn_clearance = 0.8,
+        battframe_thickness = 1,
+        battframe_wall_height = 3.5,
+        battframe_support_diameter = 3.8,
+        battframe_support_hole_diameter = 2.2,
+        battframe_support_above_hole_diameter = 10,
+        battframe_support_z_clearance = 0.2,
+        battframe_connector_y_clearance = 2,
+        lshell_wall_clearance = 0.3,
+        lshell_shadowline_depth = 1.0,
+        lshell_cornersquare_diameter = 6,
+        lshell_cornersquare_y_extend = 3,
+        lshell_cornersquare_thickness = 2.5,
+        lshell_debugheader_top_clearance = 0.3,
+        lshell_debugheader_side_clearance = 0.3,
+    )
+
+# Checked before building anything; see constraints.py
+CONSTRAINTS: list[Constraint | FieldConstraint] = [
+    FieldConstraint("wall_thickness_*", ">", 0),
+    FieldConstraint("*clearance*", ">=", 0),
+    FieldConstraint("*diameter*", ">", 0),
+    Constraint("LCD stack-up must leave room for the front wall",
+               lambda p: p.lcd.stack_depth, ">", lambda p: p.wall_thickness_front),
+    Constraint("Face buttons need room above the PCB",
+               lambda p: p.face_button_enclosed_height, ">", 0),
+    Constraint("Dome button lip must fit in the enclosed height",
+               lambda p: p.dome_button_inside_height, ">", lambda p: p.face_button_lip_height),
+    Constraint("Dome button travel must not reach the PCB",
+               lambda p: p.contact_dome.travel, "<",
+               lambda p: p.contact_dome.height - p.contact_dome.tip_height),
+    Constraint("Start/select buttons must fit in the enclosed height",
+               lambda p: p.face_button_enclosed_height, ">", lambda p: p.startsel_button_smd_height),
+    # Specified spring compression is 0.8mm +/- 0.2mm
+    Constraint("Battery connector spring compression must be in tolerance",
+               lambda p: abs(p.bconn_to_battery_dist - p.batt_spring_dist), "<=",
+               lambda p: p.batt_spring_tolerance),
+]
+
+
+# Dome buttons: (name, model, rotation angle). Buttons of the same model
+# and diameter are instances of one object.
+DOME_BUTTON_TABLE = (
+    ("a",          "circular", 0),
+    ("b",          "circular", 0),
+    ("x",          "circular", 0),
+    ("y",          "circular", 0),
+    ("start",      "startsel", 0),
+    ("select",     "startsel", 0),
+    ("dpad_up",    "dpad",     0),
+    ("dpad_left",  "dpad",     90),
+    ("dpad_down",  "dpad",     180),
+    ("dpad_right", "dpad",     270),
+)
+
+# Object names are made by these functions, which both the builders and
+# the part declarations use, so they can't get out of step
+
+def dome_button_name(bname: str) -> str:
+    return "button-" + bname.replace("_", "-")
+
+def dome_button_model_name(params: Params, bname: str, model: str) -> str:
+    if model == "dpad":
+        return "button-dpad"
+
+    # Start/select buttons have always been exported under the name of
+    # circular ones, and their files are used by that name, so keep it
+    # unless a circular button of the same diameter needs it
+    diameter = params.face_button_diameter[bname]
+    if model == "startsel" and not any(
+            other == "circular" and params.face_button_diameter[other_bname] == diameter
+            for other_bname, other, _ in DOME_BUTTON_TABLE):
+        model = "circular"
+
+    return f"button-dome-{model}-{diameter}mm"
+
+def dome_button_names(params: Params) -> list[str]:
+    models = [dome_button_model_name(params, bname, model)
+              for bname, model, _ in DOME_BUTTON_TABLE]
+    names = list(dict.fromkeys(models))
+    names += [dome_button_name(bname) for bname, _, _ in DOME_BUTTON_TABLE]
+    return names
+
+# Side buttons: (name, model, angle, datum name). Buttons of the same
+# model are instances of one object, which is named after the model.
+SIDE_BUTTON_TABLE = (
+    ("volume-up",   "volume", -90, "vol_up"),
+    ("volume-down", "volume", -90, "vol_dn"),
+    ("power",       "power",    0, "power"),
+)
+
+def side_button_name(name: str) -> str:
+    return f"button-{name}"
+
+def side_button_model_name(model: str) -> str:
+    return f"button-{model}"
+
+def pcb_button_name(name: str) -> str:
+    return f"pcb-button-{name}"
+
+def mockup_names(params: Params) -> list[str]:
+    names = ["pcb", "battery", "battery-connector", "pcb-button"]
+    names += [pcb_button_name(name) for name, _, _, _ in SIDE_BUTTON_TABLE]
+    return names
+
+def side_button_names(params: Params) -> list[str]:
+    # The power button is the only instance of its model, and has the
+    # same name
+    names = [side_button_model_name(model) for _, model, _, _ in SIDE_BUTTON_TABLE]
+    names += [side_button_name(name) for name, _, _, _ in SIDE_BUTTON_TABLE]
+    return list(dict.fromkeys(names))
+
+# Parts are independent of each other once the datums are resolved, so
+# they can be built in any order, or concurrently. The order here is
+# the order of objects returned by build().
+PARTS = [
+    Part("upper-shell",   ".r1_rev1:build_upper_shell",   datums=("ushell",)),
+    Part("lower-shell",   ".r1_rev1:build_lower_shell",   datums=("lshell",)),
+    Part("battery-frame", ".r1_rev1:build_battery_frame", datums=("bframe",)),
+    Part("dome-buttons",  ".r1_rev1:build_dome_buttons",  datums=("ushell",),
+         objects=dome_button_names),
+    Part("mockups",       ".r1_rev1:build_mockups",       datums=("pcb", "ushell"),
+         objects=mockup_names),
+    Part("side-buttons",  ".r1_rev1:build_side_buttons",  datums=("ushell",),
+         objects=side_button_names),
+]
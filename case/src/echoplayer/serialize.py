@@ -0,0 +1,376 @@
+"""
+Compact, versioned serialization of datum sets and objects
+
+Datum sets are stored as plain float arrays together with tables of
+their aliases, references and boxes, and compounds as BREP blobs. The
+on-disk form is a small JSON header followed by the raw binary blobs,
+so loading is fast and doesn't need pickle.
+
+Loading only needs numpy. The loaded Snapshot can be queried for datum
+values directly, and only converting back to DatumSets and Objects
+needs build123d.
+"""
+
+from __future__ import annotations
+
+import dataclasses
+import json
+import struct
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from .utils import DatumSet, Object
+
+MAGIC = b"ECHODATA"
+
+# Bump this when the format changes; older data is rejected on loading
+FORMAT_VERSION = 3
+
+_HEADER = struct.Struct("<8sII")
+
+# Kinds of datum, as in utils.DatumArrays
+POINT, AXIS, PLANE = 0, 1, 2
+
+
+class SerializationError(ValueError):
+    pass
+
+
+@dataclass
+class DatumSetData:
+    """
+    Plain-data form of a DatumSet
+
+    Each datum is a row of `values` holding its origin, x direction and
+    z direction, as in utils.DatumArrays. References map to the index of
+    the referenced set in the snapshot and the 3x4 matrix of the
+    reference transform.
+    """
+
+    names: list[str]
+    kinds: np.ndarray
+    values: np.ndarray
+    aliases: dict[str, tuple[str, str]] = field(default_factory=dict)
+    refs: dict[str, tuple[int, np.ndarray]] = field(default_factory=dict)
+    boxes: dict[str, np.ndarray] = field(default_factory=dict)
+    index: dict[str, int] = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.index = {name: i for i, name in enumerate(self.names)}
+
+@dataclass
+class ObjectData:
+    """
+    Plain-data form of an Object
+
+    The compound is stored as BREP, with its color and label alongside
+    since BREP doesn't carry them. Datums are given by the name of the
+    datum set, to be looked up when unpacking, and locations as their
+    3x4 matrix in row-major order. All other fields of the Object must
+    be plain values and are stored as they are.
+    """
+
+    name: str
+    brep: bytes | None = None
+    color: tuple[float, ...] | None = None
+    label: str = ""
+    datums: str | None = None
+    datums_xform: tuple[float, ...] = (1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1, 0)
+    instances: dict[str, tuple[float, ...]] = field(default_factory=dict)
+    fields: dict[str, Any] = field(default_factory=dict)
+
+@dataclass
+class Snapshot:
+    """
+    Datum sets and objects in plain-data form
+
+    `sets` holds every datum set, including sets only reachable through
+    references, and `named` maps datum set names to indexes in `sets`.
+    """
+
+    sets: list[DatumSetData] = field(default_factory=list)
+    named: dict[str, int] = field(default_factory=dict)
+    objects: list[ObjectData] = field(default_factory=list)
+
+    def _resolve(self, index: int, name: str) -> tuple[int, np.ndarray]:
+        ds = self.sets[index]
+
+        i = ds.index.get(name)
+        if i is not None:
+            return int(ds.kinds[i]), ds.values[i]
+
+        alias = ds.aliases.get(name)
+        if alias is None:
+            raise KeyError(name)
+
+        refname, othername = alias
+        target, matrix = ds.refs[refname]
+        kind, row = self._resolve(target, othername)
+
+        # Same as utils.datum_transform(): points are only translated
+        rot, pos = matrix[:, :3], matrix[:, 3]
+        origin = row[0:3] + pos if kind == POINT else rot @ row[0:3] + pos
+        return kind, np.concatenate([origin, rot @ row[3:6], rot @ row[6:9]])
+
+    def datum_values(self, set_name: str, name: str) -> tuple[float, ...]:
+        """
+        Return a datum (or alias) of a named set as utils.datum_values()
+        would. Raises KeyError if it doesn't exist.
+        """
+
+        kind, row = self._resolve(self.named[set_name], name)
+        if kind == POINT:
+            values = row[0:3]
+        elif kind == AXIS:
+            values = np.concatenate([row[0:3], row[6:9]])
+        else:
+            values = row
+
+        return tuple(float(v) for v in values)
+
+    def datum_kind(self, set_name: str, name: str) -> int:
+        """
+        Return the kind of a datum (or alias) of a named set, one of
+        POINT, AXIS or PLANE. Raises KeyError if it doesn't exist.
+        """
+
+        return self._resolve(self.named[set_name], name)[0]
+
+    def datum_names(self, set_name: str) -> list[str]:
+        ds = self.sets[self.named[set_name]]
+        return ds.names + list(ds.aliases)
+
+    def datum_sets(self) -> dict[str, DatumSet]:
+        """
+        Convert the named datum sets (and the sets they reference) back
+        to DatumSets
+        """
+
+        from .utils import DatumArrays, DatumSet, DatumSetRef, matrix_location
+
+        sets = [DatumSet() for _ in self.sets]
+
+        for ds, data in zip(sets, self.sets, strict=True):
+            values = data.values.reshape(-1, 9)
+            arrays = DatumArrays(data.names, data.kinds,
+                                 values[:, 0:3], values[:, 3:6], values[:, 6:9])
+            ds.datums = arrays.to_datums()
+            ds.aliases = dict(data.aliases)
+            ds.refs = {name: DatumSetRef(sets[target], matrix_location(matrix))
+                       for name, (target, matrix) in data.refs.items()}
+            ds.boxes = {name: box.copy() for name, box in data.boxes.items()}
+            ds._modified()
+
+        return {name: sets[index] for name, index in self.named.items()}
+
+
+def snapshot_datums(datums: dict[str, DatumSet]) -> Snapshot:
+    """
+    Convert datum sets, and all the sets they reference, to plain data
+    """
+
+    from .utils import location_matrix
+
+    snapshot = Snapshot()
+    indexes: dict[int, int] = {}
+
+    def add(ds: DatumSet) -> int:
+        index = indexes.get(id(ds))
+        if index is not None:
+            return index
+
+        index = len(snapshot.sets)
+        indexes[id(ds)] = index
+        arrays = ds.arrays()
+        snapshot.sets.append(DatumSetData(
+            names = list(arrays.names),
+            kinds = arrays.kinds.copy(),
+            values = np.hstack([arrays.origins, arrays.x_dirs, arrays.z_dirs]),
+            aliases = dict(ds.aliases),
+            boxes = {name: box.copy() for name, box in ds.boxes.items()},
+        ))
+
+        # Added afterwards, since references may be cyclic
+        snapshot.sets[index].refs = {
+            name: (add(ref.ref), location_matrix(ref.loc))
+            for name, ref in ds.refs.items()
+        }
+
+        return index
+
+    for name, ds in datums.items():
+        snapshot.named[name] = add(ds)
+
+    return snapshot
+
+def pack_object(obj: Object, datum_names: dict[int, str]) -> ObjectData:
+    """
+    Convert an Object to plain data. `datum_names` maps the ids of datum
+    sets to their names.
+    """
+
+    from .utils import compound_to_brep, location_values
+
+    data = ObjectData(
+        name = obj.name,
+        datums_xform = location_values(obj.datums_xform),
+        instances = {name: location_values(loc) for name, loc in obj.instances.items()},
+        fields = {f.name: getattr(obj, f.name) for f in dataclasses.fields(obj)
+                  if f.name not in ("name", "compound", "datums", "datums_xform", "instances")},
+    )
+
+    if obj.compound is not None:
+        data.brep = compound_to_brep(obj.compound)
+        data.label = obj.compound.label
+        if obj.compound.color is not None:
+            data.color = obj.compound.color.to_tuple()
+
+    if obj.datums is not None:
+        data.datums = datum_names[id(obj.datums)]
+
+    return data
+
+def unpack_object(data: ObjectData, datums: dict[str, DatumSet]) -> Object:
+    """
+    Inverse of pack_object(), using the datum sets in `datums`
+    """
+
+    from .utils import Object, compound_from_brep, matrix_location
+
+    obj = Object(
+        name = data.name,
+        datums_xform = matrix_location(np.array(data.datums_xform).reshape(3, 4)),
+        instances = {name: matrix_location(np.array(values).reshape(3, 4))
+                     for name, values in data.instances.items()},
+        **data.fields,
+    )
+
+    if data.brep is not None:
+        obj.compound = compound_from_brep(data.brep, color=data.color, label=data.label)
+
+    if data.datums is not None:
+        obj.datums = datums[data.datums]
+
+    return obj
+
+
+class _Blobs:
+    def __init__(self) -> None:
+        self.blobs: list[bytes] = []
+
+    def add(self, blob: bytes) -> int:
+        self.blobs.append(blob)
+        return len(self.blobs) - 1
+
+    def array(self, a: np.ndarray) -> dict[str, Any]:
+        a = np.ascontiguousarray(a)
+        return {"blob": self.add(a.tobytes()), "dtype": a.dtype.str, "shape": list(a.shape)}
+
+def _array(spec: dict[str, Any], blobs: list[memoryview]) -> np.ndarray:
+    a = np.frombuffer(blobs[spec["blob"]], dtype=np.dtype(spec["dtype"]))
+    return a.reshape(spec["shape"])
+
+def dumps(snapshot: Snapshot) -> bytes:
+    blobs = _Blobs()
+
+    sets = []
+    for ds in snapshot.sets:
+        box_names = list(ds.boxes)
+        ref_names = list(ds.refs)
+        sets.append({
+            "names": ds.names,
+            "kinds": blobs.array(ds.kinds.astype(np.int8)),
+            "values": blobs.array(ds.values.astype("<f8").reshape(-1, 9)),
+            "aliases": ds.aliases,
+            "refs": ref_names,
+            "ref_sets": [ds.refs[name][0] for name in ref_names],
+            "ref_matrices": blobs.array(np.array([ds.refs[name][1] for name in ref_names],
+                                                 dtype="<f8").reshape(-1, 3, 4)),
+            "boxes": box_names,
+            "box_values": blobs.array(np.array([ds.boxes[name] for name in box_names],
+                                               dtype="<f8").reshape(-1, 2, 3)),
+        })
+
+    objects = []
+    for obj in snapshot.objects:
+        objects.append({
+            "name": obj.name,
+            "brep": None if obj.brep is None else blobs.add(obj.brep),
+            "color": obj.color,
+            "label": obj.label,
+            "datums": obj.datums,
+            "datums_xform": obj.datums_xform,
+            "instances": obj.instances,
+            "fields": obj.fields,
+        })
+
+    header = json.dumps({
+        "sets": sets,
+        "named": snapshot.named,
+        "objects": objects,
+        "blobs": [len(b) for b in blobs.blobs],
+    }, separators=(",", ":")).encode()
+
+    return b"".join([_HEADER.pack(MAGIC, FORMAT_VERSION, len(header)), header,
+                     *blobs.blobs])
+
+def loads(data: bytes) -> Snapshot:
+    """
+    Inverse of dumps(). Raises SerializationError if the data isn't
+    in the current format.
+    """
+
+    if len(data) < _HEADER.size:
+        raise SerializationError("truncated data")
+
+    magic, version, header_size = _HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise SerializationError("not serialized datums or objects")
+    if version != FORMAT_VERSION:
+        raise SerializationError(f"unsupported format version {version}")
+
+    offset = _HEADER.size
+    header = json.loads(bytes(data[offset:offset + header_size]))
+    offset += header_size
+
+    # Arrays are views of the data, so nothing is copied
+    view = memoryview(data)
+    blobs = []
+    for size in header["blobs"]:
+        blobs.append(view[offset:offset + size])
+        offset += size
+
+    if offset != len(data):
+        raise SerializationError("truncated data")
+
+    snapshot = Snapshot(named=header["named"])
+
+    for ds in header["sets"]:
+        matrices = _array(ds["ref_matrices"], blobs)
+        boxes = _array(ds["box_values"], blobs)
+        snapshot.sets.append(DatumSetData(
+            names = ds["names"],
+            kinds = _array(ds["kinds"], blobs),
+            values = _array(ds["values"], blobs),
+            aliases = {name: (ref, other) for name, (ref, other) in ds["aliases"].items()},
+            refs = {name: (target, matrices[i])
+                    for i, (name, target) in enumerate(zip(ds["refs"], ds["ref_sets"], strict=True))},
+            boxes = {name: boxes[i] for i, name in enumerate(ds["boxes"])},
+        ))
+
+    for obj in header["objects"]:
+        snapshot.objects.append(ObjectData(
+            name = obj["name"],
+            brep = None if obj["brep"] is None else bytes(blobs[obj["brep"]]),
+            color = None if obj["color"] is None else tuple(obj["color"]),
+            label = obj["label"],
+            datums = obj["datums"],
+            datums_xform = tuple(obj["datums_xform"]),
+            instances = {name: tuple(values) for name, values in obj["instances"].items()},
+            fields = obj["fields"],
+        ))
+
+    return snapshot
@@ -0,0 +1,306 @@
+"""
+Tessellation of shapes into NumPy buffers, and mesh file writers
+
+Each shape is tessellated once and its triangles are copied into a Mesh,
+which the STL and glTF writers (and duplicate detection) use instead of
+tessellating again. The triangulation is also left on the shape, so the
+viewer reuses it rather than meshing the shape itself.
+
+Deflections are chosen per part by a MeshQuality preset, scaled to the
+size of the part. This module can be imported without build123d, so the
+presets are available to the command line.
+"""
+
+from __future__ import annotations
+
+import json
+import math
+import pathlib
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from . import kernel
+
+if TYPE_CHECKING:
+    from build123d import Shape
+
+# Binary STL triangle records
+STL_TRIANGLE = np.dtype([
+    ("normal", "<f4", (3,)),
+    ("vertices", "<f4", (3, 3)),
+    ("attributes", "<u2"),
+])
+
+# glTF component types and buffer view targets
+GLTF_FLOAT = 5126
+GLTF_UNSIGNED_INT = 5125
+GLTF_ARRAY_BUFFER = 34962
+GLTF_ELEMENT_ARRAY_BUFFER = 34963
+
+# Angular deflections of presets are for a part of this size, in mm
+REFERENCE_SIZE = 50.0
+
+
+@dataclass(frozen=True)
+class MeshQuality:
+    # Linear deflection as a fraction of the part size, limited to a
+    # range in mm
+    relative_tolerance: float
+    min_tolerance: float
+    max_tolerance: float
+
+    # Angular deflection in radians for a part of REFERENCE_SIZE. Small
+    # parts have small radii, whose chord error is small anyway, so it is
+    # scaled with the square root of the size ratio, within a factor of 2.
+    angular_tolerance: float
+
+    def tolerances(self, size: float) -> tuple[float, float]:
+        """
+        Return the linear and angular deflection for a part of `size`
+        """
+
+        tolerance = min(max(size * self.relative_tolerance, self.min_tolerance),
+                        self.max_tolerance)
+        scale = min(max(math.sqrt(REFERENCE_SIZE / size), 0.5), 2) if size > 0 else 1
+
+        # Rounded, so that copies of a part are meshed the same
+        return float(f"{tolerance:.2g}"), float(f"{self.angular_tolerance * scale:.2g}")
+
+MESH_QUALITIES = {
+    "draft": MeshQuality(relative_tolerance = 1e-3, min_tolerance = 0.01,
+                         max_tolerance = 0.1, angular_tolerance = 0.5),
+    "print": MeshQuality(relative_tolerance = 2e-4, min_tolerance = 0.005,
+                         max_tolerance = 0.02, angular_tolerance = 0.25),
+    "fine": MeshQuality(relative_tolerance = 5e-5, min_tolerance = 0.001,
+                        max_tolerance = 0.005, angular_tolerance = 0.1),
+}
+
+DEFAULT_MESH_QUALITY = "print"
+
+
+@dataclass
+class Mesh:
+    """
+    Triangles of a tessellated shape, in mm
+    """
+
+    # Vertex coordinates, (n, 3). Kept as float64 so that placed copies
+    # of a shape have the same vertices relative to each other.
+    vertices: np.ndarray
+
+    # Vertex indices of each triangle, counter-clockwise seen from
+    # outside, (m, 3)
+    triangles: np.ndarray
+
+    label: str = ""
+    color: tuple[float, ...] | None = None
+
+    # Deflections used, and the time taken to tessellate
+    tolerance: float = 0
+    angular_tolerance: float = 0
+    elapsed: float = 0
+
+    @property
+    def triangle_count(self) -> int:
+        return len(self.triangles)
+
+    def facet_normals(self) -> np.ndarray:
+        """
+        Return the unit normal of each triangle
+        """
+
+        corners = self.vertices[self.triangles]
+        normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+        lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+        return normals / np.where(lengths > 0, lengths, 1)
+
+    def vertex_normals(self) -> np.ndarray:
+        """
+        Return the unit normal of each vertex, averaged over the triangles
+        using it, weighted by their area. Faces don't share vertices, so
+        edges between faces stay sharp.
+        """
+
+        corners = self.vertices[self.triangles]
+        weighted = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+
+        normals = np.zeros_like(self.vertices)
+        for i in range(3):
+            np.add.at(normals, self.triangles[:, i], weighted)
+
+        lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+        return normals / np.where(lengths > 0, lengths, 1)
+
+
+def part_size(shape: Shape) -> float:
+    """
+    Return the size of a shape: the diagonal of the box with the same
+    moments of inertia. Unlike the bounding box, this doesn't depend on
+    how the shape is placed. For a box, it is the length of its diagonal.
+    """
+
+    from OCP.BRepGProp import BRepGProp  # type: ignore
+    from OCP.GProp import GProp_GProps  # type: ignore
+
+    props = GProp_GProps()
+    BRepGProp.VolumeProperties_s(shape.wrapped, props)
+    if props.Mass() <= 0:
+        return 0
+
+    # The moments of a box sum to mass * (a² + b² + c²) / 6
+    inertia = props.MatrixOfInertia()
+    trace = sum(inertia.Value(i, i) for i in range(1, 4))
+    return math.sqrt(6 * trace / props.Mass())
+
+def tessellate(shape: Shape, quality: MeshQuality) -> Mesh:
+    """
+    Tessellate a shape with deflections for its size, unless it already
+    is, and return its triangles
+    """
+
+    from OCP.BRep import BRep_Tool  # type: ignore
+    from OCP.TopAbs import TopAbs_Orientation  # type: ignore
+    from OCP.TopLoc import TopLoc_Location  # type: ignore
+
+    start = time.perf_counter()
+
+    tolerance, angular_tolerance = quality.tolerances(part_size(shape))
+    kernel.mesh(shape, tolerance, angular_tolerance)
+
+    vertices: list[np.ndarray] = []
+    triangles: list[np.ndarray] = []
+    offset = 0
+
+    for face in shape.faces():
+        topods = face.wrapped
+        assert topods is not None
+
+        loc = TopLoc_Location()
+        poly = BRep_Tool.Triangulation_s(topods, loc)
+        if poly is None or poly.NbTriangles() == 0:
+            continue
+
+        nodes = np.array([poly.Node(i).Coord() for i in range(1, poly.NbNodes() + 1)])
+        if not loc.IsIdentity():
+            trsf = loc.Transformation()
+            matrix = np.array([[trsf.Value(r, c) for c in range(1, 5)] for r in range(1, 4)])
+            nodes = nodes @ matrix[:, :3].T + matrix[:, 3]
+
+        tris = np.array([poly.Triangle(i).Get() for i in range(1, poly.NbTriangles() + 1)]) - 1
+        if topods.Orientation() == TopAbs_Orientation.TopAbs_REVERSED:
+            tris = tris[:, [0, 2, 1]]
+
+        vertices.append(nodes)
+        triangles.append(tris + offset)
+        offset += len(nodes)
+
+    return Mesh(
+        vertices = np.concatenate(vertices) if vertices else np.zeros((0, 3)),
+        triangles = (np.concatenate(triangles) if triangles else np.zeros((0, 3))).astype(np.uint32),
+        label = shape.label,
+        color = shape.color.to_tuple() if shape.color else None,
+        tolerance = tolerance,
+        angular_tolerance = angular_tolerance,
+        elapsed = time.perf_counter() - start,
+    )
+
+def write_stl(mesh: Mesh, file_name: pathlib.Path) -> int:
+    """
+    Write a binary STL file, and return its size in bytes
+    """
+
+    records = np.zeros(mesh.triangle_count, dtype=STL_TRIANGLE)
+    records["normal"] = mesh.facet_normals()
+    records["vertices"] = mesh.vertices[mesh.triangles]
+
+    header = f"echoplayer {mesh.label}".encode()[:80].ljust(80, b" ")
+
+    with open(file_name, "wb") as f:
+        f.write(header)
+        f.write(np.uint32(mesh.triangle_count).tobytes())
+        f.write(records.tobytes())
+
+    return len(header) + 4 + records.nbytes
+
+def write_gltf(mesh: Mesh, file_name: pathlib.Path) -> int:
+    """
+    Write a glTF file, with its buffer in a .bin file next to it, and
+    return the size of both in bytes
+
+    As with build123d's exporter, coordinates are converted from mm to
+    m, and from +Z up to glTF's +Y up.
+    """
+
+    def to_gltf(a: np.ndarray, scale: float) -> np.ndarray:
+        return (np.stack([a[:, 0], a[:, 2], -a[:, 1]], axis=1) * scale).astype("<f4")
+
+    indices = mesh.triangles.astype("<u4").ravel()
+    positions = to_gltf(mesh.vertices, 1e-3)
+    normals = to_gltf(mesh.vertex_normals(), 1)
+
+    # All components are 4 bytes, so every view stays aligned
+    views = []
+    offset = 0
+    for data, target in ((indices, GLTF_ELEMENT_ARRAY_BUFFER),
+                         (positions, GLTF_ARRAY_BUFFER),
+                         (normals, GLTF_ARRAY_BUFFER)):
+        views.append({"buffer": 0, "byteOffset": offset, "byteLength": data.nbytes, "target": target})
+        offset += data.nbytes
+
+    primitive: dict = {
+        "attributes": {"POSITION": 1, "NORMAL": 2},
+        "indices": 0,
+        "mode": 4,
+    }
+
+    materials = []
+    if mesh.color is not None:
+        materials.append({
+            "pbrMetallicRoughness": {
+                "baseColorFactor": list(mesh.color),
+                "metallicFactor": 0.0,
+                "roughnessFactor": 1.0,
+            },
+        })
+        primitive["material"] = 0
+
+    bin_file = file_name.with_suffix(".bin")
+    gltf = {
+        "asset": {"version": "2.0", "generator": "echoplayer"},
+        "scene": 0,
+        "scenes": [{"nodes": [0]}],
+        "nodes": [{"mesh": 0, "name": mesh.label}],
+        "meshes": [{"name": mesh.label, "primitives": [primitive]}],
+        "materials": materials,
+        "buffers": [{"uri": bin_file.name, "byteLength": offset}],
+        "bufferViews": views,
+        "accessors": [
+            {"bufferView": 0, "componentType": GLTF_UNSIGNED_INT,
+             "count": len(indices), "type": "SCALAR"},
+            {"bufferView": 1, "componentType": GLTF_FLOAT,
+             "count": len(positions), "type": "VEC3",
+             "min": positions.min(axis=0).tolist(), "max": positions.max(axis=0).tolist()},
+            {"bufferView": 2, "componentType": GLTF_FLOAT,
+             "count": len(normals), "type": "VEC3"},
+        ],
+    }
+    if not materials:
+        del gltf["materials"]
+
+    with open(bin_file, "wb") as f:
+        for data in (indices, positions, normals):
+            f.write(data.tobytes())
+
+    text = json.dumps(gltf, indent=2) + "\n"
+    file_name.write_text(text)
+
+    return offset + len(text.encode())
+
+# Writers of mesh formats, which are fed from a Mesh rather than a shape
+MESH_WRITERS = {
+    "stl": write_stl,
+    "gltf": write_gltf,
+}
@@ -1,7 +1,16 @@
-from build123d import Axis, Compound, Location, Plane, Vector
-from typing import Any, Optional, TypeAlias, Union, overload
+from build123d import Axis, Color, Compound, Location, Plane, Shape, Vector
+from OCP.BinTools import BinTools, BinTools_FormatVersion # type: ignore
+from OCP.gp import gp_Trsf # type: ignore
+from OCP.TopoDS import TopoDS_Shape # type: ignore
+from typing import Any, Optional, TypeAlias, TypeVar, Union, cast, overload
 from dataclasses import dataclass, field as dataclass_field
+from collections.abc import Iterable
 from copy import copy
+import fnmatch
+import io
+import numpy as np
+
+from .params import canonical
 
 PlaneLike: TypeAlias = Plane
 VectorLike: TypeAlias = Vector | tuple[float, float, float]
@@ -99,6 +108,30 @@ def datum_loc(d: Datum) -> Location:
 
     raise TypeError(type(d))
 
+def datum_values(d: Datum) -> tuple[float, ...]:
+    """
+    Return the datum as a flat tuple of floats: the position of a point,
+    position and direction of an axis, or origin, x and z directions of
+    a plane.
+    """
+    if isinstance(d, Vector):
+        return d.to_tuple()
+    if isinstance(d, Axis):
+        return d.position.to_tuple() + d.direction.to_tuple()
+    if isinstance(d, Plane):
+        return d.origin.to_tuple() + d.x_dir.to_tuple() + d.z_dir.to_tuple()
+
+    raise TypeError(type(d))
+
+def location_values(loc: Location) -> tuple[float, ...]:
+    """
+    Return the 3x4 transformation matrix of a location in row-major order
+    """
+    xform = loc.wrapped.Transformation()
+    return tuple(xform.Value(row, col)
+                 for row in range(1, 4)
+                 for col in range(1, 5))
+
 @overload
 def datum_transform(d: None, xform: Location) -> None: ...
 @overload
@@ -120,29 +153,275 @@ def datum_transform(d: Optional[Datum], xform: Location) -> Optional[Datum]:
 
     raise TypeError(type(d))
 
+ShapeT = TypeVar("ShapeT", bound=Shape)
+
+def located(shape: ShapeT, loc: Location) -> ShapeT:
+    """
+    Return a reference to a shape moved by a location. Unlike with
+    Shape.moved(), the geometry is shared rather than copied.
+    """
+    assert shape.wrapped is not None
+    ref = cast(ShapeT, Compound.cast(shape.wrapped.Moved(loc.wrapped)))
+    ref.color = shape.color
+    ref.label = shape.label
+    return ref
+
+def location_matrix(loc: Location) -> np.ndarray:
+    """
+    Return the 3x4 transformation matrix of a location
+    """
+    return np.array(location_values(loc)).reshape(3, 4)
+
+def matrix_location(m: np.ndarray) -> Location:
+    """
+    Inverse of location_matrix()
+    """
+    xform = gp_Trsf()
+    xform.SetValues(*(float(v) for v in m.reshape(12)))
+    return Location(xform)
+
+# Kinds of datum stored in DatumArrays
+POINT, AXIS, PLANE = 0, 1, 2
+
+class DatumArrays:
+    """
+    Compact, array-backed copy of the datums in a DatumSet
+
+    Positions and directions of all datums are stored as rows of
+    contiguous (N, 3) arrays, so a whole set can be transformed with a
+    single matrix multiply. build123d objects are only created when
+    datums are read back with get_datum() or to_datums().
+
+    Transforms follow datum_transform(): points are only translated,
+    while axes and planes are fully transformed.
+    """
+
+    names: list[str]
+    index: dict[str, int]
+    kinds: np.ndarray
+    # Axis position or plane origin for axes and planes
+    origins: np.ndarray
+    # Plane x direction; zero for points and axes
+    x_dirs: np.ndarray
+    # Axis direction or plane z direction; zero for points
+    z_dirs: np.ndarray
+
+    def __init__(self,
+                 names: list[str],
+                 kinds: np.ndarray,
+                 origins: np.ndarray,
+                 x_dirs: np.ndarray,
+                 z_dirs: np.ndarray):
+        self.names = names
+        self.index = {name: i for i, name in enumerate(names)}
+        self.kinds = kinds
+        self.origins = origins
+        self.x_dirs = x_dirs
+        self.z_dirs = z_dirs
+
+    @classmethod
+    def from_datums(cls, datums: dict[str, Datum]) -> "DatumArrays":
+        n = len(datums)
+        kinds = np.empty(n, dtype=np.int8)
+        origins = np.zeros((n, 3))
+        x_dirs = np.zeros((n, 3))
+        z_dirs = np.zeros((n, 3))
+
+        for i, d in enumerate(datums.values()):
+            if isinstance(d, Vector):
+                kinds[i] = POINT
+                origins[i] = d.to_tuple()
+            elif isinstance(d, Axis):
+                kinds[i] = AXIS
+                origins[i] = d.position.to_tuple()
+                z_dirs[i] = d.direction.to_tuple()
+            elif isinstance(d, Plane):
+                kinds[i] = PLANE
+                origins[i] = d.origin.to_tuple()
+                x_dirs[i] = d.x_dir.to_tuple()
+                z_dirs[i] = d.z_dir.to_tuple()
+            else:
+                raise TypeError(type(d))
+
+        return cls(list(datums), kinds, origins, x_dirs, z_dirs)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def transform(self, xform: Location) -> "DatumArrays":
+        """
+        Return a copy of the datums transformed by a location
+        """
+        m = location_matrix(xform)
+        rot, pos = m[:, :3], m[:, 3]
+
+        points = self.kinds == POINT
+        origins = np.where(points[:, None],
+                           self.origins + pos,
+                           self.origins @ rot.T + pos)
+
+        return DatumArrays(self.names, self.kinds, origins,
+                           self.x_dirs @ rot.T, self.z_dirs @ rot.T)
+
+    def _datum(self, i: int) -> Datum:
+        kind = self.kinds[i]
+        origin = Vector(*self.origins[i])
+
+        if kind == POINT:
+            return origin
+        if kind == AXIS:
+            return Axis(origin, Vector(*self.z_dirs[i]))
+
+        return Plane(origin=origin,
+                     x_dir=Vector(*self.x_dirs[i]),
+                     z_dir=Vector(*self.z_dirs[i]))
+
+    def get_datum(self, name: str) -> Datum | None:
+        i = self.index.get(name)
+        if i is None:
+            return None
+
+        return self._datum(i)
+
+    def to_datums(self) -> dict[str, Datum]:
+        return {name: self._datum(i) for i, name in enumerate(self.names)}
+
+@dataclass
+class ResolutionStats:
+    """
+    Counters for the resolution caches of all DatumSets and DatumSetRefs.
+    Hits and misses count lookups of referenced (transformed or aliased)
+    datums and composed references; local datums are not counted.
+    """
+
+    hits: int = 0
+    misses: int = 0
+
+    def report(self) -> str:
+        return f"Datum resolution cache: {self.hits} hits, {self.misses} misses"
+
+resolution_stats = ResolutionStats()
+
+def _expand_names(names: str | Iterable[str], available: Iterable[str]) -> list[str]:
+    """
+    Expand a batch query into a list of names. A string is treated as a
+    glob pattern matched against the available names, in order.
+    """
+    if isinstance(names, str):
+        return fnmatch.filter(available, names)
+
+    return list(names)
+
+def _check_datum_type(name: str, datum: Datum | None, kind: type, desc: str) -> Any:
+    if datum is None:
+        raise KeyError(name)
+    if type(datum) is not kind:
+        raise TypeError(f"{name} is not {desc}")
+
+    return datum
+
 class DatumSetRef:
+    """
+    A DatumSet seen through a transform
+
+    Transformed datums and composed references are cached, and the cache
+    is cleared whenever the referenced set is modified. Cached datums are
+    copied on access, so callers are free to modify them.
+    """
+
     ref: "DatumSet"
     loc: Location
 
+    _version: int
+    _datums: dict[str, Datum]
+    _refs: dict[str, "DatumSetRef"]
+
     def __init__(self, ref: "DatumSet", loc: Location):
         self.ref = ref
         self.loc = loc
+        self._version = ref._version
+        self._datums = {}
+        self._refs = {}
+
+    def _validate_cache(self) -> None:
+        if self._version != self.ref._version:
+            self._datums.clear()
+            self._refs.clear()
+            self._version = self.ref._version
 
     def get_datum(self, name: str) -> Optional[Datum]:
-        return datum_transform(self.ref.get_datum(name), self.loc)
+        self._validate_cache()
+
+        datum = self._datums.get(name)
+        if datum is not None:
+            resolution_stats.hits += 1
+            return copy(datum)
+
+        datum = datum_transform(self.ref.get_datum(name), self.loc)
+        if datum is None:
+            return None
+
+        resolution_stats.misses += 1
+        self._datums[name] = datum
+        return copy(datum)
 
     def get_point(self, name: str) -> Vector:
-        return datum_transform(self.ref.get_point(name), self.loc)
+        return _check_datum_type(name, self.get_datum(name), Vector, "a point")
 
     def get_axis(self, name: str) -> Axis:
-        return datum_transform(self.ref.get_axis(name), self.loc)
+        return _check_datum_type(name, self.get_datum(name), Axis, "an axis")
 
     def get_plane(self, name: str) -> Plane:
-        return datum_transform(self.ref.get_plane(name), self.loc)
+        return _check_datum_type(name, self.get_datum(name), Plane, "a plane")
+
+    def get_datums(self, names: str | Iterable[str]) -> dict[str, Datum]:
+        """
+        Batch form of get_datum(). `names` is a list of names or a glob
+        pattern. Uncached datums are resolved in one call to the
+        referenced set and transformed together.
+        """
+        self._validate_cache()
+
+        names = _expand_names(names, self.ref.names())
+        missing = [name for name in names if name not in self._datums]
+        resolution_stats.hits += len(names) - len(missing)
+
+        if missing:
+            resolved = self.ref.get_datums(missing)
+            xformed = DatumArrays.from_datums(resolved).transform(self.loc)
+            self._datums.update(xformed.to_datums())
+            resolution_stats.misses += len(missing)
+
+        return {name: copy(self._datums[name]) for name in names}
+
+    def get_points(self, names: str | Iterable[str]) -> dict[str, Vector]:
+        return {n: _check_datum_type(n, d, Vector, "a point")
+                for n, d in self.get_datums(names).items()}
+
+    def get_planes(self, names: str | Iterable[str]) -> dict[str, Plane]:
+        return {n: _check_datum_type(n, d, Plane, "a plane")
+                for n, d in self.get_datums(names).items()}
 
     def get_ref(self, name: str) -> "DatumSetRef":
+        self._validate_cache()
+
+        ref = self._refs.get(name)
+        if ref is not None:
+            resolution_stats.hits += 1
+            return ref
+
         subref = self.ref.get_ref(name)
-        return DatumSetRef(subref.ref, self.loc * subref.loc)
+        ref = DatumSetRef(subref.ref, self.loc * subref.loc)
+
+        resolution_stats.misses += 1
+        self._refs[name] = ref
+        return ref
+
+    def arrays(self) -> DatumArrays:
+        """
+        Return the datums of the referenced set, transformed
+        """
+        return self.ref.arrays().transform(self.loc)
 
     def box_dimension(self, name_prefix: str, axis: str) -> float:
         return self.ref.box_dimension(name_prefix, axis)
@@ -186,6 +465,15 @@ class DatumSet:
     aliases: dict[str, tuple[str, str]]
     refs: dict[str, DatumSetRef]
 
+    # Boxes added with add_box(), as rows of the left/bottom/back and
+    # right/top/front plane coordinates
+    boxes: dict[str, np.ndarray]
+
+    # Incremented on every modification, to invalidate resolution caches
+    _version: int
+    _resolved: dict[str, Datum]
+    _arrays: DatumArrays | None
+
     @staticmethod
     def __refname(ref: Optional[str]):
         if ref is None:
@@ -197,10 +485,28 @@ class DatumSet:
         return ref
 
     def __init__(self):
+        self._version = 0
+        self._resolved = {}
+        self._arrays = None
+        self.boxes = {}
         self.datums = {}
         self.aliases = {}
         self.refs = { DatumSet.__refname(None) : DatumSetRef(self, Location()) }
 
+    def _modified(self) -> None:
+        self._version += 1
+        self._resolved.clear()
+        self._arrays = None
+
+    def arrays(self) -> DatumArrays:
+        """
+        Return the datums of this set (excluding aliases) as arrays
+        """
+        if self._arrays is None:
+            self._arrays = DatumArrays.from_datums(self.datums)
+
+        return self._arrays
+
     def add_point(self,
                   name: str,
                   origin: Optional[VectorLike] = None,
@@ -282,6 +588,7 @@ class DatumSet:
         datum_setpos(ldatum, origin)
 
         self.datums[name] = ldatum
+        self._modified()
 
     def add_reference(self,
                       ref: str,
@@ -296,6 +603,7 @@ class DatumSet:
             raise ValueError(f"DatumSet reference \"{refname}\" already exists")
 
         self.refs[refname] = DatumSetRef(datums, copy(transform))
+        self._modified()
 
     def add_alias(self,
                   newname: str,
@@ -315,45 +623,89 @@ class DatumSet:
             raise ValueError(f"Datum \"{name}\" not found in reference \"{refname}\"")
 
         self.aliases[newname] = (refname, name)
+        self._modified()
 
     def get_datum(self, name: str) -> Optional[Datum]:
         datum = self.datums.get(name)
         if datum is not None:
             return copy(datum)
 
+        # Aliases are resolved through the references once, then cached
+        datum = self._resolved.get(name)
+        if datum is not None:
+            resolution_stats.hits += 1
+            return copy(datum)
+
         alias = self.aliases.get(name)
         if alias is not None:
             refname, othername = alias
-            return self.get_ref(refname).get_datum(othername)
+            datum = self.get_ref(refname).get_datum(othername)
+            if datum is not None:
+                resolution_stats.misses += 1
+                self._resolved[name] = datum
+                return copy(datum)
 
         return None
 
-    def get_point(self, name: str) -> Vector:
-        datum = self.get_datum(name)
-        if datum is None:
-            raise KeyError(name)
-        if type(datum) is not Vector:
-            raise TypeError(f"{name} is not a point")
+    def get_datums(self, names: str | Iterable[str]) -> dict[str, Datum]:
+        """
+        Batch form of get_datum(). `names` is a list of names or a glob
+        pattern matched against the names of datums and aliases. Aliases
+        are resolved with one batch query per reference.
+
+        Raises KeyError if a listed name doesn't exist.
+        """
+        names = _expand_names(names, self.names())
+        datums: dict[str, Datum] = {}
+        by_ref: dict[str, list[str]] = {}
+
+        for name in names:
+            datum = self.datums.get(name)
+            if datum is None:
+                datum = self._resolved.get(name)
+                if datum is not None:
+                    resolution_stats.hits += 1
+
+            if datum is not None:
+                datums[name] = datum
+            elif name in self.aliases:
+                by_ref.setdefault(self.aliases[name][0], []).append(name)
+            else:
+                raise KeyError(name)
 
-        return datum
+        for refname, aliases in by_ref.items():
+            resolved = self.get_ref(refname).get_datums(
+                [self.aliases[name][1] for name in aliases])
 
-    def get_axis(self, name: str) -> Axis:
-        datum = self.get_datum(name)
-        if datum is None:
-            raise KeyError(name)
-        if type(datum) is not Axis:
-            raise TypeError(f"{name} is not an axis")
+            for name in aliases:
+                datums[name] = resolved[self.aliases[name][1]]
+                self._resolved[name] = datums[name]
+                resolution_stats.misses += 1
 
-        return datum
+        return {name: copy(datums[name]) for name in names}
 
-    def get_plane(self, name: str) -> Plane:
-        datum = self.get_datum(name)
-        if datum is None:
-            raise KeyError(name)
-        if type(datum) is not Plane:
-            raise TypeError(f"{name} is not a plane")
+    def get_points(self, names: str | Iterable[str]) -> dict[str, Vector]:
+        return {n: _check_datum_type(n, d, Vector, "a point")
+                for n, d in self.get_datums(names).items()}
 
-        return datum
+    def get_planes(self, names: str | Iterable[str]) -> dict[str, Plane]:
+        return {n: _check_datum_type(n, d, Plane, "a plane")
+                for n, d in self.get_datums(names).items()}
+
+    def names(self) -> list[str]:
+        """
+        Return the names of all datums and aliases in the set
+        """
+        return list(self.datums) + list(self.aliases)
+
+    def get_point(self, name: str) -> Vector:
+        return _check_datum_type(name, self.get_datum(name), Vector, "a point")
+
+    def get_axis(self, name: str) -> Axis:
+        return _check_datum_type(name, self.get_datum(name), Axis, "an axis")
+
+    def get_plane(self, name: str) -> Plane:
+        return _check_datum_type(name, self.get_datum(name), Plane, "a plane")
 
     def get_ref(self, name: str) -> DatumSetRef:
         return self.refs[name]
@@ -400,6 +752,8 @@ class DatumSet:
             "yz": Plane.YZ,
         }
 
+        box = np.array([origin_t, origin_t], dtype=float)
+
         for name_suffix in axis_mapping:
             name = f"{name_prefix}_{name_suffix}"
             index, coord, sign = axis_mapping[name_suffix]
@@ -416,6 +770,10 @@ class DatumSet:
             args[index] += offset
             self.add_plane(name, plane=plane, origin=Vector(*args))
 
+            box[0 if sign < 0 else 1, index] = args[index]
+
+        self.boxes[name_prefix] = box
+
     def box_dimension(self, name_prefix: str, axis: str) -> float:
         axis_mapping = {
             "x": ("left", "right"),
@@ -423,6 +781,11 @@ class DatumSet:
             "z": ("back", "front"),
         }
 
+        box = self.boxes.get(name_prefix)
+        if box is not None:
+            index = "xyz".index(axis)
+            return float(box[1, index] - box[0, index])
+
         side0, side1 = axis_mapping[axis]
         plane0 = self.get_plane(f"{name_prefix}_{side0}")
         plane1 = self.get_plane(f"{name_prefix}_{side1}")
@@ -432,6 +795,13 @@ class DatumSet:
 
     def box_point(self, name_prefix: str, align: VectorLike) -> Vector:
         align_t = tuple(align)
+
+        box = self.boxes.get(name_prefix)
+        if box is not None:
+            # Row 0 for -1, row 1 for +1, and the midpoint for 0
+            weights = (np.sign(align_t) + 1) / 2
+            return Vector(*(box[0] * (1 - weights) + box[1] * weights))
+
         out_t = [0, 0, 0]
         axis_mapping = (
             ("x", "left", "right"),
@@ -457,6 +827,170 @@ class DatumSet:
         return Vector(*out_t)
 
 
+# A query made through a TracingDatumSet: the path of the datum set (a
+# datum set name followed by reference names), method name and arguments
+DatumRead: TypeAlias = tuple[tuple[str, ...], str, tuple[Any, ...]]
+
+def _read_value(value: Any) -> Any:
+    if isinstance(value, (Vector, Axis, Plane)):
+        return datum_values(value)
+    if isinstance(value, Location):
+        return location_values(value)
+    if isinstance(value, DatumArrays):
+        value = value.to_datums()
+    if isinstance(value, dict):
+        return {k: _read_value(v) for k, v in value.items()}
+
+    return value
+
+class TracingDatumSet:
+    """
+    View of a DatumSet or DatumSetRef which records every query made
+    through it
+
+    Queries are recorded in a dict mapping each DatumRead to the
+    canonical form of its result. References are returned as tracing
+    views too. Use changed_datum_reads() to find out whether the results
+    are still the same for another set of datums.
+    """
+
+    __slots__ = ("_datums", "_path", "_reads")
+
+    _datums: "DatumSet | DatumSetRef"
+    _reads: dict[DatumRead, Any]
+    _path: tuple[str, ...]
+
+    def __init__(self,
+                 datums: "DatumSet | DatumSetRef",
+                 reads: dict[DatumRead, Any],
+                 path: tuple[str, ...]):
+        self._datums = datums
+        self._reads = reads
+        self._path = path
+
+    def _record(self, method: str, args: tuple[Any, ...], value: Any) -> Any:
+        self._reads[(self._path, method, args)] = canonical(_read_value(value))
+        return value
+
+    def _query(self, method: str, *args: Any) -> Any:
+        return self._record(method, args, getattr(self._datums, method)(*args))
+
+    def untraced(self) -> "DatumSet | DatumSetRef":
+        return self._datums
+
+    @property
+    def loc(self) -> Location:
+        # Only references have a location
+        loc = getattr(self._datums, "loc", None)
+        if loc is None:
+            raise AttributeError("loc")
+
+        return self._record("loc", (), loc)
+
+    def get_datum(self, name: str) -> Datum | None:
+        return self._query("get_datum", name)
+
+    def get_point(self, name: str) -> Vector:
+        return self._query("get_point", name)
+
+    def get_axis(self, name: str) -> Axis:
+        return self._query("get_axis", name)
+
+    def get_plane(self, name: str) -> Plane:
+        return self._query("get_plane", name)
+
+    def get_datums(self, names: str | Iterable[str]) -> dict[str, Datum]:
+        return self._query("get_datums", names if isinstance(names, str) else tuple(names))
+
+    def get_points(self, names: str | Iterable[str]) -> dict[str, Vector]:
+        return self._query("get_points", names if isinstance(names, str) else tuple(names))
+
+    def get_planes(self, names: str | Iterable[str]) -> dict[str, Plane]:
+        return self._query("get_planes", names if isinstance(names, str) else tuple(names))
+
+    def point(self, name: str) -> Vector:
+        return self._query("get_point", name)
+
+    def plane(self, name: str) -> Plane:
+        return self._query("get_plane", name)
+
+    def names(self) -> list[str]:
+        return self._query("names")
+
+    def arrays(self) -> DatumArrays:
+        return self._query("arrays")
+
+    def box_dimension(self, name_prefix: str, axis: str) -> float:
+        return self._query("box_dimension", name_prefix, axis)
+
+    def box_point(self, name_prefix: str, align: VectorLike) -> Vector:
+        return self._query("box_point", name_prefix, tuple(align))
+
+    def get_ref(self, name: str) -> "TracingDatumSet":
+        return TracingDatumSet(self._datums.get_ref(name), self._reads,
+                               self._path + (name,))
+
+    def __getattr__(self, name: str) -> Any:
+        # Don't record lookups of special methods, eg. by copy or pickle
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        datum = self.get_datum(name)
+        if datum is not None:
+            return datum
+
+        try:
+            return self.get_ref(name)
+        except KeyError:
+            raise AttributeError(name) from None
+
+def trace_datums(datums: dict[str, DatumSet],
+                 reads: dict[DatumRead, Any]) -> dict[str, TracingDatumSet]:
+    """
+    Return tracing views of datum sets, recording queries in `reads`
+    """
+    return {name: TracingDatumSet(ds, reads, (name,)) for name, ds in datums.items()}
+
+def changed_datum_reads(reads: dict[DatumRead, Any],
+                        datums: dict[str, DatumSet]) -> list[DatumRead]:
+    """
+    Return the recorded queries whose result is different (or which
+    fail) when repeated on `datums`
+    """
+
+    changed = []
+
+    for read, old in reads.items():
+        path, method, args = read
+        new: dict[DatumRead, Any] = {}
+
+        try:
+            target: DatumSet | DatumSetRef = datums[path[0]]
+            for name in path[1:]:
+                target = target.get_ref(name)
+
+            query = getattr(TracingDatumSet(target, new, path), method)
+            if method != "loc":
+                query(*args)
+        except (AttributeError, KeyError, TypeError, ValueError):
+            changed.append(read)
+            continue
+
+        if new[read] != old:
+            changed.append(read)
+
+    return changed
+
+def format_datum_read(read: DatumRead) -> str:
+    path, method, args = read
+    if method in ("get_datum", "get_point", "get_axis", "get_plane"):
+        return ".".join(path + args)
+    if method == "loc":
+        return ".".join(path) + ".loc"
+
+    return f"{'.'.join(path)}.{method}({', '.join(repr(a) for a in args)})"
+
+
 @dataclass
 class Object:
     # Name of the object for rendering and exporting
@@ -467,13 +1001,63 @@ class Object:
     datums: Optional[DatumSet] = None
     datums_xform: Location = dataclass_field(default_factory=Location)
 
-    # Control whether the object is used for rendering, exporting, or both.
-    # This is used for instanced objects like buttons which have only one
-    # model to export but need to appear multiple times for rendering.
-    renderable: bool = True
-    exportable: bool = True
-
     # Flag for manufacturable objects; false for render-only mockups.
     # Mockup objects are still exportable because they may be useful
     # to import to another CAD package.
     manufacturable: bool = True
+
+    # Named placements for objects which appear several times in the
+    # model, like buttons. The compound is then a master shape which is
+    # exported once, and rendered once per instance as a reference to
+    # the same geometry, so it is only tessellated once.
+    instances: dict[str, Location] = dataclass_field(default_factory=dict)
+
+    def placed(self) -> list[tuple[str, Compound]]:
+        """
+        Return the name and compound of each placed copy of the object
+        """
+        if self.compound is None:
+            return []
+        if not self.instances:
+            return [(self.name, self.compound)]
+
+        return [(name, located(self.compound, loc))
+                for name, loc in self.instances.items()]
+
+
+def compound_to_brep(compound: Compound) -> bytes:
+    """
+    Serialize a compound to binary BREP, eg. for handing it to another
+    process
+
+    Unlike text BREP, which rounds coordinates to 15 digits, binary BREP
+    stores them exactly, so a loaded copy tessellates to the same
+    triangles as the original. Triangulations aren't stored. Version 3
+    of the format is used, since reading later versions from a Python
+    stream fails for some shapes.
+    """
+    buf = io.BytesIO()
+    BinTools.Write_s(compound.wrapped, buf, False, False,
+                     BinTools_FormatVersion.BinTools_FormatVersion_VERSION_3)
+    return buf.getvalue()
+
+def compound_from_brep(data: bytes,
+                       color: tuple[float, ...] | None = None,
+                       label: str = "") -> Compound:
+    """
+    Load a compound serialized by compound_to_brep()
+
+    BREP does not carry colors or labels, so these can be passed in
+    separately to restore them.
+    """
+    shape = TopoDS_Shape()
+    BinTools.Read_s(shape, io.BytesIO(data))
+    if shape.IsNull():
+        raise ValueError("invalid BREP data")
+
+    compound = Compound.cast(shape)
+    compound.label = label
+    if color is not None:
+        compound.color = Color(*color)
+
+    return compound
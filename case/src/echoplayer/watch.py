@@ -0,0 +1,98 @@
+"""
+Rebuild the model when its source code changes
+
+Watch mode keeps build123d loaded between builds and reloads the model
+modules in place when any of their source files are modified. Parts are
+looked up in the part cache as usual, so only parts whose code, datums
+or parameters changed are rebuilt.
+"""
+
+import importlib
+import pathlib
+import sys
+import time
+import traceback
+from collections.abc import Callable
+
+# Modules reloaded on a change, in dependency order. Modules holding
+# state that must survive a rebuild (eg. profiling) are not reloaded.
+WATCHED_MODULES = ("params", "utils", "cache", "parts", "csg", "r1_rev1_params", "r1_rev1")
+
+# Editors often save in several steps, so wait for writes to settle
+SETTLE_TIME = 0.1
+
+
+def _module_name(name: str) -> str:
+    return f"{__name__.rpartition('.')[0]}.{name}"
+
+def source_files() -> list[pathlib.Path]:
+    files = []
+    for name in WATCHED_MODULES:
+        module = sys.modules.get(_module_name(name))
+        if module is not None and module.__file__ is not None:
+            files.append(pathlib.Path(module.__file__))
+
+    return files
+
+def _snapshot(files: list[pathlib.Path]) -> dict[pathlib.Path, float]:
+    mtimes = {}
+    for f in files:
+        try:
+            mtimes[f] = f.stat().st_mtime
+        except FileNotFoundError:
+            # Some editors replace files by deleting and renaming
+            mtimes[f] = 0
+
+    return mtimes
+
+def wait_for_change(files: list[pathlib.Path],
+                    interval: float = 0.5) -> list[pathlib.Path]:
+    """
+    Block until any of the files are modified and return the changed files
+    """
+
+    before = _snapshot(files)
+
+    while True:
+        time.sleep(interval)
+        after = _snapshot(files)
+        if after != before:
+            break
+
+    time.sleep(SETTLE_TIME)
+    after = _snapshot(files)
+
+    return [f for f in files if after[f] != before[f]]
+
+def reload_modules() -> None:
+    for name in WATCHED_MODULES:
+        module = sys.modules.get(_module_name(name))
+        if module is not None:
+            importlib.reload(module)
+
+def watch(rebuild: Callable[[], None], interval: float = 0.5) -> None:
+    """
+    Call rebuild() after reloading the model modules every time their
+    source changes, until interrupted. Errors in the model code are
+    reported without stopping the watch.
+    """
+
+    files = source_files()
+
+    try:
+        while True:
+            print(f"Watching {len(files)} files for changes (Ctrl-C to stop)...")
+            changed = wait_for_change(files, interval)
+            print(f"Changed: {', '.join(f.name for f in changed)}")
+
+            start = time.perf_counter()
+            try:
+                reload_modules()
+                rebuild()
+            except Exception: # noqa: BLE001
+                traceback.print_exc()
+                continue
+
+            print(f"Rebuilt in {time.perf_counter() - start:.2f}s")
+    except KeyboardInterrupt:
+        pass